@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Shared helpers for the benchmark suite: synthetic PDFs, timing statistics,
+peak-RSS probes and JSON result files
+"""
+
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_DIR = os.path.join(REPO_ROOT, 'server')
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+
+def make_pdf(pages, pad_bytes=0):
+    """Build a PDF with `pages` text pages, padded with incompressible data"""
+    import fitz
+
+    doc = fitz.open()
+    for number in range(1, pages + 1):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Chapter {number}", fontsize=20)
+        page.insert_text((72, 110), f"Synthetic benchmark page {number} of {pages}. " * 2, fontsize=9)
+    if pad_bytes:
+        # Random bytes don't compress, so the file really grows by pad_bytes
+        doc.embfile_add('padding.bin', os.urandom(pad_bytes))
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_bookmarks(count, pages):
+    """A bookmark list with a mix of levels spread over the document"""
+    bookmarks = []
+    for index in range(count):
+        level = 1 if index % 5 == 0 else 2
+        if index == 0:
+            level = 1
+        bookmarks.append({'title': f"Section {index + 1}", 'page': index % pages + 1, 'level': level})
+    return bookmarks
+
+
+def make_multipart(pdf_data, bookmarks, boundary='----BenchBoundary7MA4YWxkTrZu0gW'):
+    """Encode a browser-style multipart body; returns (body, content_type)"""
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="pdf"; filename="bench.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n').encode()
+    tail = b'\r\n'
+    if bookmarks is not None:
+        tail += (f'--{boundary}\r\nContent-Disposition: form-data; name="bookmarks"\r\n\r\n'
+                 f'{json.dumps(bookmarks)}\r\n').encode()
+    tail += f'--{boundary}--\r\n'.encode()
+    return head + pdf_data + tail, f'multipart/form-data; boundary={boundary}'
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(durations, payload_bytes, wall_seconds, concurrency=1):
+    """Throughput and latency percentiles for a list of per-operation seconds"""
+    count = len(durations)
+    return {
+        'iterations': count,
+        'concurrency': concurrency,
+        'ops_per_second': round(count / wall_seconds, 3) if wall_seconds else None,
+        'mb_per_second': round(payload_bytes * count / wall_seconds / 1e6, 3) if wall_seconds else None,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 3),
+        'mean_ms': round(sum(durations) / count * 1000, 3),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def process_hwm_mb(pid):
+    """VmHWM of another process (Linux only), or None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def reset_hwm(pid):
+    """Reset a process's VmHWM so the next case measures its own peak (Linux)"""
+    try:
+        with open(f'/proc/{pid}/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def child_pids(pid):
+    """Direct children of a process (Linux only)"""
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def timed(fn, iterations, max_seconds=None, warmup=1, min_iterations=3):
+    """Run fn repeatedly; returns (per-call seconds, wall seconds)
+
+    Stops early once max_seconds have passed (after min_iterations), so
+    large cases don't dominate the run time.
+    """
+    for _ in range(warmup):
+        fn()
+    durations = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        call_started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - call_started)
+        if (max_seconds and len(durations) >= min_iterations
+                and time.perf_counter() - started > max_seconds):
+            break
+    return durations, time.perf_counter() - started
+
+
+def environment():
+    """Describe the machine and library versions a run was made on"""
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    try:
+        import fitz
+        info['pymupdf'] = fitz.VersionBind
+    except ImportError:
+        info['pymupdf'] = None
+    return info
+
+
+def save_results(path, results):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+
+def compare_to_baseline(results, baseline, threshold=0.10):
+    """Print per-case deltas against a baseline run; returns regressed case names"""
+    previous = {case['name']: case for case in baseline.get('cases', [])}
+    regressions = []
+    print(f"\n{'case':<44} {'p50 ms':>18} {'ops/s':>20} {'peak MB':>16}")
+    for case in results['cases']:
+        old = previous.get(case['name'])
+        if old is None or 'error' in case or 'error' in old:
+            continue
+
+        def delta(key):
+            if not old.get(key) or case.get(key) is None:
+                return '', 0.0
+            change = (case[key] - old[key]) / old[key]
+            return f"{old[key]:>7} → {case[key]:<7} ({change:+.0%})", change
+
+        p50_text, p50_change = delta('p50_ms')
+        ops_text, ops_change = delta('ops_per_second')
+        rss_text, _ = delta('peak_rss_mb')
+        flag = ''
+        if p50_change > threshold or ops_change < -threshold:
+            regressions.append(case['name'])
+            flag = '  ⚠️ regression'
+        print(f"{case['name']:<44} {p50_text:>18} {ops_text:>20} {rss_text:>16}{flag}")
+    return regressions
@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the bookmark embedding pipeline
+
+Suites:
+    embed      embed_bookmarks() directly (the work add_bookmarks_to_pdf runs)
+    multipart  PDFBookmarkHandler.extract_pdf_from_multipart()
+    http       the full server over loopback
+    save       Document.tobytes() per output profile, with and without
+               linearization (the save cost on its own)
+    outline    20k-100k entry bookmark lists: incremental JSON parsing, the
+               outline engine (normalize + write) and plain set_toc()
+    engines    every installed embedding engine (PyMuPDF, pikepdf, pypdf,
+               pdfbookmarker) on the same documents; with --corpus, on the
+               PDFs of a directory instead of synthetic ones
+
+Each direct case runs in a fresh process so its peak RSS is its own.
+Results are written as JSON; pass --baseline to compare against an
+earlier run.
+
+--write-policy turns the engines suite into an engine policy: the fastest
+engine per bookmark count and size range, for ENGINE_POLICY_FILE.
+
+Examples:
+    python benchmarks/run_benchmarks.py --quick
+    python benchmarks/run_benchmarks.py --suite engines --corpus ~/pdfs --write-policy engine-policy.json
+    python benchmarks/run_benchmarks.py --suite embed --output before.json
+    python benchmarks/run_benchmarks.py --suite embed --baseline before.json
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bench_common import (REPO_ROOT, child_pids, compare_to_baseline, environment, make_bookmarks,
+                          make_multipart, make_pdf, peak_rss_mb, process_hwm_mb, reset_hwm,
+                          save_results, summarize, timed)
+
+SUITES = ('embed', 'multipart', 'http', 'save', 'outline', 'engines')
+SAVE_VARIANTS = [('fast', False), ('balanced', False), ('smallest', False), ('fast', True), ('balanced', True)]
+OUTLINE_VARIANTS = ('parse', 'engine', 'set_toc')
+OUTLINE_SIZES = (20000, 50000, 100000)
+
+
+def case_matrix(quick):
+    """Vary page count, file size and bookmark count one at a time around a base case"""
+    base = {'pages': 100, 'pad_mb': 0, 'bookmarks': 10}
+    pages = [10, 100] if quick else [10, 100, 1000]
+    pads = [0, 5] if quick else [0, 5, 50]
+    bookmarks = [10, 1000] if quick else [0, 10, 1000, 10000]
+
+    cases = []
+    for value in pages:
+        cases.append(dict(base, pages=value))
+    for value in pads:
+        cases.append(dict(base, pad_mb=value))
+    for value in bookmarks:
+        cases.append(dict(base, bookmarks=value))
+
+    unique = []
+    for case in cases:
+        if case not in unique:
+            unique.append(case)
+    return unique
+
+
+def corpus_cases(corpus):
+    """One case per PDF in a directory, with the suite's usual 10 bookmarks"""
+    names = sorted(name for name in os.listdir(corpus) if name.lower().endswith('.pdf'))
+    if not names:
+        raise SystemExit(f"No PDFs found in {corpus}")
+    return [{'corpus': os.path.join(corpus, name), 'bookmarks': 10} for name in names]
+
+
+def suite_cases(suite, cases, quick=False, corpus=None):
+    """The save suite runs every profile variant on the page-count and size cases;
+    the outline suite has its own large-outline cases; the engines suite runs
+    every installed engine on each case (or each corpus PDF)"""
+    if suite == 'engines':
+        from engines import available_engines
+        documents = corpus_cases(corpus) if corpus else [case for case in cases if case['bookmarks']]
+        return [dict(case, engine=engine) for case in documents for engine in available_engines()]
+    if suite == 'outline':
+        sizes = OUTLINE_SIZES[:1] if quick else OUTLINE_SIZES
+        return [{'pages': 1000, 'pad_mb': 0, 'bookmarks': count, 'variant': variant}
+                for count in sizes for variant in OUTLINE_VARIANTS]
+    if suite != 'save':
+        return cases
+    import pdf_embedder
+    variants = SAVE_VARIANTS
+    if pdf_embedder.pikepdf is None:
+        print("ℹ️ pikepdf is not installed; skipping linearized save variants")
+        variants = [variant for variant in variants if not variant[1]]
+    return [dict(case, profile=profile, linearize=linearize)
+            for case in cases if case['bookmarks'] == 10 for profile, linearize in variants]
+
+
+def case_name(suite, case):
+    if 'engine' in case:
+        suite = f"{suite}/{case['engine']}"
+    if 'corpus' in case:
+        return f"{suite}/{os.path.basename(case['corpus'])},bookmarks={case['bookmarks']}"
+    if 'profile' in case:
+        suite = f"{suite}/{case['profile']}" + ('+linear' if case['linearize'] else '')
+    if 'variant' in case:
+        suite = f"{suite}/{case['variant']}"
+    return f"{suite}/pages={case['pages']},size+{case['pad_mb']}MB,bookmarks={case['bookmarks']}"
+
+
+def fixture_path(fixture_dir, case):
+    """Generate (once) and return the PDF file for a case"""
+    if 'corpus' in case:
+        return case['corpus']
+    path = os.path.join(fixture_dir, f"bench-{case['pages']}p-{case['pad_mb']}mb.pdf")
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(make_pdf(case['pages'], case['pad_mb'] * 1024 * 1024))
+    return path
+
+
+def run_direct_case(suite, pdf_path, case, iterations, max_seconds, verify_level, profile=None):
+    """Child process: time one direct case and report its own peak RSS"""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    with open(pdf_path, 'rb') as f:
+        pdf_data = f.read()
+    pages = case.get('pages')
+    if pages is None:
+        import fitz
+        with fitz.open(stream=pdf_data, filetype='pdf') as doc:
+            pages = doc.page_count
+    bookmarks = make_bookmarks(case['bookmarks'], pages) if case['bookmarks'] else None
+    rss_before = peak_rss_mb()
+
+    if suite == 'engines':
+        from engines import embed_document
+
+        def operation():
+            return embed_document(pdf_data, bookmarks, verify_level, profile, engine=case['engine'])[0]
+        payload = len(pdf_data)
+    elif suite == 'embed':
+        from pdf_embedder import embed_bookmarks
+
+        def operation():
+            return embed_bookmarks(pdf_data, bookmarks, verify_level, profile)[0]
+        payload = len(pdf_data)
+    elif suite == 'save':
+        import fitz
+        from pdf_embedder import OUTPUT_PROFILES, build_toc, linearize_pdf
+
+        doc = fitz.open(stream=pdf_data, filetype='pdf')
+        doc.set_toc(build_toc(doc.page_count, bookmarks)[0])
+        options = OUTPUT_PROFILES[case['profile']]
+
+        def operation():
+            pdf_bytes = doc.tobytes(**options)
+            return linearize_pdf(pdf_bytes) if case['linearize'] else pdf_bytes
+        payload = len(pdf_data)
+    elif suite == 'outline':
+        payload = len(json.dumps(bookmarks).encode('utf-8'))
+        if case['variant'] == 'parse':
+            from multipart_stream import CHUNK_SIZE, JSONArrayStream
+            encoded = json.dumps(bookmarks).encode('utf-8')
+
+            def operation():
+                stream = JSONArrayStream()
+                for offset in range(0, len(encoded), CHUNK_SIZE):
+                    stream.feed(encoded[offset:offset + CHUNK_SIZE])
+                return stream.close()
+        else:
+            import fitz
+            from outline import write_outline
+            from pdf_embedder import build_toc
+
+            def operation():
+                # A fresh document each time: rewriting one outline over and over grows the xref table
+                doc = fitz.open(stream=pdf_data, filetype='pdf')
+                toc, _ = build_toc(doc.page_count, bookmarks)
+                if case['variant'] == 'engine':
+                    write_outline(doc, toc)
+                else:
+                    doc.set_toc(toc)
+                doc.close()
+    else:
+        from bookmark_server_clean import PDFBookmarkHandler
+
+        body, content_type = make_multipart(pdf_data, bookmarks)
+        del pdf_data
+        handler = PDFBookmarkHandler.__new__(PDFBookmarkHandler)
+
+        def operation():
+            handler.extract_pdf_from_multipart(body, content_type)
+        payload = len(body)
+
+    durations, wall = timed(operation, iterations, max_seconds)
+    result = summarize(durations, payload, wall)
+    result.update(input_bytes=payload, rss_before_mb=rss_before, peak_rss_mb=peak_rss_mb(), page_count=pages)
+    if suite in ('embed', 'save', 'engines'):
+        result['output_bytes'] = len(operation())
+    return result
+
+
+def derive_policy(cases, default='pymupdf'):
+    """Fold the engines suite into ENGINE_POLICY_FILE rules
+
+    For each document the lossless engine with the lowest p50 wins
+    (pdfbookmarker drops attachments and forms, so it never does). Documents are
+    grouped by bookmark count and ordered by size; each run of documents
+    won by the same engine (other than the default) becomes one rule whose
+    size range reaches halfway to the neighbouring documents.
+    """
+    from engines import ENGINES
+
+    winners = {}
+    for case in cases:
+        if case.get('suite') != 'engines' or 'error' in case or not ENGINES[case['engine']].lossless:
+            continue
+        key = (case['bookmarks'], case['input_bytes'])
+        if key not in winners or case['p50_ms'] < winners[key]['p50_ms']:
+            winners[key] = case
+
+    rules = []
+    tiers = sorted({bookmarks for bookmarks, _ in winners})
+    for tier_index, bookmarks in enumerate(tiers):
+        sizes = sorted(size for count, size in winners if count == bookmarks)
+        runs = []  # [engine, first index, last index]
+        for index, size in enumerate(sizes):
+            engine = winners[(bookmarks, size)]['engine']
+            if runs and runs[-1][0] == engine:
+                runs[-1][2] = index
+            else:
+                runs.append([engine, index, index])
+        for engine, first, last in runs:
+            if engine == default:
+                continue
+            rule = {'engine': engine, 'max_bookmarks': bookmarks}
+            if tier_index:
+                rule['min_bookmarks'] = tiers[tier_index - 1] + 1
+            if first:
+                rule['min_bytes'] = (sizes[first - 1] + sizes[first]) // 2 + 1
+            if last < len(sizes) - 1:
+                rule['max_bytes'] = (sizes[last] + sizes[last + 1]) // 2
+            rules.append(rule)
+    return {'default': default, 'rules': rules}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, workers):
+    """Start bookmark_server_clean.py with caching disabled and wait for /health"""
+    env = dict(os.environ, PORT=str(port), LOG_LEVEL='WARNING', RESULT_CACHE_MEMORY_BYTES='0',
+               RESULT_CACHE_DIR='')
+    if workers is not None:
+        env['PDF_WORKERS'] = str(workers)
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'server', 'bookmark_server_clean.py')],
+                               env=env, cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/health')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Server did not become healthy within 30 s")
+
+
+def post_once(port, body, content_type):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    started = time.perf_counter()
+    connection.request('POST', '/embed-bookmarks', body=body,
+                       headers={'Content-Type': content_type, 'Content-Length': str(len(body))})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"HTTP {response.status}")
+    return time.perf_counter() - started
+
+
+def run_http_case(server, port, pdf_path, case, iterations, max_seconds, concurrency):
+    with open(pdf_path, 'rb') as f:
+        pdf_data = f.read()
+    bookmarks = make_bookmarks(case['bookmarks'], case['pages']) if case['bookmarks'] else None
+    body, content_type = make_multipart(pdf_data, bookmarks)
+    post_once(port, body, content_type)  # warm up the worker pool
+
+    processes = [server.pid] + child_pids(server.pid)
+    for pid in processes:
+        reset_hwm(pid)
+
+    durations = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def worker():
+        while True:
+            with lock:
+                if len(durations) >= iterations or (
+                        max_seconds and len(durations) >= 3 and time.perf_counter() - started > max_seconds):
+                    return
+                durations.append(None)
+                slot = len(durations) - 1
+            elapsed = post_once(port, body, content_type)
+            with lock:
+                durations[slot] = elapsed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    result = summarize([d for d in durations if d is not None], len(body), wall, concurrency)
+    hwm = [process_hwm_mb(pid) for pid in [server.pid] + child_pids(server.pid)]
+    result.update(input_bytes=len(body), peak_rss_mb=hwm[0],
+                  worker_peak_rss_mb=max([value for value in hwm[1:] if value] or [None]) if len(hwm) > 1 else None)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bookmark embedding pipeline")
+    parser.add_argument('--suite', action='append', choices=SUITES, help="Suite to run (repeatable, default: all)")
+    parser.add_argument('--quick', action='store_true', help="Smaller matrix for a fast smoke run")
+    parser.add_argument('--iterations', type=int, default=20, help="Iterations per case (default 20)")
+    parser.add_argument('--max-seconds', type=float, default=20, help="Time budget per case (default 20)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Parallel clients for the http suite")
+    parser.add_argument('--workers', type=int, help="PDF_WORKERS for the http suite server")
+    parser.add_argument('--verify', default='outline-only', help="Verification level for the embed suite")
+    parser.add_argument('--profile', help="Output profile for the embed suite (fast, balanced, smallest)")
+    parser.add_argument('--corpus', help="Directory of PDFs for the engines suite (default: synthetic documents)")
+    parser.add_argument('--write-policy', help="Write an engine policy derived from the engines suite to this path")
+    parser.add_argument('--output', help="Result JSON path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--baseline', help="Earlier result JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="Regression threshold (default 0.10)")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit 1 if any case regressed")
+    args = parser.parse_args(argv)
+
+    suites = args.suite or list(SUITES)
+    iterations = 5 if args.quick and args.iterations == 20 else args.iterations
+    cases = case_matrix(args.quick)
+    results = {'environment': environment(), 'config': vars(args), 'cases': []}
+
+    fixture_dir = tempfile.mkdtemp(prefix='pdfbookmark-bench-')
+    spawn = multiprocessing.get_context('spawn')
+
+    for suite in suites:
+        server = None
+        port = None
+        if suite == 'http':
+            port = free_port()
+            server = start_server(port, args.workers)
+        try:
+            for case in suite_cases(suite, cases, args.quick, args.corpus):
+                name = case_name(suite, case)
+                print(f"⏱️ {name} ...", end=' ', flush=True)
+                pdf_path = fixture_path(fixture_dir, case)
+                try:
+                    if suite == 'http':
+                        result = run_http_case(server, port, pdf_path, case, iterations,
+                                               args.max_seconds, args.concurrency)
+                    else:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                            result = executor.submit(run_direct_case, suite, pdf_path, case, iterations,
+                                                     args.max_seconds, args.verify, args.profile).result()
+                    print(f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, "
+                          f"{result['ops_per_second']} ops/s, peak {result['peak_rss_mb']} MB")
+                except Exception as e:
+                    result = {'error': f"{type(e).__name__}: {e}"}
+                    print(f"❌ {result['error']}")
+                result.update(name=name, suite=suite, **case)
+                results['cases'].append(result)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+    output = args.output
+    if not output:
+        os.makedirs(os.path.join(REPO_ROOT, 'benchmarks', 'results'), exist_ok=True)
+        output = os.path.join(REPO_ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    save_results(output, results)
+    print(f"\n📄 Results written to {output}")
+
+    if args.write_policy:
+        policy = derive_policy(results['cases'])
+        save_results(args.write_policy, policy)
+        print(f"⚙️ Engine policy ({len(policy['rules'])} rule(s)) written to {args.write_policy}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_to_baseline(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+            if args.fail_on_regression:
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,7 +4,7 @@ Simple test script that just starts the server and shows debug output
 """
 import sys
 import os
-sys.path.append('/Users/xeno/webdev/pdfbookmark/server')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server'))
 
 # Import our server
 from bookmark_server_clean import PDFBookmarkHandler
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Admission control
+Rejects uploads that are too large or would overrun the memory budget
+before their body is read, and bounds how many PyMuPDF jobs run or wait
+at once, so overload turns into fast 413/503 responses instead of an
+OOM kill
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from metrics import REGISTRY
+from multipart_stream import LARGE_DOCUMENT_BYTES
+from structured_log import get_logger
+from worker_pool import pool_size_from_env
+
+logger = get_logger('admission')
+
+REJECTIONS = REGISTRY.counter(
+    'pdfbookmark_admission_rejected_total', 'Requests refused by admission control', ('reason',))
+
+
+class AdmissionRejected(Exception):
+    """A request refused by admission control; ``status`` is 413 or 503"""
+
+    def __init__(self, status, reason, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def headers(self):
+        return {'Retry-After': str(self.retry_after)} if self.retry_after else {}
+
+    def to_json(self):
+        return {'success': False, 'error': str(self), 'reason': self.reason}
+
+
+class Reservation:
+    """Bytes held against the memory budget until release() (idempotent)"""
+
+    def __init__(self, controller, size):
+        self.controller = controller
+        self.size = size
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release_memory(self.size)
+
+
+class AdmissionController:
+    """Body-size limit, memory budget and bounded job queue
+
+    ``admit`` is called with the declared request size before the body is
+    read; bodies without a Content-Length (chunked) reserve the maximum
+    body size. Documents over ``large_document_bytes`` are spooled to disk
+    and processed from there, so no body reserves more than that. ``run_job`` wraps each PyMuPDF job: at most
+    ``max_concurrent_jobs`` run and ``max_queued_jobs`` wait, anything
+    beyond that is refused.
+    """
+
+    def __init__(self, max_body_bytes=2 * 1024 * 1024 * 1024, memory_budget=1024 * 1024 * 1024,
+                 max_concurrent_jobs=None, max_queued_jobs=None, retry_after=5,
+                 large_document_bytes=LARGE_DOCUMENT_BYTES):
+        self.max_body_bytes = max_body_bytes
+        self.large_document_bytes = large_document_bytes
+        self.memory_budget = memory_budget
+        self.max_concurrent_jobs = max_concurrent_jobs or pool_size_from_env() or os.cpu_count() or 1
+        self.max_queued_jobs = 4 * self.max_concurrent_jobs if max_queued_jobs is None else max_queued_jobs
+        self.retry_after = retry_after
+        self.reserved_bytes = 0
+        self.running_jobs = 0
+        self.queued_jobs = 0
+        self.rejected = 0
+        self._lock = threading.Condition()
+        self._release_listeners = []
+
+    @classmethod
+    def from_env(cls):
+        """Configure from MAX_BODY_BYTES, ADMISSION_MEMORY_BYTES, MAX_CONCURRENT_JOBS,
+        MAX_QUEUED_JOBS and RETRY_AFTER_SECONDS"""
+        queued = os.environ.get('MAX_QUEUED_JOBS')
+        return cls(
+            max_body_bytes=int(os.environ.get('MAX_BODY_BYTES', 2 * 1024 * 1024 * 1024)),
+            memory_budget=int(os.environ.get('ADMISSION_MEMORY_BYTES', 1024 * 1024 * 1024)),
+            max_concurrent_jobs=int(os.environ.get('MAX_CONCURRENT_JOBS', 0)) or None,
+            max_queued_jobs=int(queued) if queued else None,
+            retry_after=int(os.environ.get('RETRY_AFTER_SECONDS', 5)),
+        )
+
+    def _reject(self, status, reason, message, retry_after=None):
+        with self._lock:
+            self.rejected += 1
+        REJECTIONS.inc(reason)
+        logger.warning("🚫 %s", message)
+        raise AdmissionRejected(status, reason, message, retry_after)
+
+    def admit(self, content_length):
+        """Reserve memory for a body of the declared size (None = chunked)
+
+        Raises AdmissionRejected; returns a Reservation to release once the
+        request is finished.
+        """
+        if content_length is not None and content_length > self.max_body_bytes:
+            self._reject(413, 'body_too_large',
+                         f"Request body of {content_length} bytes exceeds the {self.max_body_bytes} byte limit")
+        size = min(self.max_body_bytes if content_length is None else content_length, self.large_document_bytes)
+        with self._lock:
+            # A single request larger than the whole budget is let through when it would run alone
+            fits = self.reserved_bytes + size <= self.memory_budget or self.reserved_bytes == 0
+            if fits:
+                self.reserved_bytes += size
+        if not fits:
+            self._reject(503, 'memory_budget',
+                         f"Upload memory budget exhausted ({self.reserved_bytes} of {self.memory_budget} bytes reserved)",
+                         self.retry_after)
+        return Reservation(self, size)
+
+    def hold(self, size):
+        """Count bytes that outlive their request (e.g. a queued job's input) against the budget"""
+        with self._lock:
+            self.reserved_bytes += size
+        return Reservation(self, size)
+
+    def _release_memory(self, size):
+        with self._lock:
+            self.reserved_bytes -= size
+
+    def acquire_job(self, wait_when_full=False):
+        """Take a job slot, waiting in the bounded queue if all slots are busy
+
+        With ``wait_when_full`` the caller waits even if the queue is full
+        (used for the files of an already admitted batch).
+        """
+        with self._lock:
+            busy = self.running_jobs >= self.max_concurrent_jobs
+            if not busy or wait_when_full or self.queued_jobs < self.max_queued_jobs:
+                self.queued_jobs += 1
+                try:
+                    while self.running_jobs >= self.max_concurrent_jobs:
+                        self._lock.wait()
+                finally:
+                    self.queued_jobs -= 1
+                self.running_jobs += 1
+                return
+        self._reject(503, 'queue_full',
+                     f"Embedding queue is full ({self.max_queued_jobs} jobs waiting)", self.retry_after)
+
+    def try_acquire_job(self):
+        """Take a job slot only if one is free right now and nobody is waiting"""
+        with self._lock:
+            if self.running_jobs >= self.max_concurrent_jobs or self.queued_jobs:
+                return False
+            self.running_jobs += 1
+            return True
+
+    def release_job(self):
+        with self._lock:
+            self.running_jobs -= 1
+            self._lock.notify()
+            listeners = list(self._release_listeners)
+        for listener in listeners:
+            listener()
+
+    def on_release(self, listener):
+        """Call listener() whenever a job slot is released"""
+        with self._lock:
+            self._release_listeners.append(listener)
+
+    def run_job(self, pool, fn, *args, **kwargs):
+        """pool.run(fn, ...) inside a job slot"""
+        self.acquire_job()
+        try:
+            return pool.run(fn, *args, **kwargs)
+        finally:
+            self.release_job()
+
+    def stats(self):
+        """Limits and current usage for /health"""
+        with self._lock:
+            return {
+                'max_body_bytes': self.max_body_bytes,
+                'memory_budget': self.memory_budget,
+                'reserved_bytes': self.reserved_bytes,
+                'max_concurrent_jobs': self.max_concurrent_jobs,
+                'running_jobs': self.running_jobs,
+                'max_queued_jobs': self.max_queued_jobs,
+                'queued_jobs': self.queued_jobs,
+                'rejected': self.rejected,
+            }
+
+
+def run_in_job_slots(admission, pool, fn, tasks, held_slots=0, wait_when_full=False, max_in_flight=None,
+                     on_result=None):
+    """Run fn(*task) for each task across the pool, one job slot per task in flight
+
+    ``held_slots`` slots are already held by the caller; without any, the
+    first is taken with acquire_job(wait_when_full). Further slots are only
+    taken while free, never waited for, and are handed back as their task
+    finishes, so a fan-out never holds a slot while waiting for another.
+    Without an admission controller up to ``max_in_flight`` tasks run at
+    once (default: all). ``on_result`` is called with each result in task
+    order as soon as it and the ones before it are done. Returns the
+    results in task order.
+    """
+    pending = deque(enumerate(tasks))
+    results = [None] * len(pending)
+    limit = max_in_flight or len(pending)
+    base = max(held_slots, 1)
+    held = held_slots
+    taken = 0
+    if admission is not None and held == 0 and pending:
+        admission.acquire_job(wait_when_full=wait_when_full)
+        held = taken = 1
+    in_flight = {}
+    ready = set()
+    position = 0
+    try:
+        while position < len(results):
+            while pending and len(in_flight) < limit:
+                if admission is not None and len(in_flight) >= held:
+                    if not admission.try_acquire_job():
+                        break
+                    held += 1
+                    taken += 1
+                number, args = pending.popleft()
+                in_flight[pool.submit(fn, *args)] = number
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                number = in_flight.pop(future)
+                if admission is not None and held > base:
+                    admission.release_job()
+                    held -= 1
+                    taken -= 1
+                results[number] = future.result()
+                ready.add(number)
+            while position in ready:
+                if on_result is not None:
+                    on_result(results[position])
+                position += 1
+    finally:
+        for future in in_flight:
+            future.cancel()
+        for _ in range(taken):
+            admission.release_job()
+    return results
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission():
+    """Return the process-wide admission controller, creating it on first use"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController.from_env()
+        return _controller
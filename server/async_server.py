@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP/1.1 front end
+Connections, request heads and request bodies are handled on one event
+loop; a BaseHTTPRequestHandler subclass only gets an executor thread once
+a complete request has arrived, so idle keep-alive connections and slow
+uploads cost a coroutine instead of a thread. Responses are written back
+through the loop with drain(), which throttles the handler thread to the
+client's pace.
+
+shutdown() stops accepting connections; serve_forever() returns once the
+requests in progress have been answered, or after ``graceful_timeout``.
+"""
+
+import asyncio
+import http.client
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from admission import AdmissionRejected
+from multipart_stream import CHUNK_SIZE, SPOOL_THRESHOLD
+from structured_log import get_logger
+
+logger = get_logger('async')
+
+MAX_HEAD_SIZE = 64 * 1024
+IDLE_TIMEOUT = float(os.environ.get('KEEPALIVE_TIMEOUT', 75))
+HANDLER_THREADS = int(os.environ.get('ASYNC_HANDLER_THREADS', 64))
+
+
+class RequestError(Exception):
+    """A request that cannot be framed; answered with ``status`` and closed"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RequestReader:
+    """Blocking rfile for the handler thread: the request head, then the spooled body"""
+
+    def __init__(self, head, body):
+        self._head = io.BytesIO(head)
+        self._body = body
+
+    def read(self, size=-1):
+        data = self._head.read(size)
+        if size is None or size < 0:
+            return data + self._body.read()
+        if len(data) < size:
+            data += self._body.read(size - len(data))
+        return data
+
+    def readline(self, limit=-1):
+        line = self._head.readline(limit)
+        if line.endswith(b'\n') or (limit is not None and 0 <= limit <= len(line)):
+            return line
+        rest = limit - len(line) if limit is not None and limit >= 0 else -1
+        return line + self._body.readline(rest)
+
+    def close(self):
+        self._body.close()
+
+
+class ResponseWriter:
+    """Blocking wfile for the handler thread; every write waits for drain()
+
+    After the headers of a response without Content-Length, ``chunked``
+    is switched on and each write becomes one chunk.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.chunked = False
+        self.aborted = False
+
+    def _call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def _write(self, pieces):
+        self.writer.writelines(pieces)
+        await self.writer.drain()
+
+    def write(self, data):
+        if not data:
+            return 0
+        if self.chunked:
+            pieces = [b'%x\r\n' % len(data), data, b'\r\n']
+        else:
+            pieces = [data]
+        self._call(self._write(pieces))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def sendfile(self, file, offset=0, count=None):
+        """Copy an open file, or count bytes of it from offset, to the client
+
+        Uses os.sendfile where the transport allows.
+        """
+        if self.chunked:
+            file.seek(offset)
+            remaining = count
+            while remaining is None or remaining > 0:
+                data = file.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                if not data:
+                    return
+                self.write(data)
+                if remaining is not None:
+                    remaining -= len(data)
+            return
+        self._call(self.loop.sendfile(self.writer.transport, file, offset, count))
+
+    def finish(self):
+        """Terminate a chunked body; skipped when the response was abandoned"""
+        if self.chunked and not self.aborted:
+            self._call(self._write([b'0\r\n\r\n']))
+        self.chunked = False
+
+
+class AsyncHandlerMixin:
+    """Adapts a BaseHTTPRequestHandler to run one request at a time for AsyncHTTPServer
+
+    Bodies without a declared length are sent chunked to HTTP/1.1 clients
+    (or ended by closing the connection for HTTP/1.0), so every response
+    can be followed by another request on the same connection.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_response_only(self, code, message=None):
+        self.response_code = int(code)
+        self.response_framed = False
+        super().send_response_only(code, message)
+
+    def send_header(self, keyword, value):
+        if keyword.lower() in ('content-length', 'transfer-encoding'):
+            self.response_framed = True
+        super().send_header(keyword, value)
+
+    def end_headers(self):
+        code = getattr(self, 'response_code', 200)
+        needs_framing = (code >= 200 and code not in (HTTPStatus.NO_CONTENT, HTTPStatus.NOT_MODIFIED)
+                         and self.command != 'HEAD' and not getattr(self, 'response_framed', False))
+        chunked = needs_framing and self.request_version == 'HTTP/1.1'
+        if chunked:
+            super().send_header('Transfer-Encoding', 'chunked')
+        elif needs_framing:
+            super().send_header('Connection', 'close')
+        super().end_headers()
+        self.response_framed = True
+        if chunked:
+            self.wfile.chunked = True
+
+    def handle_expect_100(self):
+        # The event loop already answered 100 Continue before reading the body
+        return True
+
+    def body_is_chunked(self):
+        return 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+
+    def send_file_body(self, file, offset=0, count=None):
+        self.wfile.sendfile(file, offset, count)
+
+    def abort_response(self):
+        self.wfile.aborted = True
+        super().abort_response()
+
+
+def parse_head(head):
+    """Return (request_version, headers) from a raw request head"""
+    request_line, _, rest = head.partition(b'\r\n')
+    words = request_line.decode('iso-8859-1').split()
+    version = words[2] if len(words) == 3 else 'HTTP/0.9'
+    try:
+        headers = http.client.parse_headers(io.BytesIO(rest))
+    except http.client.HTTPException as e:
+        raise RequestError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, str(e))
+    return version, headers
+
+
+class AsyncHTTPServer:
+    """HTTP/1.1 server: asyncio for the connections, a thread pool for handlers
+
+    The handler class must include AsyncHandlerMixin. ``serve_forever`` and
+    ``server_close`` mirror socketserver so callers can swap front ends.
+    With an ``admission`` controller, requests with a body are admitted
+    (or refused with 413/503) before the body is read. ``on_ready`` is
+    called once the socket is listening. ``sock`` is an already listening
+    socket to accept on instead of binding server_address.
+    """
+
+    def __init__(self, server_address, handler_class, threads=None, idle_timeout=None, admission=None,
+                 sock=None, graceful_timeout=30):
+        self.server_address = server_address
+        self.sock = sock
+        self.graceful_timeout = graceful_timeout
+        self.handler_class = handler_class
+        self.admission = admission
+        self.idle_timeout = IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads or HANDLER_THREADS,
+                                           thread_name_prefix='handler')
+        self.connections = 0
+        self.busy = 0  # requests between a complete head and the end of their response
+        self.draining = False
+        self._loop = None
+        self._server = None
+        self._stop = None
+        self.on_ready = None
+
+    async def serve(self):
+        """Accept connections until shutdown(), then let the requests in progress finish"""
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        if self.sock is not None:
+            self._server = await asyncio.start_server(self.handle_connection, sock=self.sock, limit=MAX_HEAD_SIZE)
+        else:
+            host, port = self.server_address
+            self._server = await asyncio.start_server(self.handle_connection, host or None, port,
+                                                      limit=MAX_HEAD_SIZE)
+        if self.on_ready is not None:
+            self.on_ready()
+        await self._stop.wait()
+        self._server.close()
+        self.draining = True
+        deadline = self._loop.time() + self.graceful_timeout
+        while self.busy and self._loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        if self.busy:
+            logger.warning("⚠️ Stopped with %d request(s) still in progress", self.busy)
+        # Idle keep-alive connections are cancelled when the loop ends
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    def shutdown(self):
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    def server_close(self):
+        self.executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send_error(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                    break
+
+                reservation = None
+                self.busy += 1
+                try:
+                    version, headers = parse_head(head)
+                    reservation = self.admit(headers)
+                    body = await self.read_body(reader, writer, version, headers)
+                    keep_open = await self._loop.run_in_executor(
+                        self.executor, self.run_handler, head, body, peer, writer, reservation)
+                except AdmissionRejected as e:
+                    await self.send_error(writer, e.status, json.dumps(e.to_json()).encode('utf-8'),
+                                          'application/json', e.headers())
+                    break
+                except RequestError as e:
+                    logger.warning("%s - %s", peer[0], e)
+                    await self.send_error(writer, e.status)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                finally:
+                    self.busy -= 1
+                    if reservation is not None:
+                        reservation.release()
+                if not keep_open or self.draining:
+                    break
+        finally:
+            self.connections -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    def admit(self, headers):
+        """Reserve admission for a request body from its declared size; None if there is no body"""
+        chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        length = headers.get('Content-Length')
+        if self.admission is None or (not chunked and not length):
+            return None
+        try:
+            return self.admission.admit(None if chunked else int(length))
+        except ValueError:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Bad Content-Length: {length!r}")
+
+    async def read_body(self, reader, writer, version, headers):
+        """Receive the whole request body into a spool before a thread is involved"""
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_THRESHOLD)
+        chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        length_header = headers.get('Content-Length')
+        if not chunked and not length_header:
+            return spool
+        try:
+            length = None if chunked else int(length_header)
+        except ValueError:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Bad Content-Length: {length_header!r}")
+        if length is not None and length < 0:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Bad Content-Length: {length_header!r}")
+
+        if (headers.get('Expect', '').lower() == '100-continue' and version >= 'HTTP/1.1'):
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await writer.drain()
+
+        if chunked:
+            limit = self.admission.max_body_bytes if self.admission is not None else None
+            await self._read_chunked(reader, spool, limit)
+        else:
+            await self._copy(reader, spool, length)
+        spool.seek(0)
+        return spool
+
+    async def _copy(self, reader, spool, length):
+        while length > 0:
+            data = await asyncio.wait_for(reader.read(min(CHUNK_SIZE, length)), self.idle_timeout)
+            if not data:
+                raise asyncio.IncompleteReadError(b'', length)
+            spool.write(data)
+            length -= len(data)
+
+    async def _read_chunked(self, reader, spool, limit=None):
+        total = 0
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise RequestError(HTTPStatus.BAD_REQUEST, f"Bad chunk size line: {line[:40]!r}")
+            if size == 0:
+                # Skip any trailer fields up to the closing blank line
+                while (await asyncio.wait_for(reader.readline(), self.idle_timeout)) not in (b'\r\n', b'\n', b''):
+                    pass
+                return
+            total += size
+            if limit is not None and total > limit:
+                raise RequestError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                   f"Chunked request body exceeds the {limit} byte limit")
+            await self._copy(reader, spool, size)
+            await asyncio.wait_for(reader.readexactly(2), self.idle_timeout)
+
+    async def send_error(self, writer, status, body=None, content_type='text/plain', headers=None):
+        """Answer a request the handler never saw; the connection is closed afterwards"""
+        status = HTTPStatus(status)
+        if body is None:
+            body = f"{status.value} {status.phrase}\n".encode('ascii')
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Type: {content_type}",
+                 f"Content-Length: {len(body)}", "Connection: close",
+                 "Access-Control-Allow-Origin: *"]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def run_handler(self, head, body, peer, writer, reservation=None):
+        """Executor thread: run one request through the handler; True to keep the connection"""
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.admission_ticket = reservation
+        handler.server = self
+        handler.client_address = peer
+        handler.request = handler.connection = None
+        handler.rfile = RequestReader(head, body)
+        handler.wfile = ResponseWriter(self._loop, writer)
+        handler.close_connection = True
+        try:
+            handler.handle_one_request()
+            handler.wfile.finish()
+        except (ConnectionError, OSError) as e:
+            logger.debug("%s - connection lost: %s", peer[0], e)
+            return False
+        except Exception as e:
+            logger.error("❌ Unhandled error for %s: %s", peer[0], e, exc_info=True)
+            return False
+        finally:
+            handler.rfile.close()
+        return not handler.close_connection
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Automatic outline from heading typography
+Scans the text lines of each page, finds the body text size from the
+character counts and turns larger or bold short lines into a hierarchical
+bookmark list. Page ranges are scanned in the worker pool and the result
+is cached per document hash.
+"""
+
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+
+from admission import get_admission, run_in_job_slots
+from lazy_import import lazy_module
+from structured_log import get_logger
+from worker_pool import get_pool
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+logger = get_logger('auto_outline')
+
+# pages: the fixed "Page 1/3/6" bookmarks; auto: detect headings
+OUTLINE_MODES = ('pages', 'auto')
+DEFAULT_OUTLINE_MODE = os.environ.get('PDF_OUTLINE_MODE', 'pages')
+
+MAX_LEVELS = 3
+MAX_HEADING_CHARS = 120
+# A heading style is at least this much larger than body text, or bold
+HEADING_SIZE_RATIO = 1.08
+# Styles carrying more than this share of all characters are body text
+MAX_HEADING_CHAR_SHARE = 0.2
+# Styles with more lines than this per page are not headings
+MAX_HEADING_LINES_PER_PAGE = 3
+# Text repeated on more than this share of pages is a running header or footer
+RUNNING_TEXT_PAGE_SHARE = 0.1
+
+BOLD_FLAG = 16
+
+
+def normalize_outline_mode(mode):
+    """Validate an outline mode, falling back to the deployment default"""
+    if not mode:
+        mode = DEFAULT_OUTLINE_MODE
+    mode = mode.strip().lower()
+    if mode not in OUTLINE_MODES:
+        raise ValueError(f"Unknown outline mode '{mode}' (expected one of {', '.join(OUTLINE_MODES)})")
+    return mode
+
+
+def scan_doc_pages(doc, start, stop):
+    """Collect the text lines of pages [start, stop) of an open document
+
+    Returns (lines, chars): lines are (page, size, bold, block, text) with
+    page numbers starting at 1; chars counts characters per (size, bold).
+    Only lines short enough to be headings are kept.
+    """
+    lines = []
+    chars = Counter()
+    for pno in range(start, stop):
+        blocks = doc[pno].get_text('dict', flags=0)['blocks']
+        for block_no, block in enumerate(blocks):
+            for line in block.get('lines', ()):
+                spans = [span for span in line['spans'] if span['text'].strip()]
+                if not spans:
+                    continue
+                bold = True
+                size = 0
+                length = 0
+                for span in spans:
+                    span_bold = bool(span['flags'] & BOLD_FLAG) or 'bold' in span['font'].lower()
+                    span_size = round(span['size'] * 2) / 2
+                    span_chars = len(span['text'].strip())
+                    chars[(span_size, span_bold)] += span_chars
+                    bold = bold and span_bold
+                    size = max(size, span_size)
+                    length += span_chars
+                if length <= MAX_HEADING_CHARS:
+                    text = ' '.join(''.join(span['text'] for span in line['spans']).split())
+                    lines.append((pno + 1, size, bold, block_no, text))
+    return lines, chars
+
+
+def scan_page_range(pdf_data, start, stop):
+    """Worker entry point: open the PDF and scan pages [start, stop)"""
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        return scan_doc_pages(doc, start, min(stop, doc.page_count))
+    finally:
+        doc.close()
+
+
+def headings_from_scans(scans, page_count):
+    """Turn (lines, chars) results, in page order, into bookmark dicts"""
+    chars = Counter()
+    for _, range_chars in scans:
+        chars.update(range_chars)
+    if not chars:
+        return []
+    total_chars = sum(chars.values())
+
+    by_size = Counter()
+    for (size, _), count in chars.items():
+        by_size[size] += count
+    body_size = by_size.most_common(1)[0][0]
+
+    lines = [line for range_lines, _ in scans for line in range_lines]
+    text_pages = {}
+    style_lines = Counter()
+    for page, size, bold, _, text in lines:
+        text_pages.setdefault(text, set()).add(page)
+        style_lines[(size, bold)] += 1
+
+    running_limit = max(2, page_count * RUNNING_TEXT_PAGE_SHARE)
+    styles = set()
+    for style, line_count in style_lines.items():
+        size, bold = style
+        if not (size >= body_size * HEADING_SIZE_RATIO or (bold and size >= body_size)):
+            continue
+        if chars[style] > total_chars * MAX_HEADING_CHAR_SHARE:
+            continue
+        if line_count > max(1, page_count) * MAX_HEADING_LINES_PER_PAGE:
+            continue
+        styles.add(style)
+
+    # Larger sizes are higher levels; at one size bold outranks regular
+    ranked = sorted(styles, key=lambda style: (-style[0], not style[1]))[:MAX_LEVELS]
+    levels = {style: level for level, style in enumerate(ranked, 1)}
+
+    bookmarks = []
+    previous = None
+    for page, size, bold, block, text in lines:
+        level = levels.get((size, bold))
+        if level is None or len(text_pages[text]) > running_limit or not any(c.isalpha() for c in text):
+            previous = None
+            continue
+        if previous is not None and previous[:3] == (page, block, level):
+            # Continuation of a heading that wraps onto the next line
+            bookmarks[-1]['title'] += ' ' + text
+        else:
+            bookmarks.append({'title': text, 'page': page, 'level': level})
+        previous = (page, block, level)
+    return bookmarks
+
+
+def detect_headings(doc):
+    """Scan a whole open document in this process and return bookmark dicts"""
+    return headings_from_scans([scan_doc_pages(doc, 0, doc.page_count)], doc.page_count)
+
+
+class AutoOutliner:
+    """Heading detection fanned out over the worker pool, cached per document hash
+
+    Each document is split into at most one page range per worker and no
+    range shorter than ``min_pages_per_task``. With an ``admission``
+    controller every range in flight holds a job slot, so admission sees
+    each busy worker; ranges only run in parallel while slots are free.
+    The bookmark lists of the last ``cache_entries`` documents are kept.
+    """
+
+    def __init__(self, pool, cache_entries=256, min_pages_per_task=25, admission=None):
+        self.pool = pool
+        self.admission = admission
+        self.cache_entries = cache_entries
+        self.min_pages_per_task = max(1, min_pages_per_task)
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()  # document digest -> bookmarks
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, pool, admission=None):
+        """Configure from AUTO_OUTLINE_CACHE_ENTRIES and AUTO_OUTLINE_MIN_PAGES_PER_TASK"""
+        return cls(
+            pool,
+            cache_entries=int(os.environ.get('AUTO_OUTLINE_CACHE_ENTRIES', 256)),
+            min_pages_per_task=int(os.environ.get('AUTO_OUTLINE_MIN_PAGES_PER_TASK', 25)),
+            admission=admission,
+        )
+
+    def page_ranges(self, page_count):
+        workers = max(1, self.pool.max_workers)
+        tasks = max(1, min(workers, page_count // self.min_pages_per_task))
+        step = math.ceil(page_count / tasks) if page_count else 1
+        return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+    def outline(self, pdf_data, digest=None, held_slots=0):
+        """Return the detected bookmark list for a PDF (empty if it has no clear headings)
+
+        ``held_slots`` job slots are already held by the caller (a queued
+        job holds one); without any, the first is waited for and may be
+        refused with AdmissionRejected. A cached outline takes none.
+        """
+        if digest is not None:
+            with self._lock:
+                cached = self._cache.get(digest)
+                if cached is not None:
+                    self._cache.move_to_end(digest)
+                    self.hits += 1
+                    return cached
+
+        started = time.perf_counter()
+        doc = fitz.open(stream=pdf_data, filetype="pdf")
+        page_count = doc.page_count
+        doc.close()
+        ranges = self.page_ranges(page_count)
+        try:
+            # One job slot per range in flight
+            scans = run_in_job_slots(self.admission, self.pool, scan_page_range,
+                                     [(pdf_data, start, stop) for start, stop in ranges], held_slots)
+        except BrokenProcessPool:
+            # A worker died (e.g. MuPDF crashed); start a fresh pool for the next job
+            self.pool.reset()
+            raise
+        bookmarks = headings_from_scans(scans, page_count)
+        logger.debug("🔎 Auto outline: %d headings in %d pages (%d ranges, %.2fs)",
+                     len(bookmarks), page_count, len(ranges), time.perf_counter() - started)
+
+        if digest is not None:
+            with self._lock:
+                self.misses += 1
+                if self.cache_entries > 0:
+                    self._cache[digest] = bookmarks
+                    while len(self._cache) > self.cache_entries:
+                        self._cache.popitem(last=False)
+        return bookmarks
+
+    def stats(self):
+        """Cache counters for /health"""
+        with self._lock:
+            return {'entries': len(self._cache), 'max_entries': self.cache_entries,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+_outliner = None
+_outliner_lock = threading.Lock()
+
+
+def get_auto_outliner():
+    """Return the process-wide auto outliner, creating it on first use"""
+    global _outliner
+    with _outliner_lock:
+        if _outliner is None:
+            _outliner = AutoOutliner.from_env(get_pool(), get_admission())
+        return _outliner
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Batch bookmark embedding
+Takes many PDF parts from one multipart upload, processes them in the
+worker pool while the upload is still arriving, and streams a ZIP of the
+results back as each file finishes
+"""
+
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from metrics import observe_embedding
+from auto_outline import normalize_outline_mode
+from engines import embed_document, get_engine_policy, normalize_engine
+from pdf_embedder import normalize_linearize, normalize_output_profile, normalize_verify_level
+from result_cache import cache_key
+from structured_log import get_logger
+
+logger = get_logger('batch')
+
+MANIFEST_NAME = 'manifest.json'
+
+
+class _StreamWriter:
+    """Minimal write-only file object so ZipFile streams straight to the socket"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.stream.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self):
+        if hasattr(self.stream, 'flush'):
+            self.stream.flush()
+
+
+class BatchEmbedder:
+    """Process the pdf parts of a multipart stream into a streamed ZIP
+
+    Form fields apply to the pdf parts that follow them:
+      bookmarks             shared default bookmark list (JSON array)
+      bookmarks[<filename>] bookmark list for one file (an invalid one fails that file)
+      verify                verification level for the whole batch
+      profile               output profile (fast, balanced, smallest)
+      linearize             true for linearized ("fast web view") output
+      outline               auto to detect headings for files without bookmarks
+      engine                embedding engine, or auto for the engine policy
+    At most ``max_in_flight`` files are held while waiting for workers, so
+    the upload is throttled instead of buffered when workers fall behind.
+    With an ``admission`` controller each file also takes a job slot, so a
+    batch shares the global PyMuPDF job cap with single requests.
+    """
+
+    def __init__(self, pool, cache=None, verify_level=None, max_in_flight=None, admission=None, profile=None,
+                 linearize=None, outline=None, engine=None):
+        self.pool = pool
+        self.cache = cache
+        self.admission = admission
+        self.verify_level = normalize_verify_level(verify_level)
+        self.profile = normalize_output_profile(profile)
+        self.linearize = normalize_linearize(linearize)
+        self.outline = normalize_outline_mode(outline)
+        self.engine = normalize_engine(engine, self.profile)
+        self.max_in_flight = max_in_flight or max(2, 2 * (pool.max_workers or 1))
+        self.default_bookmarks = None
+        self.file_bookmarks = {}
+        self.file_errors = {}  # filename -> why its bookmarks[<filename>] field was rejected
+        self.manifest = []
+        self._pending = {}  # future -> manifest entry
+        self._names = set()
+
+    def run(self, parts, stream):
+        """Consume parts and write the ZIP to stream; returns the manifest"""
+        writer = _StreamWriter(stream)
+        started = time.perf_counter()
+        with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_STORED) as archive:
+            try:
+                for part in parts:
+                    if part.file is not None:
+                        self._submit(part, archive)
+                    else:
+                        self._apply_field(part)
+                    # Wait for results instead of reading more of the upload
+                    while len(self._pending) >= self.max_in_flight:
+                        self._collect(archive, FIRST_COMPLETED)
+            except Exception as e:
+                # The body broke off mid-stream; report it and keep finished files
+                self.manifest.append({'filename': None, 'status': 'error', 'error': f"Upload failed: {e}"})
+            while self._pending:
+                self._collect(archive, FIRST_COMPLETED)
+            for filename, error in self.file_errors.items():
+                self.manifest.append({'filename': filename, 'status': 'error', 'error': error})
+
+            summary = {
+                'files': len([entry for entry in self.manifest if entry.get('filename')]),
+                'succeeded': len([entry for entry in self.manifest if entry['status'] == 'ok']),
+                'failed': len([entry for entry in self.manifest if entry['status'] != 'ok']),
+                'seconds': round(time.perf_counter() - started, 3),
+                'verification': self.verify_level,
+                'profile': self.profile,
+                'linearized': self.linearize,
+                'outline': self.outline,
+                'engine': self.engine,
+                'results': self.manifest,
+            }
+            archive.writestr(self._zip_info(MANIFEST_NAME), json.dumps(summary, indent=2))
+        logger.info("📦 Batch finished", extra={'fields': {
+            'ok': summary['succeeded'], 'failed': summary['failed'],
+            'bytes': writer.bytes_written, 'seconds': summary['seconds']}})
+        return summary
+
+    def _apply_field(self, part):
+        name = part.name or ''
+        # Batch-wide settings: field -> (attribute, normalizer)
+        settings = {
+            'verify': ('verify_level', normalize_verify_level),
+            'profile': ('profile', normalize_output_profile),
+            'linearize': ('linearize', normalize_linearize),
+            'outline': ('outline', normalize_outline_mode),
+            'engine': ('engine', lambda value: normalize_engine(value, self.profile)),
+        }
+        if name == 'bookmarks':
+            self.default_bookmarks = part.value if part.error is None and isinstance(part.value, list) else None
+        elif name in settings:
+            if part.value:
+                attribute, normalize = settings[name]
+                try:
+                    setattr(self, attribute, normalize(part.value.decode('utf-8', errors='replace')))
+                except ValueError as e:
+                    self.manifest.append({'filename': None, 'status': 'error', 'error': str(e)})
+        elif name.startswith('bookmarks[') and name.endswith(']'):
+            filename = name[len('bookmarks['):-1]
+            try:
+                bookmarks = json.loads(part.value.decode('utf-8'))
+                if not isinstance(bookmarks, list) or not all(isinstance(bookmark, dict) for bookmark in bookmarks):
+                    raise ValueError("expected a list of bookmark objects")
+            except ValueError as e:
+                # Reported in the file's manifest entry; the rest of the batch goes on
+                self.file_bookmarks.pop(filename, None)
+                self.file_errors[filename] = f"Invalid bookmark JSON: {e}"
+                return
+            self.file_bookmarks[filename] = bookmarks
+            self.file_errors.pop(filename, None)
+
+    def _submit(self, part, archive):
+        filename = os.path.basename(part.filename or f"document-{len(self.manifest) + len(self._pending) + 1}.pdf")
+        entry = {'filename': filename, 'size': part.size}
+
+        if part.size < 100 or not part.head(4).startswith(b'%PDF'):
+            part.close()
+            entry.update(status='error', error='Not a valid PDF file')
+            self.manifest.append(entry)
+            return
+        if part.large:
+            # Batch files are processed in memory; large documents go through /embed-bookmarks or /jobs
+            part.close()
+            entry.update(status='error', error='Too large for a batch; upload it to /embed-bookmarks or /jobs')
+            self.manifest.append(entry)
+            return
+
+        error = self.file_errors.pop(filename, None)
+        if error is not None:
+            part.close()
+            entry.update(status='error', error=error)
+            self.manifest.append(entry)
+            return
+
+        bookmarks = self.file_bookmarks.get(filename, self.default_bookmarks)
+        # Batch files are already processed in parallel, so headings are detected inside each file's job
+        outline = 'auto' if not bookmarks and self.outline == 'auto' else None
+        engine = None if self.engine == 'auto' else self.engine
+        key = cache_key(part.sha256, bookmarks, profile=self.profile, linearize=self.linearize, outline=outline,
+                        engine=engine)
+        entry['etag'] = key
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            part.close()
+            entry['cache'] = 'HIT'
+            self._write_result(archive, entry, *cached)
+            return
+
+        entry['cache'] = 'MISS'
+        entry['started'] = time.perf_counter()
+        pdf_data = part.read_bytes()
+        policy = get_engine_policy()
+        args = (embed_document, pdf_data, bookmarks, self.verify_level, self.profile, self.linearize, self.outline,
+                policy.choose(len(pdf_data), len(bookmarks or ()), self.profile, engine), policy.fallback(engine))
+        if self.admission is None:
+            future = self.pool.submit(*args)
+        else:
+            # The batch is already admitted, so wait for a slot rather than refusing
+            self.admission.acquire_job(wait_when_full=True)
+            try:
+                future = self.pool.submit(*args)
+            except BaseException:
+                self.admission.release_job()
+                raise
+            future.add_done_callback(lambda _: self.admission.release_job())
+        self._pending[future] = entry
+
+    def _collect(self, archive, return_when):
+        done, _ = wait(list(self._pending), return_when=return_when)
+        for future in done:
+            entry = self._pending.pop(future)
+            started = entry.pop('started')
+            entry['seconds'] = round(time.perf_counter() - started, 3)
+            try:
+                pdf_bytes, info = future.result()
+            except Exception as e:
+                entry.update(status='error', error=str(e))
+                self.manifest.append(entry)
+                logger.warning("❌ Batch file %s failed: %s", entry['filename'], e)
+                continue
+            observe_embedding(info)
+            if self.cache is not None:
+                self.cache.put(entry['etag'], pdf_bytes, info)
+            self._write_result(archive, entry, pdf_bytes, info)
+
+    def _write_result(self, archive, entry, pdf_bytes, info):
+        output_name = self._unique_name(entry['filename'])
+        archive.writestr(self._zip_info(output_name), pdf_bytes)
+        entry.update(status='ok', output=output_name, output_size=len(pdf_bytes),
+                     page_count=info['page_count'], bookmarks=info['bookmarks'],
+                     outline_source=info.get('outline_source'), engine=info.get('engine'))
+        if 'outline' in info:
+            entry['outline'] = info['outline']
+        self.manifest.append(entry)
+
+    def _unique_name(self, filename):
+        stem, ext = os.path.splitext(filename)
+        candidate = filename
+        counter = 1
+        while candidate in self._names or candidate == MANIFEST_NAME:
+            counter += 1
+            candidate = f"{stem}-{counter}{ext}"
+        self._names.add(candidate)
+        return candidate
+
+    def _zip_info(self, name):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        return info
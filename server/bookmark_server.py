@@ -10,7 +10,10 @@ import fitz  # PyMuPDF
 import tempfile
 import os
 from urllib.parse import parse_qs
-import traceback
+
+from structured_log import SAMPLED, get_logger
+
+logger = get_logger('bookmark_server')
 
 class BookmarkServerHandler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -62,12 +65,12 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
     def handle_bookmark_embedding(self):
         """Handle PDF bookmark embedding requests"""
         try:
-            print(f"📥 Received POST request to /embed-bookmarks")
-            print(f"📋 Headers: {dict(self.headers)}")
+            logger.debug("📥 Received POST request to /embed-bookmarks")
+            logger.debug("📋 Headers: %s", dict(self.headers), extra=SAMPLED)
             
             # Parse multipart form data
             content_type = self.headers.get('Content-Type', '')
-            print(f"📄 Content-Type: {content_type}")
+            logger.debug("📄 Content-Type: %s", content_type)
             
             if not content_type.startswith('multipart/form-data'):
                 self.send_error(400, "Expected multipart/form-data")
@@ -80,16 +83,16 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
                 return
                 
             content_length = int(content_length_header)
-            print(f"📏 Content-Length: {content_length}")
+            logger.debug("📏 Content-Length: %s", content_length)
             
             if content_length == 0:
                 self.send_error(400, "No content provided")
                 return
 
             # Read the entire request body
-            print("📖 Reading request body...")
+            logger.debug("📖 Reading request body...")
             post_data = self.rfile.read(content_length)
-            print(f"📦 Read {len(post_data)} bytes")
+            logger.debug("📦 Read %s bytes", len(post_data))
             
             # Simple multipart parsing for PDF files
             # Extract boundary from content type
@@ -103,17 +106,17 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
                 boundary = boundary[1:-1]
                 
             boundary_bytes = boundary.encode()
-            print(f"🔗 Boundary: {boundary}")
+            logger.debug("🔗 Boundary: %s", boundary)
             
             # Split by boundary
             parts = post_data.split(b'--' + boundary_bytes)
-            print(f"📂 Found {len(parts)} parts")
+            logger.debug("📂 Found %s parts", len(parts))
             
             pdf_data = None
             for i, part in enumerate(parts):
-                print(f"📄 Part {i}: {len(part)} bytes")
+                logger.debug("📄 Part %s: %s bytes", i, len(part), extra=SAMPLED)
                 if b'Content-Disposition: form-data; name="pdf"' in part:
-                    print("✅ Found PDF part")
+                    logger.debug("✅ Found PDF part")
                     # Find the start of file data (after headers)
                     header_end = part.find(b'\r\n\r\n')
                     if header_end != -1:
@@ -123,15 +126,15 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
                             pdf_data = pdf_data[:-2]
                         if pdf_data.endswith(b'--'):
                             pdf_data = pdf_data[:-2]
-                        print(f"📄 Extracted PDF data: {len(pdf_data)} bytes")
+                        logger.debug("📄 Extracted PDF data: %s bytes", len(pdf_data))
                         break
 
             if not pdf_data or len(pdf_data) < 100:  # PDF files should be at least 100 bytes
-                print("❌ No valid PDF data found")
+                logger.warning("❌ No valid PDF data found")
                 self.send_error(400, "No valid PDF file found in request")
                 return
 
-            print(f"📁 Processing PDF: {len(pdf_data)} bytes")
+            logger.debug("📁 Processing PDF: %s bytes", len(pdf_data))
 
             # Process PDF with bookmarks
             processed_pdf = self.add_bookmarks_to_pdf(pdf_data)
@@ -145,11 +148,10 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(processed_pdf)
 
-            print(f"✅ PDF processed successfully: {len(processed_pdf)} bytes")
+            logger.debug("✅ PDF processed successfully: %s bytes", len(processed_pdf))
 
         except Exception as e:
-            print(f"❌ Error processing PDF: {str(e)}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
+            logger.error("❌ Error processing PDF: %s", str(e), exc_info=True)
             
             self.send_response(500)
             self.send_cors_headers()
@@ -168,7 +170,7 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
         try:
             # Open PDF document
             doc = fitz.open(stream=pdf_data, filetype="pdf")
-            print(f"📄 PDF loaded: {doc.page_count} pages")
+            logger.debug("📄 PDF loaded: %s pages", doc.page_count)
 
             # Create Table of Contents (TOC) structure
             toc = []
@@ -176,24 +178,24 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
             # Add bookmarks for available pages
             if doc.page_count >= 1:
                 toc.append([1, "📄 Page 1", 1])  # [level, title, page]
-                print("✅ Added bookmark for Page 1")
+                logger.debug("✅ Added bookmark for Page 1")
             
             if doc.page_count >= 3:
                 toc.append([1, "📄 Page 3", 3])
-                print("✅ Added bookmark for Page 3")
+                logger.debug("✅ Added bookmark for Page 3")
             
             if doc.page_count >= 6:
                 toc.append([1, "📄 Page 6", 6])
-                print("✅ Added bookmark for Page 6")
+                logger.debug("✅ Added bookmark for Page 6")
 
-            print(f"📋 TOC structure: {toc}")
+            logger.debug("📋 TOC structure: %s", toc)
 
             # Set the table of contents
             if toc:
                 doc.set_toc(toc)
-                print("✅ Table of contents set successfully")
+                logger.debug("✅ Table of contents set successfully")
             else:
-                print("⚠️ No bookmarks to add (document too short)")
+                logger.warning("⚠️ No bookmarks to add (document too short)")
 
             # Save to bytes
             pdf_bytes = doc.tobytes()
@@ -202,15 +204,14 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
             # Verify the result by reopening and checking TOC
             doc_verify = fitz.open(stream=pdf_bytes, filetype="pdf")
             verify_toc = doc_verify.get_toc()
-            print(f"✅ Verification - TOC in result: {verify_toc}")
+            logger.debug("✅ Verification - TOC in result: %s", verify_toc)
             doc_verify.close()
 
-            print(f"📄 PDF with bookmarks created: {len(pdf_bytes)} bytes")
+            logger.debug("📄 PDF with bookmarks created: %s bytes", len(pdf_bytes))
             return pdf_bytes
 
         except Exception as e:
-            print(f"❌ Error adding bookmarks: {e}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
+            logger.error("❌ Error adding bookmarks: %s", e, exc_info=True)
             raise
             
             if doc.page_count >= 3:
@@ -222,9 +223,9 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
             # Set bookmarks if any were added
             if bookmarks:
                 doc.set_toc(bookmarks)
-                print(f"📚 Added {len(bookmarks)} bookmarks")
+                logger.debug("📚 Added %s bookmarks", len(bookmarks))
             else:
-                print("⚠️ PDF has fewer than 1 page, no bookmarks added")
+                logger.warning("⚠️ PDF has fewer than 1 page, no bookmarks added")
 
             # Get the modified PDF data
             modified_pdf = doc.tobytes()
@@ -233,48 +234,50 @@ class BookmarkServerHandler(BaseHTTPRequestHandler):
             return modified_pdf
 
         except Exception as e:
-            print(f"❌ PyMuPDF processing failed: {str(e)}")
+            logger.error("❌ PyMuPDF processing failed: %s", str(e))
             raise
 
+    def log_request(self, code='-', size='-'):
+        """One summary line per request at INFO"""
+        logger.info("🌐 %s - \"%s\" %s", self.address_string(), self.requestline, getattr(code, 'value', code))
+
     def log_message(self, format, *args):
         """Override to customize log format"""
-        print(f"🌐 {self.address_string()} - {format % args}")
+        logger.debug("🌐 %s - %s", self.address_string(), format % args)
 
 def main():
     """Start the bookmark embedding server"""
     port = 8081  # Changed to avoid conflict with other services
     
-    print("🚀 Starting PDF Bookmark Embedding Server")
-    print(f"📡 Server will run on http://localhost:{port}")
-    print("🔗 Endpoints:")
-    print("   GET  /health - Server health check")
-    print("   POST /embed-bookmarks - Process PDF with bookmarks")
-    print("📱 Optimized for iOS Safari compatibility")
-    print("📚 Adds bookmarks to pages 1, 3, and 6")
-    print()
+    logger.info("🚀 Starting PDF Bookmark Embedding Server")
+    logger.info("📡 Server will run on http://localhost:%s", port)
+    logger.info("🔗 Endpoints:")
+    logger.info("   GET  /health - Server health check")
+    logger.info("   POST /embed-bookmarks - Process PDF with bookmarks")
+    logger.info("📱 Optimized for iOS Safari compatibility")
+    logger.info("📚 Adds bookmarks to pages 1, 3, and 6")
     
     try:
         # Check if PyMuPDF is available
         import fitz
-        print("✅ PyMuPDF (fitz) is available")
+        logger.info("✅ PyMuPDF (fitz) is available")
         
         # Start server
         server = HTTPServer(('0.0.0.0', port), BookmarkServerHandler)  # Bind to all interfaces
-        print(f"🎯 Server running at http://localhost:{port}")
-        print(f"📱 iPad access: http://[YOUR_IP_ADDRESS]:{port}")
-        print("Press Ctrl+C to stop the server")
-        print("=" * 50)
+        logger.info("🎯 Server running at http://localhost:%s", port)
+        logger.info("📱 iPad access: http://[YOUR_IP_ADDRESS]:%s", port)
+        logger.info("Press Ctrl+C to stop the server")
         
         server.serve_forever()
         
     except ImportError:
-        print("❌ PyMuPDF not installed. Install with: pip install pymupdf")
+        logger.error("❌ PyMuPDF not installed. Install with: pip install pymupdf")
         return 1
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        logger.info("🛑 Server stopped by user")
         return 0
     except Exception as e:
-        print(f"❌ Server error: {e}")
+        logger.error("❌ Server error: %s", e)
         return 1
 
 if __name__ == "__main__":
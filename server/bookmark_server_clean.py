@@ -5,41 +5,201 @@ Automatically adds bookmarks to pages 1, 3, and 6 of uploaded PDFs
 Optimized for iOS Safari compatibility
 """
 
-import fitz  # PyMuPDF
+import base64
 import io
 import json
-import traceback
-from datetime import datetime
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import signal
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from admission import AdmissionRejected, get_admission
+from async_server import AsyncHandlerMixin, AsyncHTTPServer
+from auto_outline import get_auto_outliner, normalize_outline_mode
+from batch_embedder import BatchEmbedder
+from byte_ranges import RangeNotSatisfiable, content_range, multipart_layout, parse_range_header
+from document_store import DocumentExpired, get_document_store
+from engines import embed_document, get_engine_policy, normalize_engine
+from jobs import DONE, FAILED, get_job_manager
+from metrics import (REGISTRY, REQUEST_SECONDS, REQUESTS, RESPONSE_BYTES, STAGE_SECONDS,
+                     UPLOAD_BYTES, observe_embedding)
+from multipart_stream import LARGE_DOCUMENT_BYTES, MultipartError, StreamingMultipartParser
+import prefork
+from pdf_embedder import (count_pages, embed_bookmarks_file, normalize_linearize, normalize_output_profile,
+                          normalize_verify_level)
+from result_cache import cache_key, get_result_cache
+from startup import get_startup
+from static_assets import get_static_cache
+from structured_log import SAMPLED, get_logger
+from text_index import get_text_index_cache
+from thumbnails import (THUMBNAIL_FORMATS, get_thumbnail_cache, normalize_thumbnail_dpi, normalize_thumbnail_format,
+                        parse_page_ranges, thumbnail_etag)
+from worker_pool import get_pool
+
+logger = get_logger('server')
+
+SERVER_MODES = ('threaded', 'async')
+
+# How long a search waits for a document's first index build before answering from the pages indexed so far
+SEARCH_WAIT_SECONDS = float(os.environ.get('SEARCH_WAIT_SECONDS', 5))
+MAX_SEARCH_RESULTS = 100
+
+# App Engine sends GET /_ah/warmup to new instances before routing traffic to them
+WARMUP_PATH = '/_ah/warmup'
+WARMUP_TIMEOUT_SECONDS = 60
+
+KNOWN_ROUTES = {'/', '/index.html', '/simple', '/uploader', '/health', '/metrics', WARMUP_PATH,
+                '/embed-bookmarks', '/embed-bookmarks/batch', '/documents', '/jobs'}
+
+
+def asset_content_type(path):
+    """Content type for a /assets/ file, or None if it is not served"""
+    if path.endswith('.css'):
+        return 'text/css'
+    if path.endswith('.js'):
+        return 'application/javascript'
+    if path.endswith('.js.map'):
+        return 'application/json'
+    return None
+
+
+def route_label(path):
+    """Low-cardinality route name for metrics (document IDs are collapsed)"""
+    path = urlparse(path).path
+    for collection in ('documents', 'jobs', 'results'):
+        if path.startswith(f"/{collection}/"):
+            parts = path.strip('/').split('/')
+            return f"/{collection}/:id" + (f"/{parts[2]}" if len(parts) > 2 else '')
+    if path.startswith('/assets/'):
+        return '/assets/*'
+    if path in KNOWN_ROUTES:
+        return path
+    return 'other'
+
+
+def size_change(input_bytes, output_bytes):
+    """Relative size of the output, e.g. '-35.2%'"""
+    if not input_bytes:
+        return '+0.0%'
+    return f"{(output_bytes - input_bytes) / input_bytes * 100:+.1f}%"
+
+
+def remove_file(path):
+    """Delete a temporary file if it is still there"""
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def preload_static_assets():
+    """Read the viewer pages and built assets into the static cache at startup"""
+    paths = {'pdf-viewer.html': 'text/html', 'dist/index.html': 'text/html'}
+    cache = get_static_cache()
+    assets_dir = cache.resolve('dist/assets')
+    if assets_dir and os.path.isdir(assets_dir):
+        for name in os.listdir(assets_dir):
+            content_type = asset_content_type(name)
+            if content_type:
+                paths[f"dist/assets/{name}"] = content_type
+    cache.preload(paths)
 
 
 class PDFBookmarkHandler(BaseHTTPRequestHandler):
     """HTTP handler for PDF bookmark embedding"""
 
+    # Response headers the viewer is allowed to read cross-origin
+    EXPOSED_HEADERS = ['ETag', 'X-Cache', 'X-Verification', 'X-Page-Count', 'X-Bookmark-Count', 'Retry-After',
+                       'X-Output-Profile', 'X-Save-Ms', 'X-Input-Bytes', 'X-Size-Change', 'X-Linearized',
+                       'X-Bookmarks-Rejected', 'X-Levels-Adjusted', 'X-Bookmark-Rejections', 'X-Outline-Source',
+                       'Accept-Ranges', 'Content-Range', 'Content-Location', 'X-Peak-Memory', 'X-Engine']
+
+    MAX_REJECTIONS_IN_HEADER = 10
+
+    def handle_one_request(self):
+        """Handle one request and emit its summary log line"""
+        self.request_started = time.perf_counter()
+        self.response_status = None
+        self.log_fields = {}
+        try:
+            super().handle_one_request()
+        finally:
+            ticket = getattr(self, 'admission_ticket', None)
+            if ticket is not None:
+                ticket.release()
+                self.admission_ticket = None
+        if self.response_status is not None:
+            elapsed = time.perf_counter() - self.request_started
+            route = route_label(self.path)
+            REQUESTS.inc(route, self.response_status)
+            REQUEST_SECONDS.observe(elapsed, route)
+            fields = {'status': self.response_status, 'ms': round(elapsed * 1000, 1)}
+            fields.update(self.log_fields)
+            logger.info("%s %s", self.command, self.path, extra={'fields': fields})
+
+    def note(self, **fields):
+        """Attach fields to this request's summary log line"""
+        if not hasattr(self, 'log_fields'):
+            self.log_fields = {}
+        self.log_fields.update(fields)
+
+    def log_request(self, code='-', size='-'):
+        """Remember the status for the summary line instead of logging here"""
+        self.response_status = getattr(code, 'value', code)
+
+    def log_error(self, format, *args):
+        logger.warning("%s - %s", self.address_string(), format % args)
+
     def log_message(self, format, *args):
-        """Custom logging with timestamps"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] {format % args}")
+        """Route http.server messages through the structured logger"""
+        logger.debug("%s - %s", self.address_string(), format % args)
 
     def do_GET(self):
         """Handle GET requests"""
-        if self.path == '/health':
+        parsed = urlparse(self.path)
+        path = parsed.path
+        self.query = parse_qs(parsed.query)
+        if self.forward_to_sibling(path):
+            return
+        document_id, action = self.parse_document_path(path)
+        job_id, job_action = self.parse_document_path(path, 'jobs')
+        result_key, result_action = self.parse_document_path(path, 'results')
+        if path == '/health':
             self.send_health_check()
-        elif self.path == '/' or self.path == '/index.html':
+        elif path == '/metrics':
+            self.send_metrics()
+        elif path == WARMUP_PATH:
+            self.send_warmup()
+        elif job_id and job_action is None:
+            self.send_job_status(job_id)
+        elif job_id and job_action == 'result':
+            self.send_job_result(job_id)
+        elif result_key and result_action is None:
+            self.send_stored_result(result_key)
+        elif document_id and action is None:
+            document = get_document_store().get(document_id)
+            if document is not None:
+                self.send_json(200, document.to_json())
+            else:
+                self.send_json(404, {'success': False, 'error': 'Unknown or expired document'})
+        elif document_id and action == 'search':
+            self.send_document_search(document_id)
+        elif document_id and action == 'thumbnails':
+            self.send_thumbnails(document_id)
+        elif path == '/' or path == '/index.html':
             # Serve the PDF viewer with interactive bookmarks as the main page
             self.serve_static_file('pdf-viewer.html', 'text/html')
-        elif self.path == '/simple' or self.path == '/uploader':
+        elif path == '/simple' or path == '/uploader':
             # Serve the simple uploader as an alternative
             self.serve_static_file('dist/index.html', 'text/html')
-        elif self.path.startswith('/assets/'):
+        elif path.startswith('/assets/'):
             # Serve CSS and JS files from dist/assets/
-            file_path = f"dist{self.path}"
-            if self.path.endswith('.css'):
-                self.serve_static_file(file_path, 'text/css')
-            elif self.path.endswith('.js'):
-                self.serve_static_file(file_path, 'application/javascript')
-            elif self.path.endswith('.js.map'):
-                self.serve_static_file(file_path, 'application/json')
+            content_type = asset_content_type(path)
+            if content_type:
+                self.serve_static_file(f"dist{path}", content_type)
             else:
                 self.send_error(404, "File not found")
         else:
@@ -47,327 +207,1129 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
 
     def do_POST(self):
         """Handle POST requests for PDF processing"""
-        if self.path == '/embed-bookmarks':
+        parsed = urlparse(self.path)
+        self.query = parse_qs(parsed.query)
+        document_id, action = self.parse_document_path(parsed.path)
+        if not self.admit_request():
+            return
+        if self.forward_to_sibling(parsed.path):
+            return
+        if parsed.path == '/embed-bookmarks':
             self.handle_bookmark_embedding()
+        elif parsed.path == '/embed-bookmarks/batch':
+            self.handle_batch_embedding()
+        elif parsed.path == '/documents':
+            self.handle_document_upload()
+        elif parsed.path == '/jobs':
+            self.handle_job_submission()
+        elif document_id and action == 'embed-bookmarks':
+            self.handle_document_embedding(document_id)
         else:
             self.send_error(404, "Endpoint not found")
 
+    def admit_request(self):
+        """Check the declared body size against admission limits before reading it
+
+        Sends 413/503 and returns False if the request is refused. The async
+        front end admits requests itself and passes its reservation in.
+        """
+        if getattr(self, 'admission_ticket', None) is not None:
+            return True
+        content_length = self.headers.get('Content-Length')
+        try:
+            if content_length:
+                declared = int(content_length)
+            else:
+                declared = None if self.body_is_chunked() else 0
+            self.admission_ticket = get_admission().admit(declared)
+        except ValueError:
+            self.send_error(400, f"Bad Content-Length: {content_length!r}")
+            return False
+        except AdmissionRejected as e:
+            # The body is left unread, so this connection can't be reused
+            self.close_connection = True
+            self.send_rejection(e, {'Connection': 'close'})
+            return False
+        return True
+
+    def do_DELETE(self):
+        """Handle DELETE requests for stored documents and jobs"""
+        path = urlparse(self.path).path
+        if self.forward_to_sibling(path):
+            return
+        document_id, action = self.parse_document_path(path)
+        job_id, job_action = self.parse_document_path(path, 'jobs')
+        if job_id and job_action is None:
+            if get_job_manager().remove(job_id):
+                self.send_json(200, {'success': True, 'job_id': job_id})
+            else:
+                self.send_json(404, {'success': False, 'error': 'Unknown or expired job'})
+        elif document_id and action is None:
+            if get_document_store().remove(document_id):
+                get_text_index_cache().remove(document_id)
+                get_thumbnail_cache().remove(document_id)
+                self.send_json(200, {'success': True, 'document_id': document_id})
+            else:
+                self.send_json(404, {'success': False, 'error': 'Unknown or expired document'})
+        else:
+            self.send_error(404, "Endpoint not found")
+
+    def parse_document_path(self, path, collection='documents'):
+        """Split /documents/<id>[/<action>] (or /jobs/...) into (id, action)"""
+        parts = path.strip('/').split('/')
+        if len(parts) < 2 or parts[0] != collection or len(parts) > 3:
+            return None, None
+        return parts[1], parts[2] if len(parts) == 3 else None
+
+    def forward_to_sibling(self, path):
+        """Pass a request for a job, document or result held by another server process on to it
+
+        Only in pre-fork mode; returns True if a sibling answered.
+        """
+        if not prefork.has_siblings() or self.headers.get(prefork.FORWARDED_HEADER):
+            return False
+        for collection in ('jobs', 'documents', 'results'):
+            item_id, _ = self.parse_document_path(path, collection)
+            if item_id is None:
+                continue
+            if self.held_here(collection, item_id):
+                return False
+            sibling = prefork.forward(self, (collection, item_id))
+            if sibling is None:
+                return False
+            self.note(forwarded=os.path.basename(sibling))
+            return True
+        return False
+
+    def held_here(self, collection, item_id):
+        """True if this process holds the job, document or result"""
+        if collection == 'jobs':
+            return get_job_manager().get(item_id)[0] is not None
+        if collection == 'documents':
+            return get_document_store().get(item_id) is not None
+        return get_result_cache().contains(item_id)
+
     def do_OPTIONS(self):
         """Handle CORS preflight requests"""
         self.send_response(200)
         self.send_cors_headers()
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def send_cors_headers(self):
         """Send CORS headers for browser compatibility"""
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, If-None-Match, If-Modified-Since, Range, If-Range')
+        self.send_header('Access-Control-Expose-Headers', ', '.join(self.EXPOSED_HEADERS))
         self.send_header('Access-Control-Max-Age', '86400')
 
     def serve_static_file(self, file_path, content_type):
-        """Serve static files (HTML, CSS, JS)"""
+        """Serve static files (HTML, CSS, JS) from the in-memory asset cache"""
         try:
-            import os
-            print(f"🔍 Attempting to serve: {file_path}")
-            print(f"📁 Current working directory: {os.getcwd()}")
-            print(f"📂 File exists: {os.path.exists(file_path)}")
-            
-            if os.path.exists(file_path):
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                
-                print(f"✅ Serving {file_path} ({len(content)} bytes)")
-                self.send_response(200)
+            asset = get_static_cache().get(file_path, content_type)
+            if asset is None:
+                self.send_error(404, f"File not found: {file_path}")
+                return
+
+            cache_control = get_static_cache().cache_control(file_path)
+            if not asset.is_modified(self.headers.get('If-None-Match'), self.headers.get('If-Modified-Since')):
+                self.send_response(304)
                 self.send_cors_headers()
-                self.send_header('Content-Type', content_type)
-                self.send_header('Content-Length', str(len(content)))
+                self.send_header('ETag', asset.etag)
+                self.send_header('Cache-Control', cache_control)
                 self.end_headers()
-                self.wfile.write(content)
+                return
+
+            if self.headers.get('Range'):
+                # Ranges address the unencoded file
+                encoding, body = None, asset.data
             else:
-                # List directory contents for debugging
-                dir_path = os.path.dirname(file_path) or '.'
-                if os.path.exists(dir_path):
-                    files = os.listdir(dir_path)
-                    print(f"📂 Directory {dir_path} contents: {files}")
-                print(f"❌ File not found: {file_path}")
-                self.send_error(404, f"File not found: {file_path}")
+                encoding, body = asset.body(self.headers.get('Accept-Encoding'))
+            size = len(body) if body is not None else asset.size
+            plan = self.begin_ranged_response(content_type, size, asset.etag, asset.last_modified)
+            if plan is None:
+                return
+            self.send_header('Last-Modified', asset.last_modified)
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+
+            if body is not None:
+                self.write_ranged_body(plan, data=body)
+            else:
+                with open(asset.path, 'rb') as f:
+                    self.write_ranged_body(plan, file=f)
         except Exception as e:
-            print(f"❌ Error serving static file {file_path}: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.error("❌ Error serving static file %s: %s", file_path, e, exc_info=True)
             self.send_error(500, f"Internal server error: {str(e)}")
 
-    def send_health_check(self):
-        """Send health check response"""
-        self.send_response(200)
+    def send_file_body(self, file, offset=0, count=None):
+        """Large file: let the kernel copy it straight to the socket"""
+        self.wfile.flush()
+        self.connection.sendfile(file, offset, count)
+
+    def if_range_matches(self, etag, last_modified=None):
+        """False if If-Range names another version, so the whole body must be sent"""
+        validator = (self.headers.get('If-Range') or '').strip()
+        if not validator:
+            return True
+        if validator.startswith('"'):
+            return validator == etag
+        # Weak ETags never match; dates must match Last-Modified exactly
+        return last_modified is not None and validator == last_modified
+
+    def begin_ranged_response(self, content_type, size, etag, last_modified=None):
+        """Send the status line and body headers for a full or partial (Range) response
+
+        A GET with a satisfiable Range gets 206 with one range or a
+        multipart/byteranges body; an unsatisfiable one gets 416 and None is
+        returned. The caller adds its own headers, calls end_headers() and
+        then write_ranged_body() with the returned plan.
+        """
+        ranges = None
+        if self.command == 'GET' and self.if_range_matches(etag, last_modified):
+            try:
+                ranges = parse_range_header(self.headers.get('Range'), size)
+            except RangeNotSatisfiable:
+                self.note(range='unsatisfiable')
+                self.send_response(416)
+                self.send_cors_headers()
+                self.send_header('Accept-Ranges', 'bytes')
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+
+        if ranges is None:
+            self.send_response(200)
+            plan = ([(b'', 0, size - 1)] if size else [], b'')
+            length = size
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.send_response(206)
+            self.send_header('Content-Range', content_range(start, end, size))
+            plan = ([(b'', start, end)], b'')
+            length = end - start + 1
+        else:
+            boundary = uuid.uuid4().hex
+            parts, tail, length = multipart_layout(ranges, size, content_type, boundary)
+            self.send_response(206)
+            content_type = f"multipart/byteranges; boundary={boundary}"
+            plan = (parts, tail)
+        if ranges is not None:
+            self.note(ranges=len(ranges))
         self.send_cors_headers()
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        return plan
+
+    def write_ranged_body(self, plan, data=None, file=None):
+        """Write the body planned by begin_ranged_response from bytes or an open file"""
+        parts, tail = plan
+        view = memoryview(data) if data is not None else None
+        written = 0
+        for head, start, end in parts:
+            if head:
+                self.wfile.write(head)
+            if view is not None:
+                self.wfile.write(view[start:end + 1])
+            else:
+                self.send_file_body(file, start, end - start + 1)
+            written += len(head) + end - start + 1
+        if tail:
+            self.wfile.write(tail)
+        return written + len(tail)
+
+    def body_is_chunked(self):
+        """True if the body can be read to EOF without a Content-Length
+
+        The threaded front end reads the raw socket, so it always needs one.
+        """
+        return False
+
+    def abort_response(self):
+        """Drop the connection after a failure part-way through a streamed body"""
+        self.close_connection = True
+
+    def send_metrics(self):
+        """Expose counters and histograms in Prometheus text format"""
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        
+        self.wfile.write(body)
+
+    def send_warmup(self):
+        """Answer a warmup request once PyMuPDF and the workers are loaded"""
+        startup = get_startup()
+        startup.wait(WARMUP_TIMEOUT_SECONDS)
+        self.send_json(200, startup.stats())
+
+    def send_health_check(self):
+        """Send health check response"""
         response = {
             'status': 'healthy',
             'service': 'PDF Bookmark Embedder',
             'version': '1.2.0',
             'library': 'PyMuPDF',
-            'features': ['bookmark_embedding', 'ios_safari_compatible']
+            'features': ['bookmark_embedding', 'ios_safari_compatible', 'result_cache',
+                         'document_sessions', 'metrics', 'admission_control', 'jobs', 'auto_outline',
+                         'text_search', 'thumbnails', 'byte_ranges', 'large_documents', 'engines', 'preload',
+                         'prefork'],
+            'result_cache': get_result_cache().stats(),
+            'documents': get_document_store().stats(),
+            'admission': get_admission().stats(),
+            'jobs': get_job_manager().stats(),
+            'auto_outline': get_auto_outliner().stats(),
+            'text_index': get_text_index_cache().stats(),
+            'thumbnails': get_thumbnail_cache().stats(),
+            'engines': get_engine_policy().stats(),
+            'startup': get_startup().stats(),
+            'process': prefork.stats()
         }
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        self.send_json(200, response)
 
     def handle_bookmark_embedding(self):
         """Handle PDF bookmark embedding requests"""
         try:
-            print(f"📥 Received POST request to /embed-bookmarks")
-            print(f"📋 Headers: {dict(self.headers)}")
-            
-            # Parse multipart form data
-            content_type = self.headers.get('Content-Type', '')
-            print(f"📄 Content-Type: {content_type}")
-            
-            if not content_type.startswith('multipart/form-data'):
-                self.send_error(400, "Expected multipart/form-data")
-                return
+            logger.debug("📥 Received POST request to /embed-bookmarks")
+            logger.debug("📋 Headers: %s", dict(self.headers), extra=SAMPLED)
 
-            # Get content length
-            content_length_header = self.headers.get('Content-Length')
-            if not content_length_header:
-                self.send_error(400, "No Content-Length header")
+            fields = self.read_multipart_request()
+            if fields is None:
                 return
-                
-            content_length = int(content_length_header)
-            print(f"📏 Content-Length: {content_length}")
-            
-            if content_length == 0:
-                self.send_error(400, "No content provided")
+
+            try:
+                verify_level = normalize_verify_level(self.request_option(fields, 'verify'))
+                profile = normalize_output_profile(self.request_option(fields, 'profile'))
+                linearize = normalize_linearize(self.request_option(fields, 'linearize'))
+                outline = normalize_outline_mode(self.request_option(fields, 'outline'))
+                engine = normalize_engine(self.request_option(fields, 'engine'), profile)
+            except ValueError as e:
+                for part in fields.values():
+                    part.close()
+                self.send_error(400, str(e))
                 return
 
-            # Read the entire request body
-            print("📖 Reading request body...")
-            post_data = self.rfile.read(content_length)
-            print(f"📦 Read {len(post_data)} bytes")
-            
             # Extract PDF data from multipart form
-            pdf_data, bookmark_data = self.extract_pdf_from_multipart(post_data, content_type)
+            pdf_data, bookmark_data, pdf_digest = self.read_multipart_fields(fields, allow_path=True)
             if not pdf_data:
                 self.send_error(400, "No valid PDF file found in request")
                 return
+            if bookmark_data:
+                logger.debug("📋 Custom bookmarks provided: %d items", len(bookmark_data))
+
+            if isinstance(pdf_data, str):
+                logger.debug("📁 Processing large PDF from %s", pdf_data)
+                try:
+                    self.respond_with_bookmarks(pdf_digest, None, bookmark_data, verify_level, profile, linearize,
+                                                outline, pdf_path=pdf_data)
+                finally:
+                    remove_file(pdf_data)
+                return
+
+            logger.debug("📁 Processing PDF: %d bytes", len(pdf_data))
+            self.respond_with_bookmarks(pdf_digest, lambda: pdf_data, bookmark_data, verify_level, profile, linearize,
+                                        outline, engine=engine)
+
+        except Exception as e:
+            self.send_processing_error(e)
+
+    def handle_batch_embedding(self):
+        """Embed bookmarks into many PDFs and stream the results back as a ZIP"""
+        logger.debug("📥 Received POST request to /embed-bookmarks/batch")
+        content_type = self.headers.get('Content-Type', '')
+        if not content_type.startswith('multipart/form-data'):
+            self.send_error(400, "Expected multipart/form-data")
+            return
+        content_length_header = self.headers.get('Content-Length')
+        if not content_length_header and not self.body_is_chunked():
+            self.send_error(400, "No Content-Length header")
+            return
+
+        try:
+            content_length = int(content_length_header) if content_length_header else None
+            parser = StreamingMultipartParser(self.rfile, content_type, content_length)
+            batch = BatchEmbedder(get_pool(), get_result_cache(), self.request_option({}, 'verify'),
+                                  admission=get_admission(), profile=self.request_option({}, 'profile'),
+                                  linearize=self.request_option({}, 'linearize'),
+                                  outline=self.request_option({}, 'outline'),
+                                  engine=self.request_option({}, 'engine'))
+        except (MultipartError, ValueError) as e:
+            self.send_error(400, str(e))
+            return
+
+        # Results are streamed as they finish, so the length is unknown up front
+        # (HTTP/1.0: the connection is closed at the end; async front end: chunked)
+        self.send_response(200)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', 'attachment; filename="pdfs_with_bookmarks.zip"')
+        self.end_headers()
+
+        try:
+            batch.run(parser.parts(), self.wfile)
+        except Exception as e:
+            # Headers are already sent; all we can do is log and drop the connection
+            logger.error("❌ Batch aborted: %s", e, exc_info=True)
+            self.abort_response()
+
+    def handle_document_upload(self):
+        """Store an uploaded PDF and return its document ID and page count"""
+        try:
+            logger.debug("📥 Received POST request to /documents")
+            fields = self.read_multipart_request()
+            if fields is None:
+                return
+
+            pdf_data, _, pdf_digest = self.read_multipart_fields(fields, allow_path=True)
+            if not pdf_data:
+                self.send_error(400, "No valid PDF file found in request")
+                return
+            if isinstance(pdf_data, str):
+                # Stored documents are kept in memory; large ones are processed from disk instead
+                remove_file(pdf_data)
+                self.send_json(413, {'success': False, 'reason': 'large_document',
+                                     'error': f"Documents over {LARGE_DOCUMENT_BYTES} bytes can't be stored",
+                                     'message': 'Post the PDF to /embed-bookmarks or /jobs'})
+                return
+
+            store = get_document_store()
+            document = store.get(pdf_digest)
+            if document is None:
+                page_count = get_admission().run_job(get_pool(), count_pages, pdf_data)
+                document = store.add(pdf_digest, pdf_data, page_count)
+                logger.debug("📁 Stored document %s: %d bytes, %d pages", pdf_digest[:12], document.size, page_count)
+            else:
+                logger.debug("📁 Document %s already stored", pdf_digest[:12])
+            self.note(document=pdf_digest[:12], pages=document.page_count)
+
+            self.send_json(201, document.to_json())
+
+        except Exception as e:
+            self.send_processing_error(e)
+
+    def handle_document_embedding(self, document_id):
+        """Embed bookmarks into a stored document; the body is only bookmark JSON"""
+        try:
+            logger.debug("📥 Received bookmark-only request for document %s", document_id[:12])
+            self.note(document=document_id[:12])
+            document = get_document_store().get(document_id)
+            if document is None:
+                self.send_json(404, {
+                    'success': False,
+                    'error': 'Unknown or expired document',
+                    'message': 'Upload the PDF again to /documents'
+                })
+                return
+
+            content_length = int(self.headers.get('Content-Length') or 0)
+            if self.body_is_chunked():
+                body = self.rfile.read()
+            else:
+                body = self.rfile.read(content_length) if content_length else b''
+            try:
+                payload = json.loads(body.decode('utf-8')) if body.strip() else {}
+                if isinstance(payload, list):
+                    payload = {'bookmarks': payload}
+                bookmark_data = payload.get('bookmarks') or None
+                verify_level = normalize_verify_level(payload.get('verify') or self.request_option({}, 'verify'))
+                profile = normalize_output_profile(payload.get('profile') or self.request_option({}, 'profile'))
+                linearize = normalize_linearize(payload.get('linearize', self.request_option({}, 'linearize')))
+                outline = normalize_outline_mode(payload.get('outline') or self.request_option({}, 'outline'))
+                engine = normalize_engine(payload.get('engine') or self.request_option({}, 'engine'), profile)
+            except (ValueError, AttributeError) as e:
+                self.send_error(400, f"Invalid bookmark JSON: {e}")
+                return
 
-            print(f"📁 Processing PDF: {len(pdf_data)} bytes")
             if bookmark_data:
-                print(f"📋 Custom bookmarks provided: {len(bookmark_data)} items")
+                logger.debug("📋 Custom bookmarks provided: %d items", len(bookmark_data))
 
-            # Process PDF with bookmarks
-            processed_pdf = self.add_bookmarks_to_pdf(pdf_data, bookmark_data)
+            self.respond_with_bookmarks(document_id, document.read, bookmark_data, verify_level, profile, linearize,
+                                        outline, engine=engine)
+
+        except Exception as e:
+            self.send_processing_error(e)
+
+    def send_document_search(self, document_id):
+        """Find the pages of a stored document that contain the words of ?q=
+
+        The first search builds the document's text index; if that takes
+        longer than SEARCH_WAIT_SECONDS the answer covers the pages indexed
+        so far and ``complete`` is false.
+        """
+        started = time.perf_counter()
+        query = (self.query.get('q') or [''])[0].strip()
+        if not query:
+            self.send_error(400, "Missing search query (?q=)")
+            return
+        try:
+            limit = min(MAX_SEARCH_RESULTS, max(1, int((self.query.get('limit') or [20])[0])))
+        except ValueError:
+            self.send_error(400, "Invalid limit")
+            return
+
+        document = get_document_store().get(document_id)
+        if document is None:
+            self.send_json(404, {
+                'success': False,
+                'error': 'Unknown or expired document',
+                'message': 'Upload the PDF again to /documents'
+            })
+            return
+
+        index = get_text_index_cache().get(document_id, document.page_count, document.read)
+        if index.building:
+            index.wait(SEARCH_WAIT_SECONDS)
+        if index.error is not None:
+            if get_document_store().get(document_id) is None:
+                # Removed from the store while its text was being extracted
+                self.send_json(410, {'success': False, 'error': 'Document is no longer stored',
+                                     'message': 'Upload the PDF again to /documents'})
+                return
+            self.send_json(500, {'success': False, 'error': index.error, 'message': 'Failed to index PDF text'})
+            return
+
+        total, results = index.search(query, limit)
+        self.note(document=document_id[:12], hits=total)
+        self.send_json(200, {
+            'success': True,
+            'document_id': document_id,
+            'query': query,
+            'page_count': index.page_count,
+            'indexed_pages': index.indexed_pages,
+            'complete': index.complete,
+            'total': total,
+            'results': results,
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+        })
+
+    def send_thumbnails(self, document_id):
+        """Send page thumbnails of a stored document
+
+        ``?page=N`` returns one image; ``?pages=1-20`` (or ``1,4,10-12``)
+        returns JSON with a data URI per page. ``dpi`` and ``format``
+        (jpeg or png) pick the rendering. Only pages not yet in the
+        thumbnail cache are rendered.
+        """
+        try:
+            document = get_document_store().get(document_id)
+            if document is None:
+                self.send_json(404, {
+                    'success': False,
+                    'error': 'Unknown or expired document',
+                    'message': 'Upload the PDF again to /documents'
+                })
+                return
+
+            single = self.request_option({}, 'page')
+            batch = self.request_option({}, 'pages')
+            try:
+                dpi = normalize_thumbnail_dpi(self.request_option({}, 'dpi'))
+                image_format = normalize_thumbnail_format(self.request_option({}, 'format'))
+                if (single is None) == (batch is None):
+                    raise ValueError("Give either page=<n> or pages=<ranges>")
+                if batch is None:
+                    pages = parse_page_ranges(single, document.page_count, limit=1)
+                else:
+                    pages = parse_page_ranges(batch, document.page_count)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+
+            etag = thumbnail_etag(document_id, pages, dpi, image_format)
+            self.note(document=document_id[:12], thumbnails=len(pages))
+            if self.etag_matches(etag):
+                self.note(cache='NOT_MODIFIED')
+                self.send_response(304)
+                self.send_cors_headers()
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+
+            images = get_thumbnail_cache().get(document_id, pages, dpi, image_format, document.read)
+            if batch is None:
+                data, width, height = images[pages[0]]
+                body = data
+                content_type = THUMBNAIL_FORMATS[image_format]
+            else:
+                prefix = f"data:{THUMBNAIL_FORMATS[image_format]};base64,"
+                body = json.dumps({
+                    'success': True,
+                    'document_id': document_id,
+                    'page_count': document.page_count,
+                    'dpi': dpi,
+                    'format': image_format,
+                    'thumbnails': [{'page': page, 'width': images[page][1], 'height': images[page][2],
+                                    'src': prefix + base64.b64encode(images[page][0]).decode('ascii')}
+                                   for page in pages],
+                }).encode('utf-8')
+                content_type = 'application/json'
 
-            # Send response
             self.send_response(200)
             self.send_cors_headers()
-            self.send_header('Content-Type', 'application/pdf')
-            self.send_header('Content-Disposition', 'attachment; filename="pdf_with_bookmarks.pdf"')
-            self.send_header('Content-Length', str(len(processed_pdf)))
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            # The document ID is its content hash, so a thumbnail URL never changes meaning
+            self.send_header('Cache-Control', 'public, max-age=31536000, immutable')
             self.end_headers()
-            self.wfile.write(processed_pdf)
+            self.wfile.write(body)
 
-            print(f"✅ PDF processed successfully: {len(processed_pdf)} bytes")
+        except Exception as e:
+            self.send_processing_error(e)
+
+    def handle_job_submission(self):
+        """Queue a PDF for embedding and answer 202 with its job ID straight away"""
+        try:
+            logger.debug("📥 Received POST request to /jobs")
+            fields = self.read_multipart_request()
+            if fields is None:
+                return
+
+            try:
+                verify_level = normalize_verify_level(self.request_option(fields, 'verify'))
+                profile = normalize_output_profile(self.request_option(fields, 'profile'))
+                linearize = normalize_linearize(self.request_option(fields, 'linearize'))
+                outline = normalize_outline_mode(self.request_option(fields, 'outline'))
+                engine = normalize_engine(self.request_option(fields, 'engine'), profile)
+            except ValueError as e:
+                for part in fields.values():
+                    part.close()
+                self.send_error(400, str(e))
+                return
+
+            pdf_data, bookmark_data, pdf_digest = self.read_multipart_fields(fields, allow_path=True)
+            if not pdf_data:
+                self.send_error(400, "No valid PDF file found in request")
+                return
+            pdf_path = pdf_data if isinstance(pdf_data, str) else None
+            if pdf_path is not None:
+                pdf_data = None
+
+            outline = 'auto' if not bookmark_data and outline == 'auto' else None
+            key = cache_key(pdf_digest, bookmark_data, profile=profile, linearize=linearize, outline=outline,
+                            engine=None if engine == 'auto' else engine)
+            job = get_job_manager().submit(key, pdf_data, bookmark_data, verify_level, profile, linearize,
+                                           outline, pdf_digest, pdf_path, engine)
+            job, position = get_job_manager().get(job.job_id)
+            self.note(job=job.job_id[:12], job_status=job.status)
+            self.send_json(202, job.to_json(position), {'Location': f"/jobs/{job.job_id}"})
 
         except Exception as e:
-            print(f"❌ Error processing PDF: {str(e)}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
-            
-            self.send_response(500)
+            self.send_processing_error(e)
+
+    def send_job_status(self, job_id):
+        """Report a job's state and, while queued, its position in the queue"""
+        job, position = get_job_manager().get(job_id)
+        if job is None:
+            self.send_json(404, {'success': False, 'error': 'Unknown or expired job'})
+            return
+        self.send_json(200, job.to_json(position))
+
+    def send_job_result(self, job_id):
+        """Send a finished job's PDF; 202 while it is still pending, 409 if it failed"""
+        job, position = get_job_manager().get(job_id)
+        self.note(job=job_id[:12])
+        if job is None:
+            self.send_json(404, {'success': False, 'error': 'Unknown or expired job'})
+        elif job.status == FAILED:
+            self.send_json(409, job.to_json())
+        elif job.status != DONE:
+            retry_after = get_admission().retry_after
+            self.send_json(202, job.to_json(position), {'Retry-After': str(retry_after)})
+        elif self.etag_matches(job.etag):
+            self.note(cache='NOT_MODIFIED')
+            self.send_response(304)
             self.send_cors_headers()
-            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', job.etag)
             self.end_headers()
-            
-            error_response = {
-                'success': False,
-                'error': str(e),
-                'message': 'Failed to process PDF'
-            }
-            self.wfile.write(json.dumps(error_response).encode('utf-8'))
+        else:
+            stored = job.open_result(get_result_cache())
+            if stored is None:
+                self.send_json(410, {'success': False, 'error': 'Job result evicted from the result cache',
+                                     'message': 'Submit the job again'})
+                return
+            data, file = stored
+            if file is None:
+                self.send_pdf_response(data, job.info, job.etag, job.cache_status)
+                return
+            # Files in JOB_RESULT_DIR and large documents' outputs belong to the job, not the result cache
+            location = f"/jobs/{job_id}/result" if job.result_path else None
+            with file:
+                self.send_pdf_response(None, job.info, job.etag, job.cache_status, file=file, size=job.result_size,
+                                       location=location)
+
+    def send_stored_result(self, key):
+        """Send a processed PDF again by its result ID (the ETag of the original response)
+
+        Serves Range requests, so an interrupted download can resume.
+        """
+        self.note(result=key[:12])
+        etag = f'"{key}"'
+        if self.etag_matches(etag):
+            self.note(cache='NOT_MODIFIED')
+            self.send_response(304)
+            self.send_cors_headers()
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        stored = get_result_cache().open(key) if len(key) == 64 else None
+        if stored is None:
+            self.send_json(404, {'success': False, 'error': 'Unknown or expired result',
+                                 'message': 'Post the PDF to /embed-bookmarks again'})
+            return
+        data, file, info = stored
+        if file is None:
+            self.send_pdf_response(data, info, etag, 'HIT')
+            return
+        with file:
+            self.send_pdf_response(None, info, etag, 'HIT', file=file, size=os.fstat(file.fileno()).st_size)
+
+    def read_multipart_request(self):
+        """Validate headers and stream the multipart body; None if an error was sent"""
+        # Parse multipart form data
+        content_type = self.headers.get('Content-Type', '')
+        logger.debug("📄 Content-Type: %s", content_type)
+
+        if not content_type.startswith('multipart/form-data'):
+            self.send_error(400, "Expected multipart/form-data")
+            return None
+
+        # Get content length (chunked bodies are read to the end instead)
+        content_length_header = self.headers.get('Content-Length')
+        if not content_length_header and not self.body_is_chunked():
+            self.send_error(400, "No Content-Length header")
+            return None
+
+        content_length = int(content_length_header) if content_length_header else None
+        logger.debug("📏 Content-Length: %s", content_length if content_length is not None else 'chunked')
+
+        if content_length == 0:
+            self.send_error(400, "No content provided")
+            return None
+
+        # Stream the body straight into spooled part buffers
+        try:
+            started = time.perf_counter()
+            parser = StreamingMultipartParser(self.rfile, content_type, content_length)
+            fields = parser.parse()
+            parse_seconds = time.perf_counter() - started
+        except MultipartError as e:
+            logger.warning("❌ Invalid multipart body: %s", e)
+            self.send_error(400, str(e))
+            return None
+        STAGE_SECONDS.observe(parser.read_seconds, 'body_read')
+        STAGE_SECONDS.observe(parse_seconds - parser.read_seconds, 'multipart_extract')
+        UPLOAD_BYTES.observe(parser.bytes_read)
+        self.note(bytes_in=parser.bytes_read)
+        return fields
+
+    def respond_with_bookmarks(self, pdf_digest, load_pdf, bookmark_data, verify_level, profile=None,
+                               linearize=None, outline=None, pdf_path=None, engine=None):
+        """Serve a bookmarked PDF from the result cache or by processing it
+
+        ``load_pdf`` is only called on a cache miss. ``outline`` 'auto'
+        detects headings when no bookmarks were sent. A large document is
+        given as ``pdf_path`` instead and processed from that file; the
+        caller deletes it afterwards. ``engine`` names an embedding engine;
+        'auto' or None lets the engine policy choose. Results are cached
+        per engine only when one was asked for by name.
+        """
+        # Same PDF + same bookmarks -> same output; skip PyMuPDF on a hit
+        cache = get_result_cache()
+        profile = normalize_output_profile(profile)
+        linearize = normalize_linearize(linearize)
+        outline = 'auto' if not bookmark_data and outline == 'auto' else None
+        engine = None if engine in (None, 'auto') else engine
+        key = cache_key(pdf_digest, bookmark_data, profile=profile, linearize=linearize, outline=outline,
+                        engine=engine)
+        etag = f'"{key}"'
+        if self.etag_matches(etag):
+            self.note(cache='NOT_MODIFIED')
+            self.send_response(304)
+            self.send_cors_headers()
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        cached = cache.open(key)
+        if cached is not None:
+            processed_pdf, file, info = cached
+            if file is not None:
+                # A spooled or disk-tier result is sent without reading it into memory
+                with file:
+                    size = os.fstat(file.fileno()).st_size
+                    self.send_pdf_response(None, info, etag, 'HIT', file=file, size=size)
+                self.note(pages=info['page_count'], bookmarks=info['bookmarks'], cache='HIT')
+                return
+            cache_status = 'HIT'
+        elif pdf_path is not None:
+            output_path, info = self.add_bookmarks_to_file(pdf_path, bookmark_data, verify_level, profile,
+                                                           linearize, outline)
+            observe_embedding(info)
+            stored = False
+            try:
+                with open(output_path, 'rb') as f:
+                    # The open file stays readable after the cache moves it into place
+                    stored = cache.put_file(key, output_path, info)
+                    self.send_pdf_response(None, info, etag, 'MISS', file=f, size=info['output_bytes'],
+                                           location=None if stored else '')
+            finally:
+                if not stored:
+                    remove_file(output_path)
+            self.note(pages=info['page_count'], bookmarks=info['bookmarks'], cache='MISS', large=True)
+            return
+        else:
+            # Process PDF with bookmarks
+            processed_pdf, info = self.add_bookmarks_to_pdf(load_pdf(), bookmark_data, verify_level, profile,
+                                                            linearize, outline, pdf_digest, engine)
+            observe_embedding(info)
+            cache.put(key, processed_pdf, info)
+            cache_status = 'MISS'
+
+        self.send_pdf_response(processed_pdf, info, etag, cache_status)
+        self.note(bytes_out=len(processed_pdf), pages=info['page_count'],
+                  bookmarks=info['bookmarks'], cache=cache_status, engine=info.get('engine'))
+
+    def send_json(self, status, payload, headers=None):
+        """Send a JSON response with CORS headers"""
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_cors_headers()
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_rejection(self, e, headers=None):
+        """Send a 413/503 admission response (503 carries Retry-After)"""
+        self.note(rejected=e.reason)
+        self.send_json(e.status, e.to_json(), dict(e.headers(), **(headers or {})))
+
+    def send_processing_error(self, e):
+        """Log an unexpected failure and send the JSON error response"""
+        if isinstance(e, AdmissionRejected):
+            self.send_rejection(e)
+            return
+        if isinstance(e, DocumentExpired):
+            self.send_json(410, {'success': False, 'error': str(e), 'message': 'Upload the PDF again to /documents'})
+            return
+        logger.error("❌ Error processing PDF: %s", e, exc_info=True)
+
+        error_response = {
+            'success': False,
+            'error': str(e),
+            'message': 'Failed to process PDF'
+        }
+        self.send_json(500, error_response)
+
+    def etag_matches(self, etag):
+        """True if the request's If-None-Match covers etag"""
+        header = self.headers.get('If-None-Match')
+        if not header:
+            return False
+        candidates = [tag.strip() for tag in header.split(',')]
+        return '*' in candidates or etag in candidates or f'W/{etag}' in candidates
+
+    def send_pdf_response(self, processed_pdf, info, etag, cache_status, file=None, size=None, location=None):
+        """Send a processed PDF (bytes, or an open file of ``size`` bytes) with its metadata headers
+
+        GET requests may ask for byte ranges. Content-Location gives the
+        URL to fetch the same result again, e.g. to resume a download:
+        /results/<key> unless ``location`` names another ('' for none).
+        """
+        size = len(processed_pdf) if processed_pdf is not None else size
+        plan = self.begin_ranged_response('application/pdf', size, etag)
+        if plan is None:
+            return
+        self.send_header('Content-Disposition', 'attachment; filename="pdf_with_bookmarks.pdf"')
+        if location is None:
+            result_key = etag.strip('"')
+            location = f"/results/{result_key}"
+        if location:
+            self.send_header('Content-Location', location)
+        self.send_header('X-Cache', cache_status)
+        self.send_header('X-Verification', info['verification'])
+        self.send_header('X-Page-Count', str(info['page_count']))
+        self.send_header('X-Bookmark-Count', str(info['bookmarks']))
+        if 'profile' in info:
+            self.send_header('X-Output-Profile', info['profile'])
+            save_seconds = info['timings']['tobytes'] + info['timings'].get('linearize', 0)
+            self.send_header('X-Save-Ms', f"{save_seconds * 1000:.1f}")
+            self.send_header('X-Input-Bytes', str(info['input_bytes']))
+            self.send_header('X-Size-Change', size_change(info['input_bytes'], info['output_bytes']))
+            self.send_header('X-Linearized', 'yes' if info.get('linearized') else 'no')
+        if 'outline_source' in info:
+            self.send_header('X-Outline-Source', info['outline_source'])
+        if info.get('memory'):
+            self.send_header('X-Peak-Memory', str(info['memory']['peak_rss_bytes']))
+        if 'engine' in info:
+            self.send_header('X-Engine', info['engine'])
+        if 'outline' in info:
+            self.send_outline_headers(info['outline'])
+        self.end_headers()
+        started = time.perf_counter()
+        written = self.write_ranged_body(plan, data=processed_pdf, file=file)
+        STAGE_SECONDS.observe(time.perf_counter() - started, 'response_write')
+        RESPONSE_BYTES.observe(written)
+        self.note(bytes_out=written)
+
+    def send_outline_headers(self, outline):
+        """Report rejected and adjusted bookmark entries (the first few rejections as JSON)"""
+        self.send_header('X-Bookmarks-Rejected', str(outline['rejected']))
+        self.send_header('X-Levels-Adjusted', str(outline['levels_adjusted']))
+        if outline['rejections']:
+            sample = outline['rejections'][:self.MAX_REJECTIONS_IN_HEADER]
+            self.send_header('X-Bookmark-Rejections', json.dumps(sample, separators=(',', ':')))
 
     def extract_pdf_from_multipart(self, post_data, content_type):
         """Extract PDF data and optional bookmark data from multipart form data"""
         try:
-            # Extract boundary from content type
-            if 'boundary=' not in content_type:
-                print("❌ No boundary found in Content-Type")
-                return None, None
-                
-            boundary = content_type.split('boundary=')[1]
-            # Remove quotes if present
-            if boundary.startswith('"') and boundary.endswith('"'):
-                boundary = boundary[1:-1]
-                
-            boundary_bytes = boundary.encode()
-            print(f"🔗 Boundary: {boundary}")
-            
-            # Split by boundary
-            parts = post_data.split(b'--' + boundary_bytes)
-            print(f"📂 Found {len(parts)} parts")
-            
-            pdf_data = None
-            bookmark_data = None
-            
-            for i, part in enumerate(parts):
-                print(f"📄 Part {i}: {len(part)} bytes")
-                if len(part) > 10:  # Show content for all substantial parts
-                    # Show the beginning of each part to see headers
-                    part_preview = part[:300].decode('utf-8', errors='ignore')
-                    print(f"📋 Part {i} headers: {part_preview}")
-                
-                # Extract PDF file
-                if b'name="pdf"' in part:  # More flexible matching
-                    print("✅ Found PDF part")
-                    header_end = part.find(b'\r\n\r\n')
-                    if header_end != -1:
-                        pdf_data = part[header_end + 4:]
-                        # Remove trailing boundary markers and newlines
-                        if pdf_data.endswith(b'\r\n'):
-                            pdf_data = pdf_data[:-2]
-                        if pdf_data.endswith(b'--'):
-                            pdf_data = pdf_data[:-2]
-                        print(f"📄 Extracted PDF data: {len(pdf_data)} bytes")
-                        
-                        # Validate PDF data
-                        if len(pdf_data) < 100:
-                            print("❌ PDF data too small")
-                            continue
-                        
-                        if not pdf_data.startswith(b'%PDF'):
-                            print("❌ Invalid PDF header")
-                            continue
-                
-                # Extract bookmark data (optional)
-                elif b'name="bookmarks"' in part:  # More flexible matching
-                    print("✅ Found bookmarks part")
-                    header_end = part.find(b'\r\n\r\n')
-                    if header_end != -1:
-                        bookmark_data = part[header_end + 4:]
-                        if bookmark_data.endswith(b'\r\n'):
-                            bookmark_data = bookmark_data[:-2]
-                        if bookmark_data.endswith(b'--'):
-                            bookmark_data = bookmark_data[:-2]
-                        
-                        try:
-                            bookmark_data = json.loads(bookmark_data.decode('utf-8'))
-                            print(f"📋 Extracted bookmark data: {len(bookmark_data)} bookmarks")
-                        except:
-                            print("⚠️ Invalid bookmark data, using defaults")
-                            bookmark_data = None
-
-            if not pdf_data:
-                print("❌ No PDF data found")
-                return None, None
-                
+            parser = StreamingMultipartParser(io.BytesIO(post_data), content_type, len(post_data))
+            pdf_data, bookmark_data, _ = self.read_multipart_fields(parser.parse())
             return pdf_data, bookmark_data
-            
         except Exception as e:
-            print(f"❌ Error extracting data: {e}")
+            logger.warning("❌ Error extracting data: %s", e)
             return None, None
 
-    def add_bookmarks_to_pdf(self, pdf_data, custom_bookmarks=None):
-        """Add bookmarks to PDF using PyMuPDF with custom or default bookmarks"""
-        try:
-            # Open PDF document
-            doc = fitz.open(stream=pdf_data, filetype="pdf")
-            print(f"📄 PDF loaded: {doc.page_count} pages")
-
-            # Create Table of Contents (TOC) structure
-            toc = []
-            
-            if custom_bookmarks:
-                # Use custom bookmarks from the viewer
-                print(f"📋 Using custom bookmarks: {len(custom_bookmarks)} items")
-                for bookmark in custom_bookmarks:
-                    if bookmark['page'] <= doc.page_count:
-                        toc.append([
-                            bookmark.get('level', 1),
-                            bookmark['title'],
-                            bookmark['page']
-                        ])
-                        print(f"✅ Added custom bookmark: {bookmark['title']} (Page {bookmark['page']})")
-                    else:
-                        print(f"⚠️ Skipped bookmark {bookmark['title']} - page {bookmark['page']} exceeds document length")
-            else:
-                # Use default bookmarks for pages 1, 3, and 6
-                print("📋 Using default bookmarks (pages 1, 3, 6)")
-                if doc.page_count >= 1:
-                    toc.append([1, "📄 Page 1", 1])
-                    print("✅ Added default bookmark for Page 1")
-                
-                if doc.page_count >= 3:
-                    toc.append([1, "📄 Page 3", 3])
-                    print("✅ Added default bookmark for Page 3")
-                
-                if doc.page_count >= 6:
-                    toc.append([1, "📄 Page 6", 6])
-                    print("✅ Added default bookmark for Page 6")
-
-            print(f"📋 Final TOC structure: {toc}")
-
-            # Set the table of contents
-            if toc:
-                doc.set_toc(toc)
-                print("✅ Table of contents set successfully")
+    def request_option(self, fields, name):
+        """Read a per-request option from a form field or the query string"""
+        part = fields.get(name)
+        if part is not None and isinstance(part.value, bytes):
+            return part.value.decode('utf-8', errors='replace').strip()
+        values = getattr(self, 'query', {}).get(name)
+        return values[0] if values else None
+
+    def read_multipart_fields(self, fields, allow_path=False):
+        """Return (pdf_bytes, bookmarks, sha256) from parsed parts, releasing their spools
+
+        With ``allow_path`` a large document (over LARGE_DOCUMENT_BYTES) is
+        returned as the path of its spooled file instead of bytes; the
+        caller then owns that file.
+        """
+        pdf_part = fields.pop('pdf', None)
+        bookmarks_part = fields.pop('bookmarks', None)
+        for part in fields.values():
+            part.close()
+
+        bookmark_data = None
+        if bookmarks_part is not None:
+            if bookmarks_part.error is None and isinstance(bookmarks_part.value, list):
+                bookmark_data = bookmarks_part.value
+                logger.debug("📋 Extracted bookmark data: %d bookmarks", len(bookmark_data))
             else:
-                print("⚠️ No bookmarks to add")
+                logger.warning("⚠️ Invalid bookmark data, using defaults")
 
-            # Save to bytes
-            pdf_bytes = doc.tobytes()
-            doc.close()
-            
-            # Verify the result by reopening and checking TOC
-            doc_verify = fitz.open(stream=pdf_bytes, filetype="pdf")
-            verify_toc = doc_verify.get_toc()
-            print(f"✅ Verification - TOC in result: {verify_toc}")
-            doc_verify.close()
+        if pdf_part is None or pdf_part.file is None:
+            logger.warning("❌ No PDF data found")
+            return None, None, None
 
-            print(f"📄 PDF with bookmarks created: {len(pdf_bytes)} bytes")
-            return pdf_bytes
+        logger.debug("📄 Extracted PDF data: %d bytes", pdf_part.size)
+        # Validate PDF data
+        if pdf_part.size < 100:
+            logger.warning("❌ PDF data too small")
+            pdf_part.close()
+            return None, None, None
+        if not pdf_part.head(4).startswith(b'%PDF'):
+            logger.warning("❌ Invalid PDF header")
+            pdf_part.close()
+            return None, None, None
 
-        except Exception as e:
-            print(f"❌ Error adding bookmarks: {e}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
-            raise
+        if allow_path and pdf_part.large:
+            return pdf_part.detach_path(), bookmark_data, pdf_part.sha256
+        return pdf_part.read_bytes(), bookmark_data, pdf_part.sha256
+
+    def add_bookmarks_to_pdf(self, pdf_data, custom_bookmarks=None, verify_level=None, profile=None,
+                             linearize=None, outline=None, pdf_digest=None, engine=None):
+        """Add bookmarks to PDF with custom or default bookmarks
+
+        The work runs in the shared process pool so this request thread
+        only waits on it; admission control caps how many such jobs run or
+        wait. With outline 'auto' and no custom bookmarks the headings are
+        first detected by scanning page ranges across the pool, each range
+        under its own job slot. The engine policy picks the engine unless
+        ``engine`` names one. Returns (pdf_bytes, info).
+        """
+        admission = get_admission()
+        policy = get_engine_policy()
+        if custom_bookmarks or outline != 'auto':
+            chosen = policy.choose(len(pdf_data), len(custom_bookmarks or ()), profile, engine)
+            return admission.run_job(get_pool(), embed_document, pdf_data, custom_bookmarks,
+                                     verify_level, profile, linearize, None, chosen, policy.fallback(engine))
+
+        # The outliner takes a job slot per page range it scans
+        detected = get_auto_outliner().outline(pdf_data, pdf_digest) or None
+        chosen = policy.choose(len(pdf_data), len(detected or ()), profile, engine)
+        pdf_bytes, info = admission.run_job(get_pool(), embed_document, pdf_data, detected,
+                                            verify_level, profile, linearize, 'pages', chosen,
+                                            policy.fallback(engine))
+        info['outline_source'] = 'auto' if detected else 'pages'
+        return pdf_bytes, info
+
+    def add_bookmarks_to_file(self, pdf_path, custom_bookmarks=None, verify_level=None, profile=None,
+                              linearize=None, outline=None):
+        """Large-document variant of add_bookmarks_to_pdf working on a spooled upload
+
+        The worker opens the file itself (and detects headings for outline
+        'auto' in the same pass), so the document never crosses the pool
+        as bytes. Only PyMuPDF works from files, so no other engine is
+        used. Returns (output_path, info); see embed_bookmarks_file.
+        """
+        output_path, info = get_admission().run_job(get_pool(), embed_bookmarks_file, pdf_path, custom_bookmarks,
+                                                    verify_level, profile, linearize, outline)
+        info['engine'] = 'pymupdf'
+        return output_path, info
+
+
+class AsyncPDFBookmarkHandler(AsyncHandlerMixin, PDFBookmarkHandler):
+    """PDFBookmarkHandler served by the asyncio front end (keep-alive, chunked bodies)"""
+
+
+def create_server(server_address, handler_class=None, mode=None, sock=None):
+    """Create the HTTP front end selected by mode or SERVER_MODE
+
+    threaded (default): one thread per connection, HTTP/1.0.
+    async: one event loop for all connections, HTTP/1.1 keep-alive and
+    chunked bodies; a handler thread is only taken once a request has
+    fully arrived.
+    Either way PDF processing is handed to the worker pool (PDF_WORKERS,
+    default: CPU count) so /health and static files stay responsive
+    while large documents are being processed.
+    With ``sock`` (an inherited, listening socket) server_address is not bound.
+    """
+    mode = (mode or os.environ.get('SERVER_MODE') or 'threaded').lower()
+    if mode not in SERVER_MODES:
+        raise ValueError(f"Unknown SERVER_MODE {mode!r} (expected one of {', '.join(SERVER_MODES)})")
+
+    preload_static_assets()
+    workers = get_pool().max_workers or 'inline'
+    if mode == 'async':
+        httpd = AsyncHTTPServer(server_address, handler_class or AsyncPDFBookmarkHandler,
+                                admission=get_admission(), sock=sock, graceful_timeout=prefork.GRACEFUL_TIMEOUT)
+        logger.info("⚙️ Asyncio HTTP/1.1 front end, %d handler thread(s), %s PDF worker(s)",
+                    httpd.executor._max_workers, workers)
+    else:
+        httpd = prefork.GracefulHTTPServer(server_address, handler_class or PDFBookmarkHandler,
+                                           bind_and_activate=sock is None)
+        if sock is not None:
+            httpd.socket.close()
+            httpd.socket = sock
+            httpd.server_address = sock.getsockname()
+            httpd.server_name, httpd.server_port = httpd.server_address[:2]
+        logger.info("⚙️ Threaded front end, %s PDF worker(s)", workers)
+    return httpd
+
+
+def report_ready():
+    """Record time-to-ready, then preload PyMuPDF and start the workers in the background
+
+    Jobs run in the worker processes, so this process only needs PyMuPDF
+    for page counts before auto outlines, unless jobs run inline.
+    """
+    pool = get_pool()
+    modules = get_engine_policy().modules()
+    get_startup().ready(pool, ['fitz'] + (modules if not pool.max_workers else []), ['engines'] + modules)
+
+
+def stop_gracefully(httpd, force=False):
+    """Stop accepting connections; with force (a second Ctrl-C) stop at once instead"""
+    if getattr(httpd, 'stop_requested', False):
+        if force:
+            raise KeyboardInterrupt
+        return
+    httpd.stop_requested = True
+    logger.info("🛑 Stopping: finishing requests and jobs in progress (up to %g s)", prefork.GRACEFUL_TIMEOUT)
+    # shutdown() waits for serve_forever() to return, so it can't run on the serving thread
+    threading.Thread(target=httpd.shutdown, name='shutdown', daemon=True).start()
+
+
+def serve(httpd):
+    """Serve until stopped, reporting time-to-ready once connections are accepted
+
+    SIGTERM and SIGINT stop accepting connections, then let the requests
+    and jobs in progress finish for up to GRACEFUL_TIMEOUT seconds, so a
+    deploy does not cut off uploads. In a pre-fork server process the
+    sibling socket opens first; the supervisor takes it as the sign that
+    the process is listening.
+    """
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_gracefully(httpd))
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_gracefully(httpd, force=True))
+    if prefork.is_worker():
+        prefork.start_internal_server(PDFBookmarkHandler)
+        prefork.watch_supervisor(lambda: stop_gracefully(httpd))
+    if isinstance(httpd, AsyncHTTPServer):
+        httpd.on_ready = report_ready  # the event loop binds the socket inside serve_forever()
+    else:
+        report_ready()
+    httpd.serve_forever()
+
+    # The sibling socket stays open meanwhile, so jobs here can still be polled through other processes
+    deadline = time.monotonic() + prefork.GRACEFUL_TIMEOUT
+    if not isinstance(httpd, AsyncHTTPServer):
+        httpd.drain(prefork.GRACEFUL_TIMEOUT)  # the async front end drains inside serve_forever()
+    jobs = get_job_manager()
+    if not prefork.wait_until(lambda: jobs.active() == 0, max(0, deadline - time.monotonic())):
+        logger.warning("⚠️ Stopped with %d job(s) unfinished", jobs.active())
+    prefork.stop_internal_server()
+    httpd.server_close()
+    logger.info("👋 Server stopped")
+
+
+def start(server_address):
+    """Serve on server_address, or supervise SERVER_PROCESSES server processes that share it"""
+    processes = prefork.server_processes()
+    if processes > 1 and not prefork.is_worker():
+        prefork.supervise(server_address, processes, __file__)
+        return
+    httpd = create_server(server_address, sock=prefork.inherited_socket())
+    logger.info("✅ Server ready! Listening on all interfaces, port %d", server_address[1])
+    serve(httpd)
 
 
 def main():
     """Start the PDF bookmark server"""
-    import os
     port = int(os.environ.get('PORT', 8081))
     server_address = ('', port)
     
-    print(f"🚀 Starting PDF Bookmark Server on port {port}")
-    print(f"📱 iOS Safari compatible")
-    print(f"🔗 Health check: http://localhost:{port}/health")
-    print(f"📄 API endpoint: http://localhost:{port}/embed-bookmarks")
-    print(f"🌐 Network access: http://0.0.0.0:{port}")
+    logger.info("🚀 Starting PDF Bookmark Server on port %d", port)
+    logger.info("📱 iOS Safari compatible")
+    logger.info("🔗 Health check: http://localhost:%d/health", port)
+    logger.info("📄 API endpoint: http://localhost:%d/embed-bookmarks", port)
+    logger.info("🌐 Network access: http://0.0.0.0:%d", port)
     
     try:
-        httpd = HTTPServer(server_address, PDFBookmarkHandler)
-        print(f"✅ Server ready! Listening on all interfaces, port {port}")
-        httpd.serve_forever()
+        start(server_address)
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        logger.info("🛑 Server stopped by user")
     except Exception as e:
-        print(f"❌ Server error: {e}")
+        logger.error("❌ Server error: %s", e)
+    finally:
+        get_pool().shutdown()
 
 
 def run_server(port=8081):
     """Start server with specified port (for production use)"""
     server_address = ('', port)
     
-    print(f"🚀 Starting PDF Bookmark Server on port {port}")
-    print(f"📱 iOS Safari compatible")
+    logger.info("🚀 Starting PDF Bookmark Server on port %d", port)
+    logger.info("📱 iOS Safari compatible")
     
     try:
-        httpd = HTTPServer(server_address, PDFBookmarkHandler)
-        print(f"✅ Server ready! Listening on all interfaces, port {port}")
-        httpd.serve_forever()
+        start(server_address)
     except Exception as e:
-        print(f"❌ Server error: {e}")
+        logger.error("❌ Server error: %s", e)
         raise
+    finally:
+        get_pool().shutdown()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Offline bulk bookmark embedding
+Runs the same embedding code as the HTTP server over a directory or glob
+of PDFs using every core, without starting a server.
+
+Examples:
+    python server/bulk_embed.py archive/ -o out/
+    python server/bulk_embed.py "archive/**/*.pdf" -o out/ --manifest bookmarks.csv
+"""
+
+import argparse
+import csv
+import glob
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+from auto_outline import OUTLINE_MODES
+from pdf_embedder import OUTPUT_PROFILES, VERIFY_LEVELS, embed_bookmarks, normalize_linearize
+from structured_log import setup_logging
+
+
+def load_manifest(path):
+    """Load {relative_path: [bookmarks]} from a JSON object or a CSV file
+
+    CSV files need a header with file,title,page and optionally level;
+    each row adds one bookmark to that file.
+    """
+    if path is None:
+        return {}
+    if path.lower().endswith('.csv'):
+        manifest = {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                manifest.setdefault(os.path.normpath(row['file']), []).append({
+                    'title': row['title'],
+                    'page': int(row['page']),
+                    'level': int(row.get('level') or 1),
+                })
+        return manifest
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("JSON manifest must map file paths to bookmark lists")
+    return {os.path.normpath(key): value for key, value in data.items()}
+
+
+def find_inputs(source, recursive=True, exclude=None):
+    """Return (base_dir, [relative paths]) for a directory or a glob pattern
+
+    Files below ``exclude`` (the output directory) are left out, so an
+    output directory inside the source is not scanned as input.
+    """
+    if os.path.isdir(source):
+        base = source
+        pattern = os.path.join(source, '**', '*.pdf') if recursive else os.path.join(source, '*.pdf')
+        paths = glob.glob(pattern, recursive=recursive)
+    else:
+        # Outputs mirror the path below the last directory without wildcards
+        base = os.path.dirname(re.split(r'[*?\[]', source, 1)[0])
+        paths = glob.glob(source, recursive=True)
+    base = base or '.'
+    if exclude is not None:
+        exclude = os.path.join(os.path.realpath(exclude), '')
+        paths = [path for path in paths if not os.path.realpath(path).startswith(exclude)]
+    files = sorted(os.path.relpath(path, base) for path in paths if os.path.isfile(path))
+    return base, files
+
+
+def is_up_to_date(input_path, output_path, manifest_mtime):
+    """True if output exists and is newer than both its input and the manifest"""
+    try:
+        output_mtime = os.stat(output_path).st_mtime
+    except OSError:
+        return False
+    return output_mtime >= max(os.stat(input_path).st_mtime, manifest_mtime)
+
+
+def process_file(task):
+    """Worker: embed bookmarks into one file and write it atomically"""
+    input_path, output_path, bookmarks, verify_level, profile, linearize, outline = task
+    started = time.perf_counter()
+    result = {'input': input_path, 'output': output_path}
+    try:
+        with open(input_path, 'rb') as f:
+            pdf_data = f.read()
+        result['input_size'] = len(pdf_data)
+        pdf_bytes, info = embed_bookmarks(pdf_data, bookmarks, verify_level, profile, linearize, outline)
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        tmp_path = output_path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(pdf_bytes)
+        os.replace(tmp_path, output_path)
+        result.update(status='ok', output_size=len(pdf_bytes), pages=info['page_count'],
+                      bookmarks=info['bookmarks'], outline_source=info['outline_source'])
+    except Exception as e:
+        result.update(status='error', error=f"{type(e).__name__}: {e}")
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed bookmarks into many PDFs without the HTTP server")
+    parser.add_argument('source', help="Input directory or glob pattern (quote it)")
+    parser.add_argument('-o', '--output', required=True, help="Output directory")
+    parser.add_argument('-m', '--manifest', help="JSON or CSV mapping files to bookmark lists (default: pages 1/3/6)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="Worker processes (default: CPU count)")
+    parser.add_argument('--verify', choices=VERIFY_LEVELS, default='off', help="Verification level (default: off)")
+    parser.add_argument('--profile', choices=list(OUTPUT_PROFILES),
+                        help="Output profile: fast, balanced or smallest (default: PDF_OUTPUT_PROFILE or fast)")
+    parser.add_argument('--linearize', action='store_true', default=None,
+                        help="Write linearized (fast web view) PDFs; needs pikepdf")
+    parser.add_argument('--outline', choices=OUTLINE_MODES,
+                        help="Bookmarks for files without a manifest entry: pages (1/3/6) or auto (detected headings)")
+    parser.add_argument('--only-manifest', action='store_true', help="Skip files that are not listed in the manifest")
+    parser.add_argument('--no-resume', action='store_true', help="Reprocess files whose output is already up to date")
+    parser.add_argument('--no-recursive', action='store_true', help="Only scan the top level of an input directory")
+    parser.add_argument('--failures', help="Write failed files and errors to this JSON file")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Log per-file embedding details (LOG_LEVEL=DEBUG)")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        setup_logging('DEBUG')
+    if args.linearize:
+        try:
+            normalize_linearize(True)
+        except ValueError as e:
+            parser.error(str(e))
+
+    manifest = load_manifest(args.manifest)
+    manifest_mtime = os.stat(args.manifest).st_mtime if args.manifest else 0
+    base, files = find_inputs(args.source, recursive=not args.no_recursive, exclude=args.output)
+
+    tasks = []
+    skipped = 0
+    for relative in files:
+        key = os.path.normpath(relative)
+        if args.only_manifest and key not in manifest:
+            continue
+        input_path = os.path.join(base, relative)
+        output_path = os.path.join(args.output, relative)
+        if not args.no_resume and is_up_to_date(input_path, output_path, manifest_mtime):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path, manifest.get(key), args.verify, args.profile, args.linearize,
+                      args.outline))
+
+    print(f"📂 {len(files)} PDFs found, {skipped} already up to date, {len(tasks)} to process "
+          f"with {args.jobs} worker(s)")
+
+    started = time.perf_counter()
+    ok = 0
+    failed = []
+    bytes_in = 0
+    bytes_out = 0
+    last_report = started
+
+    with multiprocessing.Pool(processes=args.jobs) as pool:
+        chunksize = max(1, min(64, len(tasks) // (args.jobs * 8) or 1))
+        for done, result in enumerate(pool.imap_unordered(process_file, tasks, chunksize=chunksize), 1):
+            bytes_in += result.get('input_size', 0)
+            if result['status'] == 'ok':
+                ok += 1
+                bytes_out += result['output_size']
+            else:
+                failed.append(result)
+                print(f"❌ {result['input']}: {result['error']}")
+
+            now = time.perf_counter()
+            if now - last_report >= 5 or done == len(tasks):
+                elapsed = now - started
+                print(f"⏱️ {done}/{len(tasks)} files, {done / elapsed:.1f} files/s")
+                last_report = now
+
+    elapsed = time.perf_counter() - started
+    print("=" * 50)
+    print(f"✅ Processed: {ok}   ⏭️ Skipped: {skipped}   ❌ Failed: {len(failed)}")
+    if tasks:
+        print(f"⏱️ {elapsed:.1f} s, {len(tasks) / elapsed:.1f} files/s, "
+              f"{format_bytes(bytes_in / elapsed)}/s read, {format_bytes(bytes_out)} written")
+
+    if args.failures and failed:
+        with open(args.failures, 'w', encoding='utf-8') as f:
+            json.dump(failed, f, indent=2)
+        print(f"📋 Failures written to {args.failures}")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+HTTP byte ranges (RFC 9110 section 14)
+Parses Range headers into merged (start, end) pairs and lays out
+multipart/byteranges bodies, so interrupted downloads can resume and
+PDF viewers can fetch only the parts of a file they need
+"""
+
+import os
+
+# More ranges than this are answered with the whole body, as RFC 9110 allows
+MAX_RANGES = int(os.environ.get('MAX_RANGES', 16))
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlaps the content; answer 416"""
+
+
+def parse_range_header(header, size, max_ranges=MAX_RANGES):
+    """Byte ranges requested by a Range header, as sorted inclusive (start, end) pairs
+
+    Returns None when the whole body should be sent instead: no header, a
+    unit other than bytes, a malformed header or too many ranges.
+    Overlapping and adjacent ranges are merged. Raises RangeNotSatisfiable
+    if no range overlaps a body of ``size`` bytes.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+    specs = spec.split(',')
+    if len(specs) > max_ranges:
+        return None
+    ranges = []
+    for part in specs:
+        first, dash, last = part.strip().partition('-')
+        if not dash or not (first.isdigit() or (not first and last.isdigit())):
+            return None
+        if last and not last.isdigit():
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(0, size - length), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    if not ranges or size == 0:
+        raise RangeNotSatisfiable()
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def content_range(start, end, size):
+    return f"bytes {start}-{end}/{size}"
+
+
+def multipart_layout(ranges, size, content_type, boundary):
+    """Part heads and closing delimiter of a multipart/byteranges body
+
+    Returns ([(head_bytes, start, end), ...], tail_bytes, content_length).
+    """
+    parts = []
+    length = 0
+    for start, end in ranges:
+        head = (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Range: {content_range(start, end, size)}\r\n\r\n").encode('ascii')
+        parts.append((head, start, end))
+        length += len(head) + end - start + 1
+    tail = f"\r\n--{boundary}--\r\n".encode('ascii')
+    return parts, tail, length + len(tail)
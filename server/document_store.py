@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Server-side document store for upload-once sessions
+A client uploads a PDF once and later sends only bookmark lists against
+its document ID. Entries expire by TTL and by a total byte budget.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class DocumentExpired(Exception):
+    """The stored document was deleted, expired or evicted while a request was using it"""
+
+
+class StoredDocument:
+    """Metadata for one stored PDF; the bytes live in memory or on disk"""
+
+    def __init__(self, document_id, size, page_count, expires_at, data=None, path=None):
+        self.document_id = document_id
+        self.size = size
+        self.page_count = page_count
+        self.expires_at = expires_at
+        self.data = data
+        self.path = path
+
+    def read(self):
+        """Return the stored PDF bytes
+
+        Raises DocumentExpired if the document's file has been removed
+        from the store since it was looked up.
+        """
+        if self.data is not None:
+            return self.data
+        try:
+            with open(self.path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            raise DocumentExpired(f"Document {self.document_id[:12]} is no longer stored") from None
+
+    def to_json(self, now=None):
+        now = time.time() if now is None else now
+        return {
+            'document_id': self.document_id,
+            'page_count': self.page_count,
+            'size': self.size,
+            'expires_in': max(0, int(self.expires_at - now)),
+        }
+
+
+class DocumentStore:
+    """TTL + byte-budget store of uploaded PDFs keyed by their SHA-256
+
+    Using the content hash as the ID makes re-uploads of the same file free
+    and lets bookmark-only requests share the result cache with
+    /embed-bookmarks. With ``directory`` unset documents are kept in memory.
+    """
+
+    def __init__(self, ttl=3600, budget=512 * 1024 * 1024, directory=None):
+        self.ttl = ttl
+        self.budget = budget
+        self.directory = directory
+        self._documents = OrderedDict()  # least recently used first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Configure from DOCUMENT_TTL_SECONDS, DOCUMENT_STORE_BYTES and DOCUMENT_STORE_DIR"""
+        return cls(
+            ttl=int(os.environ.get('DOCUMENT_TTL_SECONDS', 3600)),
+            budget=int(os.environ.get('DOCUMENT_STORE_BYTES', 512 * 1024 * 1024)),
+            directory=os.environ.get('DOCUMENT_STORE_DIR') or None,
+        )
+
+    def get(self, document_id):
+        """Return the StoredDocument for an ID, refreshing its TTL, or None"""
+        with self._lock:
+            self._expire(time.time())
+            document = self._documents.get(document_id)
+            if document is None:
+                return None
+            document.expires_at = time.time() + self.ttl
+            self._documents.move_to_end(document_id)
+            return document
+
+    def add(self, document_id, pdf_data, page_count):
+        """Store a PDF under its content hash and return its StoredDocument"""
+        existing = self.get(document_id)
+        if existing is not None:
+            return existing
+
+        size = len(pdf_data)
+        if size > self.budget:
+            raise ValueError(f"Document of {size} bytes exceeds the store budget of {self.budget} bytes")
+
+        path = None
+        data = pdf_data
+        if self.directory:
+            fd, path = tempfile.mkstemp(dir=self.directory, prefix=document_id[:16] + '-', suffix='.pdf')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_data)
+            data = None
+
+        document = StoredDocument(document_id, size, page_count, time.time() + self.ttl, data=data, path=path)
+        with self._lock:
+            previous = self._documents.pop(document_id, None)
+            if previous is not None:
+                self._drop(previous)
+            self._documents[document_id] = document
+            self._bytes += size
+            self._expire(time.time())
+        return document
+
+    def remove(self, document_id):
+        """Delete a document; returns True if it existed"""
+        with self._lock:
+            document = self._documents.pop(document_id, None)
+            if document is None:
+                return False
+            self._drop(document)
+            return True
+
+    def _drop(self, document):
+        self._bytes -= document.size
+        # In-memory bytes are left to the GC; a request may still be reading them
+        if document.path:
+            try:
+                os.unlink(document.path)
+            except OSError:
+                pass
+
+    def _expire(self, now):
+        """Evict expired entries, then least recently used ones over budget"""
+        for document_id in [key for key, doc in self._documents.items() if doc.expires_at <= now]:
+            self._drop(self._documents.pop(document_id))
+        while self._bytes > self.budget and self._documents:
+            _, document = self._documents.popitem(last=False)
+            self._drop(document)
+
+    def stats(self):
+        """Counts and sizes for /health"""
+        with self._lock:
+            self._expire(time.time())
+            return {
+                'documents': len(self._documents),
+                'bytes': self._bytes,
+                'budget': self.budget,
+                'ttl': self.ttl,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_document_store():
+    """Return the process-wide document store, creating it on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore.from_env()
+        return _store
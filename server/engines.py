@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Embedding engines
+The same job (write an outline into a PDF) done by different libraries:
+PyMuPDF (the default, see pdf_embedder), qpdf through pikepdf, and the
+pure-Python pypdf and pdfbookmarker (PyPDF2). Which one is fastest
+depends on the document, so a policy can pick an engine per request
+from its size and outline. Without one every document goes to PyMuPDF;
+benchmarks/run_benchmarks.py --suite engines measures the engines on a
+corpus and can write a policy for ENGINE_POLICY_FILE.
+"""
+
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from auto_outline import detect_headings
+from lazy_import import lazy_module
+from pdf_embedder import (build_toc, check_outline, embed_bookmarks, embedding_info, linearize_pdf,
+                          normalize_linearize, normalize_output_profile, normalize_verify_level, verify_full)
+from peak_memory import PeakMemory
+from structured_log import get_logger
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+pikepdf = lazy_module('pikepdf', optional=True)  # optional: pip install pikepdf
+pypdf = lazy_module('pypdf', optional=True)  # optional: pip install pypdf
+pdfbookmarker = lazy_module('pdfbookmarker', optional=True)  # optional: pip install pdfbookmarker
+
+logger = get_logger('engines')
+
+DEFAULT_ENGINE = 'pymupdf'
+
+# Where the path-based pdfbm() gets its files when memfd_create is missing
+PDFBOOKMARKER_TMPDIR = os.environ.get('PDFBOOKMARKER_TMPDIR') or (
+    '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None)
+
+
+class Engine:
+    """One library's way of writing an outline
+
+    Subclasses open the document, count its pages, write the TOC built by
+    build_toc and save; embed() does the rest (auto outline, verification,
+    linearization and the info dict) the same way for every engine, and
+    times the stages under PyMuPDF's names (fitz_open, set_toc, tobytes)
+    so the stage metrics compare across engines.
+    """
+
+    name = None
+    module = None  # the library's import name, preloaded at startup when the policy may pick the engine
+    profiles = ('fast',)  # output profiles the engine can honour
+    linearizes = False  # True if write() can produce linearized output itself
+    lossless = True  # False if objects outside the pages (attachments, forms, ...) are dropped
+
+    def available(self):
+        return True
+
+    def supports(self, profile):
+        return self.available() and profile in self.profiles
+
+    def open(self, pdf_data):
+        raise NotImplementedError
+
+    def page_count(self, document):
+        raise NotImplementedError
+
+    def write_outline(self, document, toc):
+        """Replace the document's outline with toc"""
+        raise NotImplementedError
+
+    def save(self, document, profile, linearize):
+        """Return the PDF bytes"""
+        raise NotImplementedError
+
+    def read_outline(self, document):
+        """The written outline as [level, title, page] entries, or None if it can't be read before saving"""
+        return None
+
+    def close(self, document):
+        pass
+
+    def embed(self, pdf_data, custom_bookmarks=None, verify_level=None, profile=None, linearize=None, outline=None):
+        """embed_bookmarks() with this engine; returns (pdf_bytes, info)"""
+        verify_level = normalize_verify_level(verify_level)
+        profile = normalize_output_profile(profile)
+        linearize = normalize_linearize(linearize)
+        timings = {}
+        source = 'custom' if custom_bookmarks else 'pages'
+        with PeakMemory() as memory:
+            if not custom_bookmarks and outline == 'auto':
+                # Heading detection reads text and fonts, which only PyMuPDF does here
+                started = time.perf_counter()
+                doc = fitz.open(stream=pdf_data, filetype="pdf")
+                custom_bookmarks = detect_headings(doc) or None
+                doc.close()
+                timings['auto_outline'] = time.perf_counter() - started
+                source = 'auto' if custom_bookmarks else 'pages'
+
+            started = time.perf_counter()
+            document = self.open(pdf_data)
+            try:
+                page_count = self.page_count(document)
+                timings['fitz_open'] = time.perf_counter() - started
+                toc, report = build_toc(page_count, custom_bookmarks)
+
+                started = time.perf_counter()
+                self.write_outline(document, toc)
+                timings['set_toc'] = time.perf_counter() - started
+
+                verify_seconds = 0
+                if verify_level == 'outline-only':
+                    started = time.perf_counter()
+                    written = self.read_outline(document)
+                    if written is None:
+                        # Nothing to read back before saving: check the saved file, and report that
+                        verify_level = 'full'
+                    else:
+                        check_outline(toc, written)
+                        verify_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                pdf_bytes = self.save(document, profile, linearize and self.linearizes)
+                timings['tobytes'] = time.perf_counter() - started
+            finally:
+                self.close(document)
+
+            if linearize and not self.linearizes:
+                started = time.perf_counter()
+                pdf_bytes = linearize_pdf(pdf_bytes)
+                timings['linearize'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if verify_level == 'full':
+                verify_full(pdf_bytes, toc, page_count)
+            if verify_level != 'off':
+                timings['verification'] = verify_seconds + time.perf_counter() - started
+
+        info = embedding_info(page_count, toc, report, source, verify_level, profile, linearize,
+                              len(pdf_data), len(pdf_bytes), timings, memory)
+        return pdf_bytes, info
+
+
+class PyMuPDFEngine(Engine):
+    """MuPDF through PyMuPDF: the outline engine in outline.py, every output profile"""
+
+    name = 'pymupdf'
+    module = 'fitz'
+    profiles = ('fast', 'balanced', 'smallest')
+
+    def embed(self, pdf_data, custom_bookmarks=None, verify_level=None, profile=None, linearize=None, outline=None):
+        return embed_bookmarks(pdf_data, custom_bookmarks, verify_level, profile, linearize, outline)
+
+
+class PikepdfEngine(Engine):
+    """qpdf through pikepdf; writes linearized output in the same pass"""
+
+    name = 'pikepdf'
+    module = 'pikepdf'
+    profiles = ('fast', 'balanced', 'smallest')
+    linearizes = True
+
+    def available(self):
+        return pikepdf is not None
+
+    def open(self, pdf_data):
+        return pikepdf.open(io.BytesIO(pdf_data))
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def write_outline(self, document, toc):
+        with document.open_outline() as outline:
+            outline.root.clear()
+            parents = {0: outline.root}
+            for level, title, page in toc:
+                item = pikepdf.OutlineItem(title, page - 1)
+                item.is_closed = True  # like write_outline: entries start collapsed
+                parents[level - 1].append(item)
+                parents[level] = item.children
+
+    def read_outline(self, document):
+        pages = {page.obj.objgen: number for number, page in enumerate(document.pages, 1)}
+        written = []
+
+        def walk(items, level):
+            for item in items:
+                destination = item.destination
+                if destination is None and item.action is not None:
+                    destination = item.action.get('/D')
+                page = destination[0] if isinstance(destination, pikepdf.Array) and len(destination) else None
+                written.append([level, str(item.title), pages.get(page.objgen) if page is not None else None])
+                walk(item.children, level + 1)
+
+        with document.open_outline() as outline:
+            walk(outline.root, 1)
+        return written
+
+    def save(self, document, profile, linearize):
+        options = {'linearize': linearize}
+        if profile == 'fast':
+            # Copy streams as they are; decoding and recompressing them costs seconds on large files
+            options.update(compress_streams=False, stream_decode_level=pikepdf.StreamDecodeLevel.none)
+        else:
+            options.update(compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+        if profile == 'smallest':
+            options['recompress_flate'] = True
+        output = io.BytesIO()
+        document.save(output, **options)
+        return output.getvalue()
+
+    def close(self, document):
+        document.close()
+
+
+class PypdfEngine(Engine):
+    """pypdf, a pure-Python reader and writer"""
+
+    name = 'pypdf'
+    module = 'pypdf'
+
+    def available(self):
+        return pypdf is not None
+
+    def open(self, pdf_data):
+        return pypdf.PdfWriter(clone_from=pypdf.PdfReader(io.BytesIO(pdf_data)))
+
+    def page_count(self, document):
+        return len(document.pages)
+
+    def write_outline(self, document, toc):
+        document.root_object.pop('/Outlines', None)  # replace, don't extend, an existing outline
+        parents = {0: None}
+        for level, title, page in toc:
+            parents[level] = document.add_outline_item(title, page - 1, parent=parents[level - 1], is_open=False)
+
+    def read_outline(self, document):
+        pages = {page.indirect_reference.idnum: number for number, page in enumerate(document.pages, 1)}
+        written = []
+
+        def walk(item, level):
+            while item is not None:
+                item = item.get_object()
+                action = item.get('/A')
+                destination = item.get('/Dest') or (action.get_object().get('/D') if action is not None else None)
+                page = destination[0] if destination else None
+                written.append([level, str(item.get('/Title')), pages.get(getattr(page, 'idnum', None))])
+                walk(item.get('/First'), level + 1)
+                item = item.get('/Next')
+
+        outlines = document.root_object.get('/Outlines')
+        if outlines is not None:
+            walk(outlines.get_object().get('/First'), 1)
+        return written
+
+    def save(self, document, profile, linearize):
+        output = io.BytesIO()
+        document.write(output)
+        return output.getvalue()
+
+
+class PdfbookmarkerEngine(Engine):
+    """pdfbookmarker, a pure-Python PyPDF2 wrapper
+
+    It copies the pages into a new document, so attachments, forms and
+    other catalog entries are lost; the policy never picks it, it only
+    runs when asked for by name. Its outline can't be read back before
+    saving, so outline-only verification checks the saved file and is
+    reported as full. Its add_bookmarks() takes streams, so
+    nothing touches the disk.
+    Releases that only have the path-based pdfbm(input, bookmarks,
+    output) get memfd files (or files in PDFBOOKMARKER_TMPDIR, /dev/shm by
+    default) instead of the three temp files on disk.
+    """
+
+    name = 'pdfbookmarker'
+    module = 'pdfbookmarker'
+    lossless = False
+
+    def available(self):
+        return pdfbookmarker is not None
+
+    def open(self, pdf_data):
+        # The library rewrites the whole file in one call, so its output is the only state
+        return {'input': pdf_data, 'output': None}
+
+    def page_count(self, document):
+        reader_class = getattr(pdfbookmarker, 'PdfFileReader', None)
+        if reader_class is not None:
+            return reader_class(io.BytesIO(document['input'])).getNumPages()
+        doc = fitz.open(stream=document['input'], filetype="pdf")
+        try:
+            return doc.page_count
+        finally:
+            doc.close()
+
+    def write_outline(self, document, toc):
+        if hasattr(pdfbookmarker, 'add_bookmarks'):
+            output = io.BytesIO()
+            pdfbookmarker.add_bookmarks(io.BytesIO(document['input']), bookmarks_tree(toc), output)
+            document['output'] = output.getvalue()
+            return
+        if not hasattr(pdfbookmarker, 'pdfbm'):
+            raise RuntimeError("This pdfbookmarker release has neither add_bookmarks() nor pdfbm()")
+        with ScratchFile('.pdf', document['input']) as input_file, \
+                ScratchFile('.txt', bookmarks_text(toc).encode('utf-8')) as bookmarks_file, \
+                ScratchFile('.pdf') as output_file:
+            pdfbookmarker.pdfbm(input_file.path, bookmarks_file.path, output_file.path)
+            document['output'] = output_file.read()
+
+    def save(self, document, profile, linearize):
+        return document['output']
+
+
+def bookmarks_tree(toc):
+    """pdfbookmarker's (title, page index, children) tree for a TOC"""
+    tree = []
+    children = {0: tree}
+    for level, title, page in toc:
+        node = (title, page - 1, [])
+        children[level - 1].append(node)
+        children[level] = node[2]
+    return tree
+
+
+def bookmarks_text(toc):
+    """pdfbookmarker's bookmark file format: one '+"Title"|page' line per entry, a '+' per level"""
+    lines = []
+    for level, title, page in toc:
+        title = ' '.join(title.replace('"', "'").split())
+        lines.append(f'{"+" * level}"{title}"|{page}\n')
+    return ''.join(lines)
+
+
+class ScratchFile:
+    """A named file for path-only APIs, kept in memory where the OS allows
+
+    Uses memfd_create (Linux) and hands out its /proc/self/fd path, falls
+    back to a file in PDFBOOKMARKER_TMPDIR (a tmpfs such as /dev/shm) and
+    finally to the regular temp directory.
+    """
+
+    def __init__(self, suffix, data=None):
+        self.fd = None
+        self._unlink = False
+        if hasattr(os, 'memfd_create') and os.path.isdir('/proc/self/fd'):
+            self.fd = os.memfd_create(f"pdfbookmarker{suffix}")
+            self.path = f"/proc/self/fd/{self.fd}"
+        else:
+            self.fd, self.path = tempfile.mkstemp(suffix=suffix, dir=PDFBOOKMARKER_TMPDIR)
+            self._unlink = True
+        if data:
+            os.write(self.fd, data)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        os.close(self.fd)
+        if self._unlink:
+            os.unlink(self.path)
+        return False
+
+
+ENGINES = {engine.name: engine for engine in (PyMuPDFEngine(), PikepdfEngine(), PypdfEngine(),
+                                                PdfbookmarkerEngine())}
+
+
+def available_engines():
+    return [name for name, engine in ENGINES.items() if engine.available()]
+
+
+def normalize_engine(value, profile=None):
+    """Validate a requested engine ('auto' or empty = let the policy choose)
+
+    Raises ValueError for unknown or unavailable engines, or one that
+    can't produce the requested output profile.
+    """
+    name = (value or 'auto').strip().lower()
+    if name == 'auto':
+        return name
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise ValueError(f"Unknown engine '{value}' (expected auto or one of {', '.join(ENGINES)})")
+    if not engine.available():
+        raise ValueError(f"Engine '{name}' is not installed (pip install {name})")
+    profile = normalize_output_profile(profile)
+    if not engine.supports(profile):
+        raise ValueError(f"Engine '{name}' does not support the '{profile}' profile")
+    return name
+
+
+def embed_document(pdf_data, custom_bookmarks=None, verify_level=None, profile=None, linearize=None, outline=None,
+                   engine=DEFAULT_ENGINE, fallback=None):
+    """Worker entry point: embed_bookmarks() with the named engine
+
+    info gains 'engine'. Module-level so it can be shipped to worker
+    processes; the engine is chosen beforehand by the server's policy.
+    If ``engine`` fails and ``fallback`` names another engine, the job is
+    retried with it (MuPDF repairs files qpdf and pypdf reject) and
+    info['engine_failed'] records the first engine.
+    """
+    if not ENGINES[engine].supports(normalize_output_profile(profile)):
+        raise ValueError(f"Engine '{engine}' is not installed or does not support the '{profile}' profile")
+    try:
+        pdf_bytes, info = ENGINES[engine].embed(pdf_data, custom_bookmarks, verify_level, profile, linearize, outline)
+    except Exception as e:
+        if not fallback or fallback == engine:
+            raise
+        logger.warning("⚠️ Engine %s failed (%s), retrying with %s", engine, e, fallback)
+        pdf_bytes, info = embed_document(pdf_data, custom_bookmarks, verify_level, profile, linearize, outline,
+                                         fallback)
+        info['engine_failed'] = engine
+        return pdf_bytes, info
+    info['engine'] = engine
+    return pdf_bytes, info
+
+
+class EnginePolicy:
+    """Picks the engine for a document from its size and outline
+
+    ``rules`` are tried in order; each names an engine and optional
+    ``min_bytes``/``max_bytes`` and ``min_bookmarks``/``max_bookmarks``
+    bounds. The first rule whose bounds match and whose engine is
+    installed, lossless and supports the requested profile wins; otherwise
+    ``default``. ``forced`` (PDF_ENGINE) overrides the rules. There are no
+    rules unless ENGINE_POLICY_FILE provides them.
+    """
+
+    def __init__(self, rules=None, default=DEFAULT_ENGINE, forced=None):
+        self.rules = list(rules or ())
+        self.default = default
+        self.forced = forced
+        self.chosen = Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Configure from PDF_ENGINE (auto or an engine name) and ENGINE_POLICY_FILE"""
+        forced = normalize_engine(os.environ.get('PDF_ENGINE'))
+        rules = []
+        default = DEFAULT_ENGINE
+        path = os.environ.get('ENGINE_POLICY_FILE')
+        if path:
+            with open(path, 'r', encoding='utf-8') as f:
+                policy = json.load(f)
+            rules = policy.get('rules', [])
+            default = normalize_engine(policy.get('default'))
+            default = DEFAULT_ENGINE if default == 'auto' else default
+            logger.info("⚙️ Engine policy from %s: %d rule(s), default %s", path, len(rules), default)
+        return cls(rules, default, None if forced == 'auto' else forced)
+
+    def choose(self, size, bookmark_count=0, profile=None, requested=None):
+        """Name of the engine for a document of ``size`` bytes and ``bookmark_count`` entries
+
+        ``requested`` is a validated engine name from the request, or
+        'auto'/None to apply the policy.
+        """
+        profile = normalize_output_profile(profile)
+        name = requested if requested not in (None, 'auto') else self.forced
+        if name is None:
+            name = self.default if ENGINES[self.default].supports(profile) else DEFAULT_ENGINE
+            for rule in self.rules:
+                engine = ENGINES.get(rule.get('engine'))
+                if engine is None or not engine.lossless or not engine.supports(profile):
+                    continue
+                if size < rule.get('min_bytes', 0) or size > rule.get('max_bytes', size):
+                    continue
+                if not rule.get('min_bookmarks', 0) <= bookmark_count <= rule.get('max_bookmarks', bookmark_count):
+                    continue
+                name = engine.name
+                break
+        with self._lock:
+            self.chosen[name] += 1
+        return name
+
+    def fallback(self, requested=None):
+        """Engine to retry with if the chosen one fails: the default, unless the request named one"""
+        return DEFAULT_ENGINE if requested in (None, 'auto') else None
+
+    def modules(self):
+        """Import names of the installed libraries this policy can pick, for preloading"""
+        names = [self.forced] if self.forced else [self.default] + [rule.get('engine') for rule in self.rules]
+        modules = []
+        for name in names:
+            engine = ENGINES.get(name)
+            if engine is not None and engine.available() and engine.module not in modules:
+                modules.append(engine.module)
+        return modules
+
+    def stats(self):
+        """Installed engines, rules and how often each engine was picked, for /health"""
+        with self._lock:
+            chosen = dict(self.chosen)
+        return {'available': available_engines(), 'default': self.default, 'forced': self.forced,
+                'rules': self.rules, 'chosen': chosen}
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def get_engine_policy():
+    """Return the process-wide engine policy, creating it on first use"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = EnginePolicy.from_env()
+        return _policy
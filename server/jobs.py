@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Asynchronous embedding jobs
+POST /jobs answers with a job ID straight away; the PDF is processed in
+the worker pool without holding a connection or a handler thread, and
+the result is kept for a TTL so the client can poll /jobs/<id> and fetch
+/jobs/<id>/result when it is done
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures.process import BrokenProcessPool
+
+from admission import AdmissionRejected, get_admission
+from auto_outline import get_auto_outliner
+from metrics import REGISTRY, observe_embedding
+from engines import embed_document, get_engine_policy
+from pdf_embedder import embed_bookmarks_file
+from result_cache import get_result_cache
+from structured_log import get_logger
+from worker_pool import get_pool
+
+logger = get_logger('jobs')
+
+JOBS = REGISTRY.counter('pdfbookmark_jobs_total', 'Asynchronous jobs by final status', ('status',))
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    """One submitted document; the input is dropped once the job starts
+
+    A large document arrives as ``pdf_path`` (a spooled upload the job
+    owns) instead of ``pdf_data`` and is processed from that file.
+    ``engine`` is the engine asked for by name, or None for the policy.
+    """
+
+    def __init__(self, job_id, key, pdf_data, bookmarks, verify_level, profile=None, linearize=None, outline=None,
+                 digest=None, pdf_path=None, engine=None):
+        self.job_id = job_id
+        self.key = key
+        self.status = QUEUED
+        self.pdf_data = pdf_data
+        self.pdf_path = pdf_path
+        self.bookmarks = bookmarks
+        self.verify_level = verify_level
+        self.profile = profile
+        self.linearize = linearize
+        self.outline = outline
+        self.engine = engine
+        self.digest = digest
+        self.outline_source = None
+        if pdf_path is not None:
+            self.input_size = os.path.getsize(pdf_path)
+        else:
+            self.input_size = len(pdf_data) if pdf_data is not None else 0
+        self.reservation = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.expires_at = None
+        self.error = None
+        self.info = None
+        self.cache_status = None
+        self.result = None
+        self.result_path = None
+        self.result_size = None
+        self.pinned = False
+
+    @property
+    def etag(self):
+        return f'"{self.key}"'
+
+    def open_result(self, cache=None):
+        """Return (data, file) for the processed PDF, or None if the result cache no longer has it
+
+        Exactly one of data and file is set; the caller closes the file.
+        """
+        if self.result is not None:
+            return self.result, None
+        if self.result_path is not None:
+            return None, open(self.result_path, 'rb')
+        stored = cache.open(self.key) if cache is not None else None
+        return (stored[0], stored[1]) if stored is not None else None
+
+    def to_json(self, position=None, now=None):
+        now = time.time() if now is None else now
+        payload = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'status_url': f"/jobs/{self.job_id}",
+            'input_size': self.input_size,
+            'created': round(self.created, 3),
+        }
+        if position is not None:
+            payload['position'] = position
+        if self.started is not None:
+            payload['started'] = round(self.started, 3)
+        if self.finished is not None:
+            payload['finished'] = round(self.finished, 3)
+            payload['seconds'] = round(self.finished - (self.started or self.created), 3)
+        if self.status == DONE:
+            payload.update(result_url=f"/jobs/{self.job_id}/result", size=self.result_size,
+                           page_count=self.info['page_count'], bookmarks=self.info['bookmarks'],
+                           verification=self.info['verification'], profile=self.info.get('profile'),
+                           linearized=self.info.get('linearized', False),
+                           outline_source=self.info.get('outline_source'), engine=self.info.get('engine'),
+                           cache=self.cache_status)
+            if 'outline' in self.info:
+                payload['outline'] = self.info['outline']
+        if self.status == FAILED:
+            payload['error'] = self.error
+        if self.expires_at is not None:
+            payload['expires_in'] = max(0, int(self.expires_at - now))
+        return payload
+
+
+class JobManager:
+    """Queue of embedding jobs fed into the worker pool as job slots free up
+
+    Jobs take the same admission slots as synchronous requests; while they
+    wait their input counts against the admission memory budget. At most
+    ``max_queued`` jobs may wait. Finished jobs are kept for ``ttl``
+    seconds; their PDFs are pinned in the result cache's disk or spool
+    tier until then and served from it, or kept as files in
+    ``result_dir``. Jobs with outline 'auto' first have their headings
+    detected by ``outliner``. Large
+    documents are processed from their file by embed_bookmarks_file; they
+    hold no memory while queued, and their result stays a file owned by
+    the job rather than a result cache entry.
+    """
+
+    def __init__(self, pool, cache=None, admission=None, ttl=900, max_queued=100, result_dir=None, outliner=None):
+        self.pool = pool
+        self.outliner = outliner
+        self.cache = cache
+        self.admission = admission
+        self.ttl = ttl
+        self.max_queued = max_queued
+        self.result_dir = result_dir
+        self._jobs = OrderedDict()
+        self._queue = deque()
+        self._lock = threading.RLock()
+        if result_dir:
+            os.makedirs(result_dir, exist_ok=True)
+        if admission is not None:
+            admission.on_release(self._pump)
+
+    @classmethod
+    def from_env(cls, pool, cache=None, admission=None, outliner=None):
+        """Configure from JOB_TTL_SECONDS, JOB_QUEUE_SIZE and JOB_RESULT_DIR"""
+        return cls(
+            pool, cache, admission,
+            ttl=int(os.environ.get('JOB_TTL_SECONDS', 900)),
+            max_queued=int(os.environ.get('JOB_QUEUE_SIZE', 100)),
+            result_dir=os.environ.get('JOB_RESULT_DIR') or None,
+            outliner=outliner,
+        )
+
+    def submit(self, key, pdf_data, bookmarks=None, verify_level=None, profile=None, linearize=None, outline=None,
+               digest=None, pdf_path=None, engine=None):
+        """Queue a job (or finish it at once from the result cache) and return it
+
+        With ``pdf_path`` the job takes ownership of that file. ``engine``
+        names an embedding engine; 'auto' or None lets the policy choose.
+        """
+        job = Job(uuid.uuid4().hex, key, pdf_data, bookmarks, verify_level, profile, linearize, outline, digest,
+                  pdf_path, None if engine == 'auto' else engine)
+        # A large document's cached result would have to be read into memory; process the file instead
+        cached = self.cache.get(key) if self.cache is not None and pdf_path is None else None
+        with self._lock:
+            self._expire(time.time())
+            if cached is None and len(self._queue) >= self.max_queued:
+                self._discard_input(job)
+                retry_after = self.admission.retry_after if self.admission is not None else 5
+                raise AdmissionRejected(503, 'job_queue_full',
+                                        f"Job queue is full ({self.max_queued} jobs waiting)", retry_after)
+            self._jobs[job.job_id] = job
+            if cached is not None:
+                job.pdf_data = None
+                job.started = job.created
+                self._complete(job, cached[0], cached[1], 'HIT')
+                return job
+            if self.admission is not None and pdf_path is None:
+                job.reservation = self.admission.hold(job.input_size)
+            self._queue.append(job)
+        logger.debug("📥 Job %s queued (%d bytes)", job.job_id[:12], job.input_size)
+        self._pump()
+        return job
+
+    def _pump(self):
+        """Start queued jobs while job slots are free"""
+        with self._lock:
+            while self._queue:
+                if self.admission is not None and not self.admission.try_acquire_job():
+                    return
+                job = self._queue.popleft()
+                job.status = RUNNING
+                job.started = time.time()
+                pdf_data, job.pdf_data = job.pdf_data, None
+                if job.pdf_path is not None:
+                    # Headings of a large document are detected in the worker, from the file
+                    self._start(job, None, job.bookmarks, job.outline)
+                    continue
+                if job.outline == 'auto' and not job.bookmarks and self.outliner is not None:
+                    # The page scan fans out over the pool; wait for it off the pump's lock
+                    threading.Thread(target=self._run_auto_outline, args=(job, pdf_data),
+                                     name=f"job-outline-{job.job_id[:8]}", daemon=True).start()
+                    continue
+                self._start(job, pdf_data, job.bookmarks, job.outline)
+
+    def _start(self, job, pdf_data, bookmarks, outline):
+        try:
+            if job.pdf_path is not None:
+                future = self.pool.submit(embed_bookmarks_file, job.pdf_path, bookmarks, job.verify_level,
+                                          job.profile, job.linearize, outline)
+            else:
+                policy = get_engine_policy()
+                engine = policy.choose(job.input_size, len(bookmarks or ()), job.profile, job.engine)
+                future = self.pool.submit(embed_document, pdf_data, bookmarks, job.verify_level,
+                                          job.profile, job.linearize, outline, engine, policy.fallback(job.engine))
+        except Exception as e:
+            self._finish(job, None, e)
+            return
+        finally:
+            if job.reservation is not None:
+                job.reservation.release()
+        future.add_done_callback(lambda done: self._finish(job, done, None))
+
+    def _run_auto_outline(self, job, pdf_data):
+        """Detect the job's headings across the pool, then embed them"""
+        try:
+            # The job's slot covers the first page range; the outliner takes more while they are free
+            bookmarks = self.outliner.outline(pdf_data, job.digest, held_slots=1) or None
+        except Exception as e:
+            if job.reservation is not None:
+                job.reservation.release()
+            self._finish(job, None, e)
+            return
+        job.outline_source = 'auto' if bookmarks else 'pages'
+        self._start(job, pdf_data, bookmarks, 'pages')
+
+    def _finish(self, job, future, error):
+        """Pool callback: record the result or failure and free the job slot"""
+        try:
+            if error is None:
+                try:
+                    pdf_bytes, info = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. MuPDF crashed); start a fresh pool for the next job
+                    self.pool.reset()
+                    error = e
+                except Exception as e:
+                    error = e
+            with self._lock:
+                if error is not None:
+                    self._discard_input(job)
+                    job.status = FAILED
+                    job.error = str(error)
+                    job.finished = time.time()
+                    job.expires_at = job.finished + self.ttl
+                    JOBS.inc(FAILED)
+                    logger.warning("❌ Job %s failed: %s", job.job_id[:12], error)
+                else:
+                    if job.outline_source is not None:
+                        info['outline_source'] = job.outline_source
+                    info.setdefault('engine', 'pymupdf')  # files are always embedded by PyMuPDF
+                    observe_embedding(info)
+                    if job.pdf_path is not None:
+                        self._complete_file(job, pdf_bytes, info)
+                    else:
+                        if self.cache is not None:
+                            self.cache.put(job.key, pdf_bytes, info)
+                        self._complete(job, pdf_bytes, info, 'MISS')
+        finally:
+            if self.admission is not None:
+                self.admission.release_job()
+            else:
+                self._pump()
+
+    def _complete(self, job, pdf_bytes, info, cache_status):
+        if job.job_id not in self._jobs:
+            return  # deleted while running
+        job.info = info
+        job.cache_status = cache_status
+        job.result_size = len(pdf_bytes)
+        if self.result_dir:
+            fd, path = tempfile.mkstemp(dir=self.result_dir, prefix=job.job_id[:16] + '-', suffix='.pdf')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(pdf_bytes)
+            job.result_path = path
+        elif self.cache is None:
+            job.result = pdf_bytes
+        else:
+            # Served from the result cache, which keeps it until the job expires
+            self.cache.pin(job.key, (pdf_bytes, info))
+            job.pinned = True
+        self._mark_done(job)
+
+    def _complete_file(self, job, output_path, info):
+        """Finish a large-document job; its output file becomes the job's result"""
+        if output_path != job.pdf_path:
+            self._discard_input(job)
+        job.pdf_path = None
+        if job.job_id not in self._jobs:
+            os.unlink(output_path)  # deleted while running
+            return
+        job.info = info
+        job.cache_status = 'MISS'
+        job.result_size = os.path.getsize(output_path)
+        job.result_path = output_path
+        self._mark_done(job)
+
+    def _mark_done(self, job):
+        job.status = DONE
+        job.finished = time.time()
+        job.expires_at = job.finished + self.ttl
+        JOBS.inc(DONE)
+        logger.debug("✅ Job %s done (%d bytes)", job.job_id[:12], job.result_size)
+
+    def get(self, job_id):
+        """Return (job, queue position) or (None, None) for unknown/expired IDs"""
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None, None
+            if job.pinned and not self.cache.contains(job.key):
+                # The pinned copy could not be written or was lost; don't offer a result URL
+                self._lose_result(job)
+            position = None
+            if job.status == QUEUED:
+                position = next((index for index, queued in enumerate(self._queue, 1) if queued is job), None)
+            return job, position
+
+    def remove(self, job_id):
+        """Cancel a queued job or discard a result; returns True if it existed"""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return False
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                if job.reservation is not None:
+                    job.reservation.release()
+            self._drop(job)
+            return True
+
+    def _discard_input(self, job):
+        if job.pdf_path is not None:
+            try:
+                os.unlink(job.pdf_path)
+            except OSError:
+                pass
+            job.pdf_path = None
+
+    def _lose_result(self, job):
+        self.cache.unpin(job.key)
+        job.pinned = False
+        job.status = FAILED
+        job.error = 'Job result is no longer in the result cache; submit the job again'
+        logger.warning("❌ Job %s lost its result", job.job_id[:12])
+
+    def _drop(self, job):
+        if job.pinned:
+            self.cache.unpin(job.key)
+            job.pinned = False
+        job.pdf_data = job.result = None
+        if job.status != RUNNING:
+            self._discard_input(job)
+        if job.result_path:
+            try:
+                os.unlink(job.result_path)
+            except OSError:
+                pass
+
+    def _expire(self, now):
+        for job_id in [key for key, job in self._jobs.items() if job.expires_at is not None and job.expires_at <= now]:
+            self._drop(self._jobs.pop(job_id))
+
+    def active(self):
+        """Number of queued and running jobs"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in (QUEUED, RUNNING))
+
+    def stats(self):
+        """Counts for /health"""
+        with self._lock:
+            self._expire(time.time())
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return dict(counts, max_queued=self.max_queued, ttl=self.ttl)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager():
+    """Return the process-wide job manager, creating it on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager.from_env(get_pool(), get_result_cache(), get_admission(), get_auto_outliner())
+        return _manager
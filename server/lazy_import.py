@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Deferred imports of the PDF libraries
+PyMuPDF, pikepdf and pypdf make up most of the server's import time, yet
+/health and static files never touch them. lazy_module() returns a
+stand-in that imports the real module on first attribute access, and
+preload() imports them all ahead of time, e.g. in a background thread
+once the server is listening.
+"""
+
+import importlib
+import importlib.util
+import threading
+import time
+
+_modules = {}  # name -> LazyModule, shared by every module that asks for it
+_modules_lock = threading.Lock()
+
+
+class LazyModule:
+    """Module stand-in that imports ``name`` when an attribute is first read"""
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+        self._lazy_lock = threading.Lock()
+
+    def _load(self):
+        module = self._lazy_module
+        if module is None:
+            # One thread imports; others asking meanwhile wait instead of importing half-initialised modules
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+                module = self._lazy_module
+        return module
+
+    @property
+    def loaded(self):
+        return self._lazy_module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_module(name, optional=False):
+    """Stand-in for ``import name``; with optional=True, None if it is not installed
+
+    Whether an optional module is installed is decided from its import
+    spec, without running it.
+    """
+    with _modules_lock:
+        module = _modules.get(name)
+        if module is None:
+            if optional and importlib.util.find_spec(name) is None:
+                return None
+            module = _modules[name] = LazyModule(name)
+        return module
+
+
+def preload(names=None):
+    """Import the deferred modules now; returns {name: seconds} for those imported
+
+    Import errors are left to the first real use.
+    """
+    with _modules_lock:
+        modules = [module for name, module in _modules.items() if names is None or name in names]
+    timings = {}
+    for module in modules:
+        if module.loaded:
+            continue
+        started = time.perf_counter()
+        try:
+            module._load()
+        except ImportError:
+            continue
+        timings[module._lazy_name] = time.perf_counter() - started
+    return timings
+
+
+def loaded_modules():
+    """Names of the deferred modules that have been imported, for /health"""
+    with _modules_lock:
+        return sorted(name for name, module in _modules.items() if module.loaded)
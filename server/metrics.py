@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Prometheus-style metrics
+Counters and histograms cheap enough for the request path, rendered in
+the text exposition format for /metrics
+"""
+
+import bisect
+import threading
+
+# Seconds, from sub-millisecond stages up to very large documents
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1 KiB .. 1 GiB
+PAGE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                label_text = _format_labels(self.labelnames, labels, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds metrics in registration order and renders them together"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        metric = Histogram(name, documentation, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+REQUESTS = REGISTRY.counter(
+    'pdfbookmark_requests_total', 'HTTP requests by route and status', ('route', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram(
+    'pdfbookmark_request_duration_seconds', 'End-to-end request latency', labelnames=('route',))
+UPLOAD_BYTES = REGISTRY.histogram(
+    'pdfbookmark_upload_bytes', 'Request body size of PDF uploads', BYTES_BUCKETS)
+RESPONSE_BYTES = REGISTRY.histogram(
+    'pdfbookmark_response_bytes', 'Size of returned PDFs', BYTES_BUCKETS)
+PAGE_COUNT = REGISTRY.histogram(
+    'pdfbookmark_document_pages', 'Page count of processed documents', PAGE_BUCKETS)
+STAGE_SECONDS = REGISTRY.histogram(
+    'pdfbookmark_stage_duration_seconds', 'Time spent in each embedding stage', labelnames=('stage',))
+BOOKMARK_ENTRIES = REGISTRY.counter(
+    'pdfbookmark_bookmark_entries_total', 'Custom bookmark entries by outcome', ('outcome',))
+PEAK_MEMORY = REGISTRY.histogram(
+    'pdfbookmark_job_peak_memory_bytes', 'Peak resident memory of the process running an embedding job',
+    BYTES_BUCKETS)
+ENGINE_JOBS = REGISTRY.counter(
+    'pdfbookmark_engine_jobs_total', 'Embedding jobs by the engine that wrote the output', ('engine',))
+
+
+def observe_embedding(info):
+    """Record the per-stage timings, page count, peak memory, engine and outline outcome of an embedding"""
+    for stage, seconds in (info.get('timings') or {}).items():
+        STAGE_SECONDS.observe(seconds, stage)
+    PAGE_COUNT.observe(info['page_count'])
+    memory = info.get('memory')
+    if memory and memory.get('peak_rss_bytes'):
+        PEAK_MEMORY.observe(memory['peak_rss_bytes'])
+    if info.get('engine'):
+        ENGINE_JOBS.inc(info['engine'])
+    outline = info.get('outline')
+    if outline:
+        BOOKMARK_ENTRIES.inc('accepted', amount=outline['accepted'])
+        BOOKMARK_ENTRIES.inc('rejected', amount=outline['rejected'])
+        BOOKMARK_ENTRIES.inc('level_adjusted', amount=outline['levels_adjusted'])
@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Streaming multipart/form-data parser
+Reads the request body in chunks and writes file parts straight into
+spooled buffers, so an upload is held in memory at most once
+"""
+
+import codecs
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_THRESHOLD = int(os.environ.get('UPLOAD_SPOOL_THRESHOLD', 8 * 1024 * 1024))
+# File parts larger than this go to a named file so MuPDF can open them by path
+LARGE_DOCUMENT_BYTES = int(os.environ.get('LARGE_DOCUMENT_BYTES', 64 * 1024 * 1024))
+LARGE_DOCUMENT_DIR = os.environ.get('LARGE_DOCUMENT_DIR') or None
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised when the request body is not valid multipart/form-data"""
+
+
+def parse_boundary(content_type):
+    """Extract the boundary parameter from a multipart Content-Type header"""
+    if 'boundary=' not in content_type:
+        return None
+    boundary = content_type.split('boundary=')[1].split(';')[0].strip()
+    # Remove quotes if present
+    if boundary.startswith('"') and boundary.endswith('"'):
+        boundary = boundary[1:-1]
+    return boundary or None
+
+
+def _parse_part_headers(raw_headers):
+    """Parse part headers into (headers dict, name, filename)"""
+    headers = {}
+    for line in raw_headers.decode('utf-8', errors='replace').split('\r\n'):
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+
+    name = None
+    filename = None
+    for param in headers.get('content-disposition', '').split(';')[1:]:
+        if '=' not in param:
+            continue
+        key, value = param.split('=', 1)
+        key = key.strip().lower()
+        value = value.strip()
+        if value.startswith('"') and value.endswith('"'):
+            value = value[1:-1]
+        if key == 'name':
+            name = value
+        elif key == 'filename':
+            filename = value
+    return headers, name, filename
+
+
+class JSONArrayStream:
+    """Incremental decoder for a JSON array fed in arbitrary byte chunks
+
+    Complete items are decoded as soon as their closing delimiter arrives,
+    so a large bookmark list never has to be buffered as one string.
+    Anything that is not a top-level array is decoded in one go on close().
+    """
+
+    def __init__(self):
+        self.items = []
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._state = 'start'  # start -> item -> separator -> done | whole
+
+    def feed(self, data):
+        self._buffer += self._utf8.decode(bytes(data))
+        self._drain()
+
+    def _skip_ws(self, pos):
+        buffer = self._buffer
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        return pos
+
+    def _drain(self):
+        buffer = self._buffer
+        pos = 0
+        while True:
+            pos = self._skip_ws(pos)
+            if pos >= len(buffer) or self._state in ('done', 'whole'):
+                break
+            char = buffer[pos]
+            if self._state == 'start':
+                if char != '[':
+                    self._state = 'whole'
+                    break
+                self._state = 'item'
+                pos += 1
+            elif self._state == 'separator':
+                if char == ',':
+                    self._state = 'item'
+                    pos += 1
+                elif char == ']':
+                    self._state = 'done'
+                    pos += 1
+                else:
+                    raise ValueError(f"Unexpected {char!r} in JSON array")
+            else:
+                if char == ']' and not self.items:
+                    self._state = 'done'
+                    pos += 1
+                    continue
+                try:
+                    item, end = self._decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    break  # incomplete item, wait for more data
+                if end >= len(buffer):
+                    break  # a bare number might still be growing
+                self.items.append(item)
+                self._state = 'separator'
+                pos = end
+        if self._state != 'whole':
+            self._buffer = buffer[pos:]
+
+    def close(self):
+        """Finish decoding and return the parsed value"""
+        self._buffer += self._utf8.decode(b'', final=True)
+        if self._state == 'whole':
+            return json.loads(self._buffer)
+        if self._state == 'separator' or self._state == 'item':
+            # The final item is only complete once we know no more data follows
+            self._buffer = self._buffer.rstrip() + ' '
+            self._drain()
+        if self._state != 'done' or self._buffer.strip():
+            raise ValueError("Incomplete JSON array")
+        return self.items
+
+
+def _named_file():
+    return tempfile.NamedTemporaryFile(prefix='pdfbookmark-upload-', suffix='.pdf',
+                                       dir=LARGE_DOCUMENT_DIR, delete=False)
+
+
+class MultipartPart:
+    """One form-data part: file parts are spooled, small fields kept as bytes
+
+    A file part that grows past ``large_threshold`` moves to a named file
+    in LARGE_DOCUMENT_DIR, whose ``path`` can be handed to MuPDF; such a
+    part is a large document.
+    """
+
+    def __init__(self, headers, name, filename, spool_threshold, large_threshold=LARGE_DOCUMENT_BYTES):
+        self.headers = headers
+        self.name = name
+        self.filename = filename
+        self.size = 0
+        self.value = None
+        self.error = None
+        self.file = None
+        self.path = None
+        self.sha256 = None
+        self.large_threshold = large_threshold
+        self._json = None
+        self._field = None
+
+        if filename is not None or name == 'pdf':
+            self.file = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+            # Hash while streaming so callers get a content address for free
+            self._hash = hashlib.sha256()
+        elif name == 'bookmarks':
+            self._json = JSONArrayStream()
+        else:
+            self._field = bytearray()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.file is not None:
+            if self.path is None and self.size > self.large_threshold:
+                self._move_to_named_file()
+            self.file.write(data)
+            self._hash.update(data)
+        elif self._json is not None:
+            try:
+                self._json.feed(data)
+            except ValueError as e:
+                # Keep consuming the part; the caller decides what a bad field means
+                self.error = str(e)
+                self._json = None
+        elif self.error is not None:
+            pass
+        else:
+            if self.size > MAX_FIELD_SIZE:
+                raise MultipartError(f"Form field '{self.name}' is too large")
+            self._field += data
+
+    def finish(self):
+        if self.file is not None:
+            self.file.seek(0)
+            self.sha256 = self._hash.hexdigest()
+        elif self._json is not None:
+            try:
+                self.value = self._json.close()
+            except ValueError as e:
+                self.error = str(e)
+            self._json = None
+        elif self.error is not None:
+            pass
+        else:
+            self.value = bytes(self._field)
+            self._field = None
+
+    def _move_to_named_file(self):
+        named = _named_file()
+        try:
+            self.file.seek(0)
+            while True:
+                chunk = self.file.read(CHUNK_SIZE * 16)
+                if not chunk:
+                    break
+                named.write(chunk)
+        except BaseException:
+            named.close()
+            os.unlink(named.name)
+            raise
+        self.file.close()
+        self.file = named
+        self.path = named.name
+
+    @property
+    def large(self):
+        return self.size > self.large_threshold
+
+    def head(self, length):
+        """Peek at the first bytes of a file part"""
+        self.file.seek(0)
+        data = self.file.read(length)
+        self.file.seek(0)
+        return data
+
+    def read_bytes(self):
+        """Return the file contents and release the spool
+
+        Reading consumes the part so the upload is never held twice.
+        """
+        self.file.seek(0)
+        data = self.file.read()
+        self.close()
+        return data
+
+    def detach_path(self):
+        """Close a large part's file and hand its path to the caller, who deletes it"""
+        path = self.path
+        self.file.close()
+        self.file = None
+        self.path = None
+        return path
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+class StreamingMultipartParser:
+    """Incremental multipart/form-data parser over a file-like body
+
+    Only ``content_length`` bytes are read from ``rfile`` (or until EOF when
+    it is None), CHUNK_SIZE at a time. Boundaries are located as data
+    arrives and part bodies are forwarded to their sink immediately.
+    """
+
+    def __init__(self, rfile, content_type, content_length=None,
+                 chunk_size=CHUNK_SIZE, spool_threshold=SPOOL_THRESHOLD,
+                 large_threshold=LARGE_DOCUMENT_BYTES):
+        boundary = parse_boundary(content_type)
+        if not boundary:
+            raise MultipartError("No boundary found in Content-Type")
+        self.boundary = boundary
+        self.rfile = rfile
+        self.remaining = content_length
+        self.chunk_size = chunk_size
+        self.spool_threshold = spool_threshold
+        self.large_threshold = large_threshold
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+        # Prefix CRLF so the first boundary matches the same delimiter as the rest
+        self._delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self._buffer = bytearray(b'\r\n')
+        self._eof = False
+
+    def _fill(self):
+        """Read the next chunk into the buffer; False once the body is exhausted"""
+        if self._eof:
+            return False
+        size = self.chunk_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        started = time.perf_counter()
+        chunk = self.rfile.read(size) if size > 0 else b''
+        self.read_seconds += time.perf_counter() - started
+        if not chunk:
+            self._eof = True
+            return False
+        self.bytes_read += len(chunk)
+        if self.remaining is not None:
+            self.remaining -= len(chunk)
+        self._buffer += chunk
+        return True
+
+    def _find(self, needle, start=0):
+        """Find needle in the buffer, reading more data until it shows up"""
+        while True:
+            index = self._buffer.find(needle, start)
+            if index != -1:
+                return index
+            start = max(0, len(self._buffer) - len(needle) + 1)
+            if not self._fill():
+                return -1
+
+    def _consume(self, length):
+        del self._buffer[:length]
+
+    def _skip_to_line_end(self):
+        """Consume transport padding and the CRLF after a boundary"""
+        index = self._find(b'\r\n')
+        if index == -1:
+            raise MultipartError("Truncated multipart body")
+        self._consume(index + 2)
+
+    def _at_final_boundary(self):
+        while len(self._buffer) < 2:
+            if not self._fill():
+                return True
+        return self._buffer[:2] == b'--'
+
+    def _stream_body(self, part):
+        """Forward part data to its sink until the next delimiter"""
+        delimiter = self._delimiter
+        keep = len(delimiter) - 1
+        while True:
+            index = self._buffer.find(delimiter)
+            if index != -1:
+                with memoryview(self._buffer) as view:
+                    part.write(view[:index])
+                self._consume(index + len(delimiter))
+                return
+            safe = len(self._buffer) - keep
+            if safe > 0:
+                with memoryview(self._buffer) as view:
+                    part.write(view[:safe])
+                self._consume(safe)
+            if not self._fill():
+                raise MultipartError("Truncated multipart body")
+
+    def parts(self):
+        """Yield each MultipartPart as soon as its body is complete"""
+        # Preamble: everything up to the first delimiter is ignored
+        index = self._find(self._delimiter)
+        if index == -1:
+            raise MultipartError("No multipart boundary found in body")
+        self._consume(index + len(self._delimiter))
+
+        while not self._at_final_boundary():
+            self._skip_to_line_end()
+            header_end = self._find(b'\r\n\r\n')
+            if header_end == -1:
+                raise MultipartError("Truncated part headers")
+            headers, name, filename = _parse_part_headers(bytes(self._buffer[:header_end]))
+            self._consume(header_end + 4)
+
+            part = MultipartPart(headers, name, filename, self.spool_threshold, self.large_threshold)
+            try:
+                self._stream_body(part)
+                part.finish()
+            except Exception:
+                part.close()
+                raise
+            yield part
+
+        # Drain the epilogue so the connection is left at a request boundary
+        self._buffer.clear()
+        while self._fill():
+            self._buffer.clear()
+
+    def parse(self):
+        """Consume the whole body and return {name: MultipartPart}
+
+        Later parts with the same name replace earlier ones.
+        """
+        fields = {}
+        try:
+            for part in self.parts():
+                previous = fields.get(part.name)
+                if previous is not None:
+                    previous.close()
+                fields[part.name] = part
+        except Exception:
+            for part in fields.values():
+                part.close()
+            raise
+        return fields
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Outline engine
+Validates and normalizes bookmark lists in one linear pass and writes the
+outline objects directly, so lists of 100k entries take seconds instead
+of failing on one bad level or spending most of their time in set_toc
+"""
+
+import os
+
+from lazy_import import lazy_module
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+
+# Rejected entries listed in a report; the rest are only counted
+MAX_REPORTED_REJECTIONS = int(os.environ.get('OUTLINE_MAX_REPORTED_REJECTIONS', 100))
+
+# Entries deeper than this start collapsed, as with Document.set_toc()
+COLLAPSE_LEVEL = 1
+
+# Distance of the bookmark target below the top of its page, in points
+TOP_MARGIN = 36
+
+
+class OutlineReport:
+    """What happened to a bookmark list: accepted, adjusted and rejected entries"""
+
+    def __init__(self, received=0):
+        self.received = received
+        self.accepted = 0
+        self.levels_adjusted = 0
+        self.rejected = 0
+        self.rejections = []
+
+    def reject(self, index, reason, **details):
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append(dict(index=index, reason=reason, **details))
+
+    def to_json(self):
+        return {
+            'received': self.received,
+            'accepted': self.accepted,
+            'levels_adjusted': self.levels_adjusted,
+            'rejected': self.rejected,
+            'rejections': self.rejections,
+            'rejections_truncated': self.rejected > len(self.rejections),
+        }
+
+
+def _as_int(value):
+    """An integral value from JSON (int, integral float or digit string), else None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        value = value.strip()
+        if value.lstrip('-').isdigit():
+            return int(value)
+    return None
+
+
+def _shown(value):
+    """A rejected value as reported back (long strings and containers are cut short)"""
+    if isinstance(value, (dict, list)) or (isinstance(value, str) and len(value) > 32):
+        return str(value)[:32] + '…'
+    return value
+
+
+def normalize_outline(bookmarks, page_count):
+    """Turn bookmark dicts into a valid [level, title, page] TOC in one pass
+
+    Entries without a usable title or page, or pointing outside the
+    document, are rejected; levels below 1 or deeper than one past the
+    previous entry are clamped, so the result always satisfies set_toc.
+    Returns (toc, OutlineReport).
+    """
+    report = OutlineReport(len(bookmarks))
+    toc = []
+    append = toc.append
+    previous_level = 0
+    for index, bookmark in enumerate(bookmarks):
+        if not isinstance(bookmark, dict):
+            report.reject(index, 'not_an_object')
+            continue
+
+        title = bookmark.get('title')
+        if title is None or isinstance(title, (dict, list)):
+            report.reject(index, 'missing_title')
+            continue
+        if not isinstance(title, str):
+            title = str(title)
+        if not title.strip():
+            report.reject(index, 'missing_title')
+            continue
+
+        page = _as_int(bookmark.get('page'))
+        if page is None:
+            report.reject(index, 'invalid_page', page=_shown(bookmark.get('page')))
+            continue
+        if not 1 <= page <= page_count:
+            report.reject(index, 'page_out_of_range', page=page, page_count=page_count)
+            continue
+
+        raw_level = bookmark.get('level', 1)
+        level = _as_int(raw_level)
+        if level is None:
+            report.reject(index, 'invalid_level', level=_shown(raw_level))
+            continue
+        if level < 1 or level > previous_level + 1:
+            level = min(max(level, 1), previous_level + 1)
+            report.levels_adjusted += 1
+
+        append([level, title, page])
+        previous_level = level
+
+    report.accepted = len(toc)
+    return toc, report
+
+
+def pdf_string(text):
+    """PDF literal for an outline title (plain ASCII avoids get_pdf_str's per-character loop)"""
+    if text.isascii() and text.isprintable() and '(' not in text and ')' not in text and '\\' not in text:
+        return f"({text})"
+    return fitz.get_pdf_str(text)
+
+
+def write_outline(doc, toc, collapse=COLLAPSE_LEVEL):
+    """Replace the document outline with toc (as produced by normalize_outline)
+
+    Writes the same objects as Document.set_toc(), but looks up each
+    target page once instead of once per entry and skips set_toc's
+    separate validation pass, which dominates for large outlines.
+    """
+    if not toc:
+        doc.set_toc([])
+        return 0
+    doc.set_toc([])  # drop any existing outline items
+
+    catalog = doc.pdf_catalog()
+    kind, value = doc.xref_get_key(catalog, 'Outlines')
+    if kind == 'xref':
+        root = int(value.split()[0])
+    else:
+        root = doc.get_new_xref()
+        doc.xref_set_key(catalog, 'Outlines', f"{root} 0 R")
+    xrefs = [root] + [doc.get_new_xref() for _ in toc]
+
+    # Per item: [count, first, last, prev, next, parent]; index 0 is the root
+    links = [[0, 0, 0, 0, 0, 0] for _ in range(len(toc) + 1)]
+    last_at_level = {0: 0}
+    for position, (level, _, _) in enumerate(toc, 1):
+        parent = last_at_level[level - 1]
+        last_at_level[level] = position
+        parent_links = links[parent]
+        parent_links[0] += -1 if collapse and level > collapse else 1
+        links[position][5] = parent
+        if parent_links[1]:
+            links[parent_links[2]][4] = position
+            links[position][3] = parent_links[2]
+        else:
+            parent_links[1] = position
+        parent_links[2] = position
+
+    targets = {}
+    for position, (level, title, page) in enumerate(toc, 1):
+        target = targets.get(page)
+        if target is None:
+            height = doc.page_cropbox(page - 1).height
+            target = targets[page] = f"/A<</S/GoTo/D[{doc.page_xref(page - 1)} 0 R/XYZ 72 {height - TOP_MARGIN:g} 0]>>"
+        count, first, last, prev, next_, parent = links[position]
+        parts = ['<<']
+        if count:
+            parts.append(f"/Count {count}")
+        parts.append(target)
+        if first:
+            parts.append(f"/First {xrefs[first]} 0 R/Last {xrefs[last]} 0 R")
+        if next_:
+            parts.append(f"/Next {xrefs[next_]} 0 R")
+        parts.append(f"/Parent {xrefs[parent]} 0 R")
+        if prev:
+            parts.append(f"/Prev {xrefs[prev]} 0 R")
+        parts.append('/Title')
+        parts.append(pdf_string(title))
+        parts.append('>>')
+        doc.update_object(xrefs[position], ''.join(parts))
+
+    count, first, last = links[0][:3]
+    doc.update_object(root, f"<</Count {count}/First {xrefs[first]} 0 R/Last {xrefs[last]} 0 R/Type/Outlines>>")
+    doc.init_doc()  # reload the outline so get_toc() sees the new items
+    return len(toc)
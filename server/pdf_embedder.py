@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+PDF bookmark embedding core
+Pure PyMuPDF work shared by the HTTP handler and its worker processes
+"""
+
+import io
+import os
+import tempfile
+import time
+
+from auto_outline import detect_headings, normalize_outline_mode
+from lazy_import import lazy_module
+from outline import normalize_outline, write_outline
+from peak_memory import PeakMemory
+from structured_log import get_logger
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+pikepdf = lazy_module('pikepdf', optional=True)  # optional: pip install pikepdf (qpdf) for linearized output
+
+logger = get_logger('embedder')
+
+# off: trust set_toc; outline-only: re-read the outline objects written into
+# the document; full: re-parse the saved bytes and compare TOC and page count
+VERIFY_LEVELS = ('off', 'outline-only', 'full')
+DEFAULT_VERIFY_LEVEL = os.environ.get('PDF_VERIFY_LEVEL', 'outline-only')
+
+# Document.tobytes() options per output profile. fast: plain rewrite (the
+# original behaviour); balanced: drop unreferenced objects, compress
+# streams and pack objects into object streams, usually smaller and no
+# slower; smallest: also merge duplicate objects, clean content streams and
+# recompress images and fonts
+OUTPUT_PROFILES = {
+    'fast': {},
+    'balanced': {'garbage': 3, 'deflate': True, 'use_objstms': 1},
+    'smallest': {'garbage': 4, 'clean': True, 'deflate': True, 'deflate_images': True,
+                 'deflate_fonts': True, 'use_objstms': 1},
+}
+DEFAULT_OUTPUT_PROFILE = os.environ.get('PDF_OUTPUT_PROFILE', 'fast')
+
+# Linearized ("fast web view") output lets viewers show page 1 before the
+# whole file has arrived. MuPDF dropped its linearizer (tobytes(linear=True)
+# raises), so the saved bytes are rewritten by qpdf through pikepdf.
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+DEFAULT_LINEARIZE = os.environ.get('PDF_LINEARIZE', '').strip().lower() in TRUE_VALUES
+if DEFAULT_LINEARIZE and pikepdf is None:
+    logger.warning("⚠️ PDF_LINEARIZE is set but pikepdf is not installed; output will not be linearized")
+    DEFAULT_LINEARIZE = False
+
+
+class VerificationError(RuntimeError):
+    """Raised when the written outline does not match the requested TOC"""
+
+
+def normalize_verify_level(level):
+    """Validate a verification level, falling back to the deployment default"""
+    if not level:
+        level = DEFAULT_VERIFY_LEVEL
+    level = level.strip().lower()
+    if level not in VERIFY_LEVELS:
+        raise ValueError(f"Unknown verification level '{level}' (expected one of {', '.join(VERIFY_LEVELS)})")
+    return level
+
+
+def normalize_output_profile(profile):
+    """Validate an output profile name, falling back to the deployment default"""
+    if not profile:
+        profile = DEFAULT_OUTPUT_PROFILE
+    profile = profile.strip().lower()
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{profile}' (expected one of {', '.join(OUTPUT_PROFILES)})")
+    return profile
+
+
+def normalize_linearize(value):
+    """Parse a linearize option (empty = deployment default)
+
+    Raises ValueError for unknown values, or if linearized output is
+    requested without pikepdf installed.
+    """
+    if value is None or value == '':
+        return DEFAULT_LINEARIZE
+    if isinstance(value, bool):
+        enabled = value
+    elif str(value).strip().lower() in TRUE_VALUES:
+        enabled = True
+    elif str(value).strip().lower() in FALSE_VALUES:
+        enabled = False
+    else:
+        raise ValueError(f"Invalid linearize value '{value}' (expected true or false)")
+    if enabled and pikepdf is None:
+        raise ValueError("Linearized output needs pikepdf (pip install pikepdf)")
+    return enabled
+
+
+def linearize_pdf(pdf_bytes):
+    """Rewrite saved PDF bytes as a linearized file with qpdf"""
+    with pikepdf.open(io.BytesIO(pdf_bytes)) as pdf:
+        output = io.BytesIO()
+        pdf.save(output, linearize=True)
+        return output.getvalue()
+
+
+def _compare_toc(expected, actual):
+    """Return a description of the first TOC mismatch, or None"""
+    if len(expected) != len(actual):
+        return f"expected {len(expected)} outline entries, found {len(actual)}"
+    for index, (want, got) in enumerate(zip(expected, actual)):
+        if list(want[:3]) != list(got[:3]):
+            return f"entry {index}: expected {want[:3]}, found {got[:3]}"
+    return None
+
+
+def check_outline(toc, written):
+    """Check an outline read back as [level, title, page] entries against toc"""
+    mismatch = _compare_toc(toc, written)
+    if mismatch:
+        raise VerificationError(f"Outline verification failed: {mismatch}")
+
+
+def verify_outline(doc, toc):
+    """Check the outline objects of an open document against toc"""
+    check_outline(toc, doc.get_toc(simple=True))
+
+
+def verify_full(pdf, toc, page_count):
+    """Re-open the saved PDF (bytes or a file path) and check its TOC and page count"""
+    if isinstance(pdf, str):
+        doc_verify = fitz.open(pdf, filetype="pdf")
+    else:
+        doc_verify = fitz.open(stream=pdf, filetype="pdf")
+    try:
+        if doc_verify.page_count != page_count:
+            raise VerificationError(
+                f"Full verification failed: expected {page_count} pages, found {doc_verify.page_count}")
+        mismatch = _compare_toc(toc, doc_verify.get_toc(simple=True))
+        if mismatch:
+            raise VerificationError(f"Full verification failed: {mismatch}")
+    finally:
+        doc_verify.close()
+
+
+def build_toc(page_count, custom_bookmarks=None):
+    """Build the [level, title, page] TOC list for a document
+
+    Returns (toc, report); report is None for the default bookmarks.
+    """
+    if custom_bookmarks:
+        # Use custom bookmarks from the viewer
+        logger.debug("📋 Using custom bookmarks: %d items", len(custom_bookmarks))
+        toc, report = normalize_outline(custom_bookmarks, page_count)
+        if report.rejected or report.levels_adjusted:
+            logger.debug("⚠️ Outline: %d bookmarks rejected, %d levels adjusted",
+                         report.rejected, report.levels_adjusted)
+        return toc, report
+
+    # Use default bookmarks for pages 1, 3, and 6
+    logger.debug("📋 Using default bookmarks (pages 1, 3, 6)")
+    toc = []
+    if page_count >= 1:
+        toc.append([1, "📄 Page 1", 1])
+
+    if page_count >= 3:
+        toc.append([1, "📄 Page 3", 3])
+
+    if page_count >= 6:
+        toc.append([1, "📄 Page 6", 6])
+
+    return toc, None
+
+
+def _write_document_outline(doc, custom_bookmarks, outline, verify_level, timings):
+    """Write the outline into an open document and check it at outline-only level
+
+    Returns (toc, report, source, verify_seconds).
+    """
+    source = 'custom' if custom_bookmarks else 'pages'
+    if not custom_bookmarks and outline == 'auto':
+        started = time.perf_counter()
+        custom_bookmarks = detect_headings(doc) or None
+        timings['auto_outline'] = time.perf_counter() - started
+        source = 'auto' if custom_bookmarks else 'pages'
+
+    # Create Table of Contents (TOC) structure
+    toc, report = build_toc(doc.page_count, custom_bookmarks)
+    logger.debug("📋 Final TOC: %d entries", len(toc))
+
+    # Set the table of contents
+    started = time.perf_counter()
+    if toc:
+        write_outline(doc, toc)
+    else:
+        logger.debug("⚠️ No bookmarks to add")
+    timings['set_toc'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if verify_level == 'outline-only':
+        verify_outline(doc, toc)
+    return toc, report, source, time.perf_counter() - started
+
+
+def embedding_info(page_count, toc, report, source, verify_level, profile, linearize, input_bytes, output_bytes,
+                   timings, memory):
+    """The info dict every embedding returns alongside the PDF"""
+    info = {
+        'page_count': page_count,
+        'bookmarks': len(toc),
+        'verification': verify_level,
+        'profile': profile,
+        'linearized': linearize,
+        'outline_source': source,
+        'input_bytes': input_bytes,
+        'output_bytes': output_bytes,
+        'timings': timings,
+        'memory': memory.to_json(),
+    }
+    if report is not None:
+        info['outline'] = report.to_json()
+    return info
+
+
+def embed_bookmarks(pdf_data, custom_bookmarks=None, verify_level=None, profile=None, linearize=None, outline=None):
+    """Add bookmarks to PDF using PyMuPDF with custom or default bookmarks
+
+    Module-level so it can be shipped to worker processes. Returns
+    (pdf_bytes, info) where info describes the document, what was
+    verified, the output profile used, how long each stage took, the
+    peak memory of the process and, for custom bookmarks, which entries
+    were rejected or adjusted. Without custom bookmarks, outline 'auto'
+    detects headings in this process (the server scans page ranges in
+    parallel beforehand instead).
+    """
+    verify_level = normalize_verify_level(verify_level)
+    profile = normalize_output_profile(profile)
+    linearize = normalize_linearize(linearize)
+    outline = normalize_outline_mode(outline)
+    timings = {}
+    try:
+        with PeakMemory() as memory:
+            # Open PDF document
+            started = time.perf_counter()
+            doc = fitz.open(stream=pdf_data, filetype="pdf")
+            page_count = doc.page_count
+            timings['fitz_open'] = time.perf_counter() - started
+            logger.debug("📄 PDF loaded: %d pages", page_count)
+
+            toc, report, source, verify_seconds = _write_document_outline(
+                doc, custom_bookmarks, outline, verify_level, timings)
+
+            # Save to bytes
+            started = time.perf_counter()
+            pdf_bytes = doc.tobytes(**OUTPUT_PROFILES[profile])
+            doc.close()
+            timings['tobytes'] = time.perf_counter() - started
+
+            if linearize:
+                started = time.perf_counter()
+                pdf_bytes = linearize_pdf(pdf_bytes)
+                timings['linearize'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if verify_level == 'full':
+                verify_full(pdf_bytes, toc, page_count)
+            if verify_level != 'off':
+                timings['verification'] = verify_seconds + time.perf_counter() - started
+                logger.debug("✅ Verification (%s) passed: %d outline entries", verify_level, len(toc))
+
+        logger.debug("📄 PDF with bookmarks created: %d bytes (%s profile)", len(pdf_bytes), profile)
+        info = embedding_info(page_count, toc, report, source, verify_level, profile, linearize,
+                               len(pdf_data), len(pdf_bytes), timings, memory)
+        return pdf_bytes, info
+
+    except Exception as e:
+        logger.error("❌ Error adding bookmarks: %s", e, exc_info=True)
+        raise
+
+
+def embed_bookmarks_file(input_path, custom_bookmarks=None, verify_level=None, profile=None, linearize=None,
+                         outline=None):
+    """Large-document variant of embed_bookmarks that works on files
+
+    MuPDF reads the document from ``input_path`` instead of a copy in
+    memory, and the result is written to a file rather than returned as
+    bytes. With the fast profile the outline is appended to ``input_path``
+    as an incremental update, so only the new objects are written and
+    that file is the result; other profiles, or documents that cannot be
+    updated incrementally, are saved to a new temp file next to it.
+    Returns (output_path, info); the caller owns both files.
+    """
+    verify_level = normalize_verify_level(verify_level)
+    profile = normalize_output_profile(profile)
+    linearize = normalize_linearize(linearize)
+    outline = normalize_outline_mode(outline)
+    timings = {}
+    directory = os.path.dirname(input_path)
+    input_bytes = os.path.getsize(input_path)
+    output_path = None
+    try:
+        with PeakMemory() as memory:
+            started = time.perf_counter()
+            doc = fitz.open(input_path, filetype="pdf")
+            page_count = doc.page_count
+            timings['fitz_open'] = time.perf_counter() - started
+            logger.debug("📄 PDF opened from file: %d pages, %d bytes", page_count, input_bytes)
+
+            toc, report, source, verify_seconds = _write_document_outline(
+                doc, custom_bookmarks, outline, verify_level, timings)
+
+            started = time.perf_counter()
+            if profile == 'fast' and doc.can_save_incrementally():
+                doc.save(input_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+                output_path = input_path
+            else:
+                fd, output_path = tempfile.mkstemp(dir=directory, suffix='.pdf')
+                os.close(fd)
+                doc.save(output_path, **OUTPUT_PROFILES[profile])
+            doc.close()
+            timings['tobytes'] = time.perf_counter() - started
+
+            if linearize:
+                started = time.perf_counter()
+                fd, linear_path = tempfile.mkstemp(dir=directory, suffix='.pdf')
+                os.close(fd)
+                with pikepdf.open(output_path) as pdf:
+                    pdf.save(linear_path, linearize=True)
+                if output_path != input_path:
+                    os.unlink(output_path)
+                output_path = linear_path
+                timings['linearize'] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            if verify_level == 'full':
+                verify_full(output_path, toc, page_count)
+            if verify_level != 'off':
+                timings['verification'] = verify_seconds + time.perf_counter() - started
+                logger.debug("✅ Verification (%s) passed: %d outline entries", verify_level, len(toc))
+
+        output_bytes = os.path.getsize(output_path)
+        logger.debug("📄 PDF with bookmarks saved: %d bytes (%s profile)", output_bytes, profile)
+        info = embedding_info(page_count, toc, report, source, verify_level, profile, linearize,
+                               input_bytes, output_bytes, timings, memory)
+        info['incremental'] = output_path == input_path
+        return output_path, info
+
+    except Exception as e:
+        if output_path is not None and output_path != input_path and os.path.exists(output_path):
+            os.unlink(output_path)
+        logger.error("❌ Error adding bookmarks: %s", e, exc_info=True)
+        raise
+
+
+def count_pages(pdf_data):
+    """Open a PDF and return its page count (validates that it parses)"""
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        return doc.page_count
+    finally:
+        doc.close()
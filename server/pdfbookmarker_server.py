@@ -6,29 +6,31 @@ Optimized for iOS Safari compatibility
 
 import io
 import json
-import os
-import tempfile
-import traceback
-from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import parse_qs, urlparse
 
-# Import pdfbookmarker
-try:
-    from pdfbookmarker import pdfbm
-    print("✅ pdfbookmarker imported successfully")
-except ImportError as e:
-    print(f"❌ Failed to import pdfbookmarker: {e}")
+from engines import ENGINES, embed_document
+from structured_log import SAMPLED, get_logger
+
+logger = get_logger('pdfbookmarker_server')
+
+# pdfbookmarker runs through its engine, which works with either of its APIs
+if not ENGINES['pdfbookmarker'].available():
+    logger.error("❌ Failed to import pdfbookmarker (pip install pdfbookmarker)")
     exit(1)
+logger.debug("✅ pdfbookmarker imported successfully")
 
 
 class PDFBookmarkHandler(BaseHTTPRequestHandler):
     """HTTP handler for PDF bookmark embedding using pdfbookmarker"""
 
+    def log_request(self, code='-', size='-'):
+        """One summary line per request at INFO"""
+        logger.info("%s - \"%s\" %s", self.address_string(), self.requestline, getattr(code, 'value', code))
+
     def log_message(self, format, *args):
-        """Custom logging with timestamps"""
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"[{timestamp}] {format % args}")
+        """Route http.server messages through the structured logger"""
+        logger.debug("%s - %s", self.address_string(), format % args)
 
     def do_GET(self):
         """Handle GET requests"""
@@ -76,12 +78,12 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
     def handle_bookmark_embedding(self):
         """Handle PDF bookmark embedding requests using pdfbookmarker"""
         try:
-            print(f"📥 Received POST request to /embed-bookmarks")
-            print(f"📋 Headers: {dict(self.headers)}")
+            logger.debug("📥 Received POST request to /embed-bookmarks")
+            logger.debug("📋 Headers: %s", dict(self.headers), extra=SAMPLED)
             
             # Parse multipart form data
             content_type = self.headers.get('Content-Type', '')
-            print(f"📄 Content-Type: {content_type}")
+            logger.debug("📄 Content-Type: %s", content_type)
             
             if not content_type.startswith('multipart/form-data'):
                 self.send_error(400, "Expected multipart/form-data")
@@ -94,16 +96,16 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
                 return
                 
             content_length = int(content_length_header)
-            print(f"📏 Content-Length: {content_length}")
+            logger.debug("📏 Content-Length: %s", content_length)
             
             if content_length == 0:
                 self.send_error(400, "No content provided")
                 return
 
             # Read the entire request body
-            print("📖 Reading request body...")
+            logger.debug("📖 Reading request body...")
             post_data = self.rfile.read(content_length)
-            print(f"📦 Read {len(post_data)} bytes")
+            logger.debug("📦 Read %s bytes", len(post_data))
             
             # Extract PDF data from multipart form
             pdf_data = self.extract_pdf_from_multipart(post_data, content_type)
@@ -111,7 +113,7 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
                 self.send_error(400, "No valid PDF file found in request")
                 return
 
-            print(f"📁 Processing PDF: {len(pdf_data)} bytes")
+            logger.debug("📁 Processing PDF: %s bytes", len(pdf_data))
 
             # Process PDF with bookmarks using pdfbookmarker
             processed_pdf = self.add_bookmarks_with_pdfbookmarker(pdf_data)
@@ -125,11 +127,10 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(processed_pdf)
 
-            print(f"✅ PDF processed successfully: {len(processed_pdf)} bytes")
+            logger.debug("✅ PDF processed successfully: %s bytes", len(processed_pdf))
 
         except Exception as e:
-            print(f"❌ Error processing PDF: {str(e)}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
+            logger.error("❌ Error processing PDF: %s", str(e), exc_info=True)
             
             self.send_response(500)
             self.send_cors_headers()
@@ -148,7 +149,7 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
         try:
             # Extract boundary from content type
             if 'boundary=' not in content_type:
-                print("❌ No boundary found in Content-Type")
+                logger.warning("❌ No boundary found in Content-Type")
                 return None
                 
             boundary = content_type.split('boundary=')[1]
@@ -157,16 +158,16 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
                 boundary = boundary[1:-1]
                 
             boundary_bytes = boundary.encode()
-            print(f"🔗 Boundary: {boundary}")
+            logger.debug("🔗 Boundary: %s", boundary)
             
             # Split by boundary
             parts = post_data.split(b'--' + boundary_bytes)
-            print(f"📂 Found {len(parts)} parts")
+            logger.debug("📂 Found %s parts", len(parts))
             
             for i, part in enumerate(parts):
-                print(f"📄 Part {i}: {len(part)} bytes")
+                logger.debug("📄 Part %s: %s bytes", i, len(part), extra=SAMPLED)
                 if b'Content-Disposition: form-data; name="pdf"' in part:
-                    print("✅ Found PDF part")
+                    logger.debug("✅ Found PDF part")
                     # Find the start of file data (after headers)
                     header_end = part.find(b'\r\n\r\n')
                     if header_end != -1:
@@ -176,73 +177,39 @@ class PDFBookmarkHandler(BaseHTTPRequestHandler):
                             pdf_data = pdf_data[:-2]
                         if pdf_data.endswith(b'--'):
                             pdf_data = pdf_data[:-2]
-                        print(f"📄 Extracted PDF data: {len(pdf_data)} bytes")
+                        logger.debug("📄 Extracted PDF data: %s bytes", len(pdf_data))
                         
                         # Validate PDF data
                         if len(pdf_data) < 100:  # PDF files should be at least 100 bytes
-                            print("❌ PDF data too small")
+                            logger.warning("❌ PDF data too small")
                             return None
                         
                         if not pdf_data.startswith(b'%PDF'):
-                            print("❌ Invalid PDF header")
+                            logger.warning("❌ Invalid PDF header")
                             return None
                             
                         return pdf_data
 
-            print("❌ No PDF part found")
+            logger.warning("❌ No PDF part found")
             return None
             
         except Exception as e:
-            print(f"❌ Error extracting PDF: {e}")
+            logger.error("❌ Error extracting PDF: %s", e)
             return None
 
     def add_bookmarks_with_pdfbookmarker(self, pdf_data):
-        """Add bookmarks using pdfbookmarker library"""
+        """Add bookmarks using pdfbookmarker library
+
+        The engine hands pdfbookmarker in-memory streams (or memfd/tmpfs
+        files for its older path-based API), so nothing is written to disk.
+        """
         try:
-            # Create temporary files
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as input_pdf:
-                input_pdf.write(pdf_data)
-                input_pdf_path = input_pdf.name
-            
-            with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as bookmarks_file:
-                # Create bookmark entries for pages 1, 3, and 6
-                bookmarks_content = '1"📄 Page 1"|1\n1"📄 Page 3"|3\n1"📄 Page 6"|6\n'
-                bookmarks_file.write(bookmarks_content.encode('utf-8'))
-                bookmarks_file_path = bookmarks_file.name
-            
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as output_pdf:
-                output_pdf_path = output_pdf.name
-            
-            print(f"📂 Input PDF: {input_pdf_path}")
-            print(f"📋 Bookmarks file: {bookmarks_file_path}")
-            print(f"📁 Output PDF: {output_pdf_path}")
-            
-            try:
-                # Use pdfbookmarker to add bookmarks
-                print("🔖 Adding bookmarks with pdfbookmarker...")
-                pdfbm(input_pdf_path, bookmarks_file_path, output_pdf_path)
-                print("✅ Bookmarks added successfully")
-                
-                # Read the processed PDF
-                with open(output_pdf_path, 'rb') as f:
-                    processed_pdf_data = f.read()
-                
-                print(f"📄 Processed PDF size: {len(processed_pdf_data)} bytes")
-                return processed_pdf_data
-                
-            finally:
-                # Clean up temporary files
-                try:
-                    os.unlink(input_pdf_path)
-                    os.unlink(bookmarks_file_path)
-                    os.unlink(output_pdf_path)
-                    print("🧹 Temporary files cleaned up")
-                except:
-                    pass
-                    
+            logger.debug("🔖 Adding bookmarks with pdfbookmarker...")
+            processed_pdf_data, info = embed_document(pdf_data, None, 'off', 'fast', False, None, 'pdfbookmarker')
+            logger.debug("📄 Processed PDF size: %s bytes (%s bookmarks)", len(processed_pdf_data), info['bookmarks'])
+            return processed_pdf_data
         except Exception as e:
-            print(f"❌ Error in pdfbookmarker processing: {e}")
-            print(f"📋 Traceback: {traceback.format_exc()}")
+            logger.error("❌ Error in pdfbookmarker processing: %s", e, exc_info=True)
             raise
 
 
@@ -251,20 +218,20 @@ def main():
     port = 8081
     server_address = ('', port)
     
-    print(f"🚀 Starting PDF Bookmark Server (pdfbookmarker) on port {port}")
-    print(f"📱 iOS Safari compatible")
-    print(f"🔗 Health check: http://localhost:{port}/health")
-    print(f"📄 API endpoint: http://localhost:{port}/embed-bookmarks")
-    print(f"🌐 Network access: http://0.0.0.0:{port}")
+    logger.info("🚀 Starting PDF Bookmark Server (pdfbookmarker) on port %s", port)
+    logger.info("📱 iOS Safari compatible")
+    logger.info("🔗 Health check: http://localhost:%s/health", port)
+    logger.info("📄 API endpoint: http://localhost:%s/embed-bookmarks", port)
+    logger.info("🌐 Network access: http://0.0.0.0:%s", port)
     
     try:
         httpd = HTTPServer(server_address, PDFBookmarkHandler)
-        print(f"✅ Server ready! Listening on all interfaces, port {port}")
+        logger.info("✅ Server ready! Listening on all interfaces, port %s", port)
         httpd.serve_forever()
     except KeyboardInterrupt:
-        print("\n🛑 Server stopped by user")
+        logger.info("🛑 Server stopped by user")
     except Exception as e:
-        print(f"❌ Server error: {e}")
+        logger.error("❌ Server error: %s", e)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Per-job peak memory of the current process
+On Linux the resident-set high-water mark (VmHWM) is reset before a job
+and read after it, so each job reports its own peak, MuPDF's buffers
+included. Elsewhere the process-lifetime ru_maxrss is reported instead.
+"""
+
+import resource
+import sys
+
+
+def _status_bytes(field):
+    """A 'kB' field of /proc/self/status in bytes, or None"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_high_water_mark():
+    """Reset VmHWM to the current RSS; False if the kernel does not allow it"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _max_rss():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024  # bytes on macOS, KiB on Linux
+
+
+class PeakMemory:
+    """Context manager measuring the peak RSS of the process during a block
+
+    ``peak`` is the highest resident size in bytes, ``baseline`` the size
+    on entry. ``per_job`` is False when the peak covers the whole process
+    lifetime, because the high-water mark could not be reset. Concurrent
+    jobs in one process (PDF_WORKERS=0) share one measurement.
+    """
+
+    def __init__(self):
+        self.baseline = None
+        self.peak = None
+        self.per_job = False
+
+    def __enter__(self):
+        self.per_job = _reset_high_water_mark()
+        self.baseline = _status_bytes('VmRSS')
+        return self
+
+    def __exit__(self, *exc_info):
+        peak = _status_bytes('VmHWM') if self.per_job else None
+        self.peak = peak if peak is not None else _max_rss()
+        return False
+
+    def to_json(self):
+        return {'peak_rss_bytes': self.peak, 'baseline_rss_bytes': self.baseline, 'per_job': self.per_job}
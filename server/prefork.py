@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+Pre-fork serving with graceful reloads
+With SERVER_PROCESSES above 1 a supervisor binds the port once and runs
+that many server processes on the same listening socket, each a fresh
+interpreter that inherits the socket's descriptor; the kernel gives each
+connection to whichever process accepts it first. A shared socket rather
+than one SO_REUSEPORT socket per process means connections waiting in the
+backlog are never lost when a process stops.
+
+The supervisor restarts processes that die, backing off if they keep
+dying on startup. On SIGHUP it replaces them one at a time: the new
+process accepts connections before the old one is told to stop, and a
+stopping process finishes the requests and jobs in flight (up to
+GRACEFUL_TIMEOUT) before it exits. SIGTERM stops all of them that way.
+
+Jobs, stored documents and cached results belong to the process that
+created them, so each process also listens on a Unix socket in a private
+run directory; a request for an ID it does not hold is passed on to the
+sibling that does.
+
+Environment:
+    SERVER_PROCESSES  server processes; 1 (default) runs without a supervisor, auto = CPU count
+    GRACEFUL_TIMEOUT  seconds a stopping process waits for requests and jobs in flight (default 30)
+    REUSE_PORT        1 to bind with SO_REUSEPORT, so a new supervisor can start while the old one drains
+"""
+
+import glob
+import http.client
+import os
+import shutil
+import signal
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer
+
+from structured_log import get_logger
+
+logger = get_logger('prefork')
+
+GRACEFUL_TIMEOUT = float(os.environ.get('GRACEFUL_TIMEOUT', 30))
+REUSE_PORT = os.environ.get('REUSE_PORT', '').strip().lower() in ('1', 'true', 'yes', 'on')
+START_TIMEOUT = 60  # seconds a new process gets to start listening during a reload
+KILL_GRACE = 5  # seconds past GRACEFUL_TIMEOUT before a stopping process is killed
+MAX_RESTART_DELAY = 30
+STABLE_SECONDS = 10  # a process that lived this long resets its slot's restart backoff
+
+LISTEN_FD_ENV = 'PREFORK_LISTEN_FD'
+RUN_DIR_ENV = 'PREFORK_RUN_DIR'
+SLOT_ENV = 'PREFORK_SLOT'
+
+FORWARDED_HEADER = 'X-Prefork-Forwarded'
+MAX_FORWARDED_BODY = 1024 * 1024
+FORWARD_TIMEOUT = 300
+# Not passed between front end and sibling; the front end sets its own
+SKIPPED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'te', 'trailer', 'upgrade',
+                   'proxy-connection', 'expect', 'server', 'date'}
+
+
+def server_processes():
+    """Number of server processes from SERVER_PROCESSES (an integer or auto)"""
+    value = os.environ.get('SERVER_PROCESSES', '1').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    try:
+        processes = int(value)
+    except ValueError:
+        raise ValueError(f"Bad SERVER_PROCESSES {value!r} (expected a number or auto)")
+    if processes < 1:
+        raise ValueError(f"Bad SERVER_PROCESSES {value!r} (expected at least 1)")
+    return processes
+
+
+def is_worker():
+    """True in a server process started by the supervisor"""
+    return LISTEN_FD_ENV in os.environ
+
+
+def inherited_socket():
+    """The listening socket passed down by the supervisor, or None"""
+    fd = os.environ.get(LISTEN_FD_ENV)
+    if fd is None:
+        return None
+    return socket.socket(fileno=int(fd))
+
+
+def wait_until(condition, timeout, interval=0.1):
+    """Poll condition() until it is true; False if timeout passes first"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+class GracefulHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that can wait for the requests in progress after shutdown()"""
+
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        self.busy = 0
+        self._idle = threading.Condition()
+        super().__init__(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        with self._idle:
+            self.busy += 1
+        try:
+            super().process_request(request, client_address)
+        except BaseException:
+            self._finished()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._finished()
+
+    def _finished(self):
+        with self._idle:
+            self.busy -= 1
+            self._idle.notify_all()
+
+    def drain(self, timeout):
+        """Wait until no request is in progress; False on timeout"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self.busy == 0, timeout)
+
+
+class InternalServer(socketserver.ThreadingUnixStreamServer):
+    """Unix socket listener through which sibling processes reach this one"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects an (address, port) pair
+        return request, ('sibling', 0)
+
+
+_internal = None
+
+
+def socket_path(pid):
+    return os.path.join(os.environ[RUN_DIR_ENV], f'worker-{pid}.sock')
+
+
+def start_internal_server(handler_class):
+    """Listen for siblings on this process's Unix socket; the supervisor treats it as ready"""
+    global _internal
+    path = socket_path(os.getpid())
+    _internal = InternalServer(path, handler_class)
+    threading.Thread(target=_internal.serve_forever, name='prefork-internal', daemon=True).start()
+    return _internal
+
+
+def stop_internal_server():
+    """Stop taking requests from siblings and remove the socket"""
+    if _internal is None:
+        return
+    _internal.shutdown()
+    _internal.server_close()
+    try:
+        os.unlink(_internal.server_address)
+    except OSError:
+        pass
+
+
+def has_siblings():
+    return _internal is not None
+
+
+def siblings():
+    """Unix socket paths of the other server processes"""
+    own = socket_path(os.getpid())
+    return [path for path in glob.glob(socket_path('*')) if path != own]
+
+
+def stats():
+    """This process's place in a pre-forked server, for /health"""
+    if not is_worker():
+        return {'pid': os.getpid(), 'prefork': False}
+    return {'pid': os.getpid(), 'prefork': True, 'slot': int(os.environ.get(SLOT_ENV, 0)),
+            'supervisor': os.getppid(), 'siblings': len(siblings()) if has_siblings() else 0}
+
+
+def watch_supervisor(on_exit):
+    """Call on_exit once if the supervisor dies, so the process does not outlive it"""
+    parent = os.getppid()
+
+    def watch():
+        while os.getppid() == parent:
+            time.sleep(1)
+        logger.warning("⚠️ Supervisor %d exited, stopping", parent)
+        on_exit()
+
+    threading.Thread(target=watch, name='prefork-watchdog', daemon=True).start()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection to a sibling's Unix socket"""
+
+    def __init__(self, path, timeout=FORWARD_TIMEOUT):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+_owners = OrderedDict()  # (collection, id) -> socket path of the sibling holding it, most recent last
+_owners_lock = threading.Lock()
+MAX_OWNERS = 4096
+
+
+def _remember(item, path):
+    with _owners_lock:
+        _owners[item] = path
+        _owners.move_to_end(item)
+        while len(_owners) > MAX_OWNERS:
+            _owners.popitem(last=False)
+
+
+def forward(handler, item):
+    """Relay handler's request to the sibling that holds item
+
+    Siblings are asked in turn, starting with the one that answered for
+    item last time, until one answers with anything but 404. Returns that
+    sibling's socket path, or None (with the request body still readable)
+    if none holds it.
+    """
+    length = handler.headers.get('Content-Length')
+    if length is None and handler.body_is_chunked():
+        return None
+    try:
+        length = int(length or 0)
+    except ValueError:
+        return None
+    if length > MAX_FORWARDED_BODY:
+        return None
+    with _owners_lock:
+        known = _owners.get(item)
+    candidates = [path for path in siblings() if path != known]
+    if known is not None and os.path.exists(known):
+        candidates.insert(0, known)
+    if not candidates:
+        return None
+
+    body = handler.rfile.read(length) if length else None
+    headers = {name: value for name, value in handler.headers.items() if name.lower() not in SKIPPED_HEADERS}
+    headers[FORWARDED_HEADER] = '1'
+    for path in candidates:
+        connection = UnixHTTPConnection(path)
+        try:
+            connection.request(handler.command, handler.path, body=body, headers=headers)
+            response = connection.getresponse()
+            if response.status == 404:
+                response.read()  # let the sibling finish writing before the connection closes
+                continue
+            _remember(item, path)
+            relay(handler, response)
+            return path
+        except OSError as e:
+            # A sibling that is stopping may already have closed its socket
+            logger.debug("Sibling %s unavailable: %s", path, e)
+        finally:
+            connection.close()
+    with _owners_lock:
+        _owners.pop(item, None)
+    if body is not None:
+        handler.rfile = _Replay(body, handler.rfile)
+    return None
+
+
+class _Replay:
+    """rfile stand-in that yields an already read body, closing the original with it"""
+
+    def __init__(self, body, original):
+        self._body = body
+        self._offset = 0
+        self._original = original
+
+    def read(self, size=-1):
+        end = len(self._body) if size is None or size < 0 else self._offset + size
+        data = self._body[self._offset:end]
+        self._offset += len(data)
+        return data
+
+    def readline(self, limit=-1):
+        end = self._body.find(b'\n', self._offset) + 1 or len(self._body)
+        if limit is not None and limit >= 0:
+            end = min(end, self._offset + limit)
+        return self.read(end - self._offset)
+
+    def close(self):
+        self._original.close()
+
+
+def relay(handler, response):
+    """Send a sibling's response through handler"""
+    handler.send_response(response.status, response.reason)
+    for name, value in response.getheaders():
+        if name.lower() not in SKIPPED_HEADERS:
+            handler.send_header(name, value)
+    handler.end_headers()
+    if handler.command == 'HEAD':
+        return
+    while True:
+        data = response.read(64 * 1024)
+        if not data:
+            break
+        handler.wfile.write(data)
+
+
+class WorkerProcess:
+    """One server process started by the supervisor"""
+
+    def __init__(self, slot, process, run_dir):
+        self.slot = slot
+        self.process = process
+        self.started = time.monotonic()
+        self.socket_path = os.path.join(run_dir, f'worker-{process.pid}.sock')
+        self.kill_at = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill_group(self):
+        """Kill the process and its PDF workers, which a crash or SIGKILL would leave behind"""
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def ready(self):
+        return os.path.exists(self.socket_path)
+
+    def stop(self, timeout):
+        """Ask the process to finish what it is doing and exit"""
+        if self.kill_at is None and self.alive():
+            self.process.send_signal(signal.SIGTERM)
+        self.kill_at = time.monotonic() + timeout + KILL_GRACE
+
+    def clean_up(self):
+        """After exit: remove what a crashed process leaves behind"""
+        self.kill_group()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def kill_if_overdue(self):
+        if self.kill_at is not None and time.monotonic() >= self.kill_at and self.alive():
+            logger.warning("⚠️ Process %d did not stop in time, killing it", self.pid)
+            self.kill_group()
+
+
+class Supervisor:
+    """Runs ``processes`` server processes on one shared listening socket
+
+    ``command`` starts one server process; it finds the socket and its
+    run directory through the PREFORK_* environment variables.
+    """
+
+    def __init__(self, server_address, processes, command, graceful_timeout=GRACEFUL_TIMEOUT,
+                 reuse_port=REUSE_PORT):
+        self.server_address = server_address
+        self.processes = processes
+        self.command = command
+        self.graceful_timeout = graceful_timeout
+        self.reuse_port = reuse_port
+        self.workers = {}  # slot -> WorkerProcess
+        self.stopping = []  # WorkerProcess being drained
+        self.failures = {}  # slot -> consecutive early exits
+        self.restart_at = {}  # slot -> monotonic time of the next start attempt
+        self.restarts = 0
+        self.socket = None
+        self.run_dir = None
+        self._stop_requested = False
+        self._force_stop = False
+        self._reload_requested = False
+
+    def spawn(self, slot):
+        env = dict(os.environ, **{LISTEN_FD_ENV: str(self.socket.fileno()), RUN_DIR_ENV: self.run_dir,
+                                  SLOT_ENV: str(slot)})
+        # Share the cores between the processes' PDF worker pools unless told otherwise
+        env.setdefault('PDF_WORKERS', str(max(1, (os.cpu_count() or 1) // self.processes)))
+        # A process group of its own: Ctrl-C reaches only the supervisor, which stops the rest in order
+        process = subprocess.Popen(self.command, env=env, pass_fds=[self.socket.fileno()], start_new_session=True)
+        return WorkerProcess(slot, process, self.run_dir)
+
+    def run(self):
+        """Start the processes and supervise them until SIGTERM or SIGINT"""
+        host, port = self.server_address
+        self.socket = socket.create_server((host, port), backlog=128, reuse_port=self.reuse_port)
+        self.socket.set_inheritable(True)
+        self.run_dir = tempfile.mkdtemp(prefix='pdfbookmark-prefork-')
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        try:
+            for slot in range(self.processes):
+                self.workers[slot] = self.spawn(slot)
+            logger.info("👥 Supervisor %d started %d server process(es) on port %d: %s", os.getpid(),
+                        self.processes, port, ', '.join(str(worker.pid) for worker in self.workers.values()))
+            while not self._stop_requested:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                self.check()
+                time.sleep(0.2)
+        finally:
+            self.stop()
+
+    def _request_stop(self, signum, frame):
+        # A second Ctrl-C skips waiting for the processes to finish
+        self._force_stop = self._force_stop or (self._stop_requested and signum == signal.SIGINT)
+        self._stop_requested = True
+
+    def _request_reload(self, signum, frame):
+        self._reload_requested = True
+
+    def check(self):
+        """Restart processes that exited and reap or kill stopping ones"""
+        now = time.monotonic()
+        for slot, worker in list(self.workers.items()):
+            if worker is not None and worker.alive():
+                continue
+            if worker is not None:
+                worker.clean_up()
+                lived = now - worker.started
+                if lived < STABLE_SECONDS:
+                    self.failures[slot] = self.failures.get(slot, 0) + 1
+                    delay = min(MAX_RESTART_DELAY, 2 ** (self.failures[slot] - 1))
+                else:
+                    self.failures.pop(slot, None)
+                    delay = 0
+                logger.warning("⚠️ Server process %d exited with %s after %.1f s, restarting in %d s",
+                               worker.pid, worker.process.returncode, lived, delay)
+                self.workers[slot] = None
+                self.restart_at[slot] = now + delay
+            if now >= self.restart_at.get(slot, 0):
+                self.workers[slot] = self.spawn(slot)
+                self.restarts += 1
+        self.check_stopping()
+
+    def reload(self):
+        """Replace the processes one at a time, each only once its successor is listening"""
+        logger.info("🔄 Rolling reload of %d server process(es)", len(self.workers))
+        for slot in sorted(self.workers):
+            if self._stop_requested:
+                return
+            old = self.workers[slot]
+            new = self.spawn(slot)
+            deadline = time.monotonic() + START_TIMEOUT
+            while not new.ready() and new.alive() and time.monotonic() < deadline and not self._stop_requested:
+                time.sleep(0.05)
+                self.check_stopping()
+            if not new.ready():
+                logger.error("❌ Reload aborted: the new process for slot %d did not start", slot)
+                new.kill_group()
+                new.process.wait()
+                return
+            self.workers[slot] = new
+            self.restart_at.pop(slot, None)
+            if old is not None:
+                old.stop(self.graceful_timeout)
+                self.stopping.append(old)
+        logger.info("✅ Reload complete: %s", ', '.join(str(worker.pid) for worker in self.workers.values()))
+
+    def check_stopping(self):
+        for worker in list(self.stopping):
+            if worker.alive():
+                worker.kill_if_overdue()
+            else:
+                worker.clean_up()
+                self.stopping.remove(worker)
+                logger.info("👋 Server process %d stopped (exit %s)", worker.pid, worker.process.returncode)
+
+    def stop(self):
+        """Stop every process gracefully, then release the socket"""
+        workers = [worker for worker in self.workers.values() if worker is not None] + self.stopping
+        logger.info("🛑 Stopping %d server process(es)", len(workers))
+        for worker in workers:
+            worker.stop(self.graceful_timeout)
+        while any(worker.alive() for worker in workers):
+            for worker in workers:
+                if self._force_stop:
+                    worker.kill_group()
+                else:
+                    worker.kill_if_overdue()
+            time.sleep(0.1)
+        for worker in workers:
+            worker.kill_group()
+        self.workers.clear()
+        self.stopping = []
+        if self.socket is not None:
+            self.socket.close()
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def supervise(server_address, processes, script):
+    """Run script under a Supervisor with the current interpreter"""
+    Supervisor(server_address, processes, [sys.executable, os.path.abspath(script)]).run()
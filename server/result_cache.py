@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache for processed PDFs
+Keyed by the SHA-256 of the uploaded PDF plus the normalized bookmark list,
+with an in-memory LRU tier and an optional on-disk tier
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from structured_log import get_logger
+
+logger = get_logger('result_cache')
+
+
+def normalize_bookmarks(bookmarks):
+    """Canonical form of a bookmark list for hashing (None = default bookmarks)"""
+    if not bookmarks:
+        return None
+    normalized = []
+    for bookmark in bookmarks:
+        if isinstance(bookmark, dict):
+            normalized.append([bookmark.get('level', 1), bookmark.get('title'), bookmark.get('page')])
+        else:
+            normalized.append(bookmark)
+    return normalized
+
+
+def cache_key(pdf_digest, bookmarks, **options):
+    """Build the cache key for a PDF digest, bookmark list and output options
+
+    Options that are None are left out, so adding an option does not
+    change the keys of requests that do not use it.
+    """
+    options = {name: value for name, value in options.items() if value is not None}
+    payload = json.dumps(
+        {'bookmarks': normalize_bookmarks(bookmarks), 'options': options},
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    digest = hashlib.sha256()
+    digest.update(pdf_digest.encode('ascii'))
+    digest.update(payload.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Two-tier LRU cache of processed PDFs with hit/miss counters
+
+    The memory tier is bounded by ``memory_budget`` bytes. When ``disk_dir``
+    is set, results are also written there and the oldest files are evicted
+    once the directory exceeds ``disk_budget`` bytes. Without a disk tier,
+    results too large for memory are spooled to a temporary directory
+    (within the same budget) so they can still be fetched again by key.
+    Pinned keys (results of unexpired jobs) are never evicted.
+    """
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, disk_dir=None, disk_budget=1024 * 1024 * 1024, spool=True):
+        self.memory_budget = memory_budget
+        self.disk_dir = disk_dir
+        self.disk_budget = disk_budget
+        self.spool = spool and not disk_dir
+        self._directory = disk_dir  # the disk tier, or the spool once something is spooled
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self._memory = OrderedDict()  # key -> (data, meta)
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size
+        self._disk_bytes = 0
+        self._pins = {}  # key -> number of holders
+        self._lock = threading.Lock()
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @classmethod
+    def from_env(cls):
+        """Configure from RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_DIR and RESULT_CACHE_DISK_BYTES"""
+        return cls(
+            memory_budget=int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', 64 * 1024 * 1024)),
+            disk_dir=os.environ.get('RESULT_CACHE_DIR') or None,
+            disk_budget=int(os.environ.get('RESULT_CACHE_DISK_BYTES', 1024 * 1024 * 1024)),
+        )
+
+    def _paths(self, key):
+        base = os.path.join(self._directory, key)
+        return base + '.pdf', base + '.json'
+
+    def _load_disk_index(self):
+        """Index existing cache files, oldest access first"""
+        entries = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.pdf'):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            entries.append((stat.st_atime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        """Return (data, meta) for key, or None on a miss"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry
+            on_disk = key in self._disk
+
+        if on_disk:
+            entry = self._read_disk(key)
+            if entry is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._store_memory(key, entry)
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def contains(self, key):
+        """True if key is cached in this process, without counting a hit or miss"""
+        with self._lock:
+            return key in self._memory or key in self._disk
+
+    def open(self, key):
+        """Return (data, file, meta) for key without reading disk entries into memory, or None
+
+        Exactly one of data and file is set; the caller closes the file.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return entry[0], None, entry[1]
+            if key not in self._disk:
+                self.misses += 1
+                return None
+            self._disk.move_to_end(key)
+
+        pdf_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            file = open(pdf_path, 'rb')
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.disk_hits += 1
+        return None, file, meta
+
+    def put(self, key, data, meta=None):
+        """Store a processed PDF under key"""
+        entry = (data, meta or {})
+        with self._lock:
+            held = self._store_memory(key, entry)
+        if self.disk_dir or (not held and self._spool_directory()):
+            self._write_disk(key, entry)
+
+    def put_file(self, key, path, meta=None):
+        """Store a processed PDF that is already in a file by moving the file in
+
+        Used for large documents, which are never read into memory. Returns
+        False, leaving the file where it is, if there is nowhere to keep it
+        (no disk tier or spool, larger than the disk budget, or another
+        filesystem).
+        """
+        size = os.path.getsize(path)
+        if size > self.disk_budget or not (self.disk_dir or self._spool_directory()):
+            return False
+        pdf_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta or {}, f)
+            os.replace(path, pdf_path)
+        except OSError as e:
+            logger.warning("⚠️ Could not move result %s into the cache: %s", key, e)
+            return False
+        self._index_disk(key, size)
+        return True
+
+    def pin(self, key, entry):
+        """Keep (data, meta) cached under key until a matching unpin()
+
+        The entry is written to the disk tier or spool, whose eviction skips
+        pinned keys, so the memory tier can still drop it. Without either it
+        stays in memory, over the budget if need be.
+        """
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+            if key in self._disk:
+                return
+        if self.disk_dir or self._spool_directory():
+            self._write_disk(key, entry)
+        else:
+            with self._lock:
+                self._store_memory(key, entry)
+
+    def unpin(self, key):
+        with self._lock:
+            count = self._pins.pop(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+
+    def _spool_directory(self):
+        with self._lock:
+            if self._directory is None and self.spool:
+                self._directory = tempfile.mkdtemp(prefix='pdfbookmark-results-')
+                atexit.register(shutil.rmtree, self._directory, ignore_errors=True)
+            return self._directory
+
+    def _store_memory(self, key, entry):
+        size = len(entry[0])
+        # Very large results would flush everything else; leave them to disk
+        if size > self.memory_budget // 4 and key not in self._pins:
+            return False
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[0])
+        self._memory[key] = entry
+        self._memory_bytes += size
+        for old_key in list(self._memory):
+            if self._memory_bytes <= self.memory_budget:
+                break
+            if old_key in self._pins and old_key not in self._disk:
+                continue  # pinned with no disk copy
+            self._memory_bytes -= len(self._memory.pop(old_key)[0])
+        return True
+
+    def _read_disk(self, key):
+        pdf_path, meta_path = self._paths(key)
+        try:
+            with open(pdf_path, 'rb') as f:
+                data = f.read()
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            return data, meta
+        except (OSError, ValueError):
+            with self._lock:
+                size = self._disk.pop(key, None)
+                if size is not None:
+                    self._disk_bytes -= size
+            return None
+
+    def _write_disk(self, key, entry):
+        data, meta = entry
+        pdf_path, meta_path = self._paths(key)
+        try:
+            # Write to a temp name and rename so readers never see partial files
+            fd, tmp_path = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, pdf_path)
+        except OSError as e:
+            logger.warning("⚠️ Could not write result cache entry %s: %s", key, e)
+            return
+        self._index_disk(key, len(data))
+
+    def _index_disk(self, key, size):
+        """Account for a new disk entry and evict the oldest beyond the budget"""
+        evict = []
+        with self._lock:
+            previous = self._disk.pop(key, None)
+            if previous is not None:
+                self._disk_bytes -= previous
+            self._disk[key] = size
+            self._disk_bytes += size
+            for old_key in list(self._disk):
+                if self._disk_bytes <= self.disk_budget:
+                    break
+                if old_key == key or old_key in self._pins:
+                    continue
+                self._disk_bytes -= self._disk.pop(old_key)
+                evict.append(old_key)
+        for old_key in evict:
+            for path in self._paths(old_key):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        """Counters and sizes for /health"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'pinned': len(self._pins),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the process-wide result cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache.from_env()
+        return _cache
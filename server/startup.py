@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Startup timing and background preloading
+On an autoscaled deployment every cold start delays the requests that
+triggered it, so the server listens before PyMuPDF is imported or any
+worker process exists. Once it is ready, a background thread imports the
+PDF libraries and starts the worker pool, so the first PDF request does
+not pay for that either. Times are measured from process start.
+
+Environment:
+    PDF_PRELOAD  1 (default) to preload after startup, 0 to load on first use
+"""
+
+import os
+import threading
+import time
+
+from lazy_import import loaded_modules, preload
+from metrics import REGISTRY
+from structured_log import get_logger
+
+logger = get_logger('startup')
+
+PRELOAD = os.environ.get('PDF_PRELOAD', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+STARTUP_SECONDS = REGISTRY.histogram(
+    'pdfbookmark_startup_seconds', 'Seconds from process start to each startup phase',
+    (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60), ('phase',))
+
+_imported_at = time.monotonic()
+
+
+def process_age():
+    """Seconds since this process started
+
+    Read from /proc on Linux, so interpreter startup and imports are
+    included; elsewhere counted from the import of this module.
+    """
+    try:
+        with open('/proc/self/stat') as f:
+            # The command name may contain spaces; the fields after it are fixed
+            started_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return max(0.0, uptime - started_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return time.monotonic() - _imported_at
+
+
+class Startup:
+    """Startup phases of this process and the background preload"""
+
+    def __init__(self, preload_enabled=PRELOAD):
+        self.preload_enabled = preload_enabled
+        self.phases = {}
+        self.preloaded = threading.Event()
+        self.preload_seconds = {}
+        self.preload_error = None
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        """Record the process age at ``phase``; returns it"""
+        seconds = process_age()
+        with self._lock:
+            self.phases[phase] = seconds
+        STARTUP_SECONDS.observe(seconds, phase)
+        return seconds
+
+    def ready(self, pool, modules=(), worker_modules=()):
+        """Record time-to-ready and start the background preload
+
+        ``modules`` are imported in this process and ``worker_modules`` in
+        every worker process of ``pool``.
+        """
+        seconds = self.mark('ready')
+        logger.info("⏱️ Ready in %.2f s after process start", seconds)
+        if not self.preload_enabled:
+            self.preloaded.set()
+            return
+        modules, worker_modules = tuple(dict.fromkeys(modules)), tuple(dict.fromkeys(worker_modules))
+        threading.Thread(target=self._preload, args=(pool, modules, worker_modules),
+                         name='startup-preload', daemon=True).start()
+
+    def _preload(self, pool, modules, worker_modules):
+        started = time.perf_counter()
+        try:
+            self.preload_seconds = {name: round(seconds, 3) for name, seconds in preload(modules).items()}
+            futures = pool.warm_up(worker_modules)
+            for future in futures:
+                future.result()
+            seconds = self.mark('preloaded')
+            logger.info("🔥 Preloaded %s and %d worker(s) in %.2f s (%.2f s after process start)",
+                        ', '.join(modules) or 'nothing', len(futures), time.perf_counter() - started, seconds)
+        except Exception as e:
+            # The libraries are imported on first use instead
+            self.preload_error = str(e)
+            logger.warning("⚠️ Preload failed: %s", e)
+        finally:
+            self.preloaded.set()
+
+    def wait(self, timeout=None):
+        """Block until the preload has finished; False on timeout"""
+        return self.preloaded.wait(timeout)
+
+    def stats(self):
+        """Startup phases and preload state, for /health"""
+        with self._lock:
+            phases = {phase: round(seconds, 3) for phase, seconds in self.phases.items()}
+        return {'seconds': phases, 'preload': self.preload_enabled, 'preloaded': self.preloaded.is_set(),
+                'preload_seconds': self.preload_seconds, 'preload_error': self.preload_error,
+                'loaded_modules': loaded_modules()}
+
+
+_startup = None
+_startup_lock = threading.Lock()
+
+
+def get_startup():
+    """Return the process-wide startup record, creating it on first use"""
+    global _startup
+    with _startup_lock:
+        if _startup is None:
+            _startup = Startup()
+        return _startup
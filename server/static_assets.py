@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+In-memory static asset cache
+Files are read once (and again only when their mtime changes), with
+gzip/brotli variants, ETag and Last-Modified computed up front
+"""
+
+import gzip
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+from structured_log import get_logger
+
+logger = get_logger('static')
+
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json')
+# Vite puts a content hash in every file name under dist/assets
+IMMUTABLE_PREFIXES = ('dist/assets/',)
+
+
+class StaticAsset:
+    """One file with its precomputed validators and encoded variants"""
+
+    def __init__(self, path, content_type, mtime, size, data=None):
+        self.path = path
+        self.content_type = content_type
+        self.mtime = mtime
+        self.size = size
+        self.data = data
+        self.variants = {}
+        self.last_modified = formatdate(mtime, usegmt=True)
+        if data is not None:
+            self.etag = '"' + hashlib.sha256(data).hexdigest()[:32] + '"'
+        else:
+            # Large files are not read into memory; validate by size + mtime
+            self.etag = f'"{int(mtime * 1000):x}-{size:x}"'
+        self.checked_at = time.monotonic()
+
+    def body(self, accept_encoding):
+        """Pick the best (encoding, bytes) pair for an Accept-Encoding header"""
+        accepted = {token.split(';')[0].strip() for token in (accept_encoding or '').split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return encoding, self.variants[encoding]
+        return None, self.data
+
+    def is_modified(self, if_none_match, if_modified_since):
+        """False if the client's validators show its copy is current"""
+        if if_none_match:
+            candidates = [tag.strip() for tag in if_none_match.split(',')]
+            return not ('*' in candidates or self.etag in candidates or f'W/{self.etag}' in candidates)
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return True
+            return int(self.mtime) > since
+        return True
+
+
+class StaticAssetCache:
+    """Serves files below ``root`` from memory, reloading on mtime change
+
+    Files larger than ``memory_limit`` stay on disk and are sent with
+    sendfile. mtimes are re-checked at most every ``check_interval``
+    seconds per asset.
+    """
+
+    def __init__(self, root, memory_limit=1024 * 1024, check_interval=1.0, compress_min=512):
+        self.root = os.path.realpath(root)
+        self.memory_limit = memory_limit
+        self.check_interval = check_interval
+        self.compress_min = compress_min
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Configure from STATIC_ROOT (default: working directory) and STATIC_MEMORY_LIMIT"""
+        return cls(
+            os.environ.get('STATIC_ROOT') or os.getcwd(),
+            memory_limit=int(os.environ.get('STATIC_MEMORY_LIMIT', 1024 * 1024)),
+        )
+
+    def resolve(self, relative_path):
+        """Absolute path for a request path, or None if it escapes the root"""
+        full_path = os.path.realpath(os.path.join(self.root, relative_path))
+        if full_path != self.root and not full_path.startswith(self.root + os.sep):
+            return None
+        return full_path
+
+    def cache_control(self, relative_path):
+        if relative_path.startswith(IMMUTABLE_PREFIXES):
+            return 'public, max-age=31536000, immutable'
+        return 'no-cache'
+
+    def get(self, relative_path, content_type):
+        """Return the StaticAsset for a path, loading or refreshing it as needed"""
+        asset = self._assets.get(relative_path)
+        now = time.monotonic()
+        if asset is not None and now - asset.checked_at < self.check_interval:
+            return asset
+
+        full_path = self.resolve(relative_path)
+        if full_path is None:
+            return None
+        try:
+            stat = os.stat(full_path)
+        except OSError:
+            with self._lock:
+                self._assets.pop(relative_path, None)
+            return None
+
+        if asset is not None and asset.mtime == stat.st_mtime and asset.size == stat.st_size:
+            asset.checked_at = now
+            return asset
+
+        asset = self._load(full_path, content_type, stat)
+        with self._lock:
+            self._assets[relative_path] = asset
+        return asset
+
+    def _load(self, full_path, content_type, stat):
+        if stat.st_size > self.memory_limit:
+            return StaticAsset(full_path, content_type, stat.st_mtime, stat.st_size)
+
+        with open(full_path, 'rb') as f:
+            data = f.read()
+        asset = StaticAsset(full_path, content_type, stat.st_mtime, len(data), data)
+        if content_type.startswith(COMPRESSIBLE_TYPES) and len(data) >= self.compress_min:
+            gzipped = gzip.compress(data, compresslevel=9, mtime=0)
+            if len(gzipped) < len(data):
+                asset.variants['gzip'] = gzipped
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=11)
+                if len(compressed) < len(data):
+                    asset.variants['br'] = compressed
+        logger.debug("📦 Cached static asset %s: %d bytes, variants: %s",
+                     os.path.relpath(full_path, self.root), len(data), ', '.join(asset.variants) or 'none')
+        return asset
+
+    def preload(self, paths):
+        """Load {relative_path: content_type} up front so first requests are fast"""
+        for relative_path, content_type in paths.items():
+            self.get(relative_path, content_type)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_static_cache():
+    """Return the process-wide static asset cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = StaticAssetCache.from_env()
+        return _cache
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Leveled, non-blocking logging for the bookmark servers
+Request threads only put records on a queue; a listener thread does the
+formatting and the stdout I/O.
+
+Environment:
+    LOG_LEVEL        DEBUG, INFO (default), WARNING or ERROR
+    LOG_FORMAT       text (default) or json
+    LOG_SAMPLE_RATE  fraction of sampled debug lines to keep (default 0.01)
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime
+
+ROOT_LOGGER = 'pdfbookmark'
+
+# Pass as extra= on high-volume lines (per part, per bookmark) to sample them
+SAMPLED = {'sampled': True}
+
+_setup_lock = threading.RLock()
+_listener = None
+_listener_pid = None
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only every Nth record that is marked as sampled"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.every = max(1, round(1 / rate)) if rate > 0 else 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, 'sampled', False):
+            return True
+        if self.every == 0:
+            return False
+        with self._lock:
+            self._count += 1
+            keep = self._count % self.every == 1 or self.every == 1
+        if keep and self.every > 1:
+            record.msg = f"{record.msg} (1 in {self.every})"
+        return keep
+
+
+class TextFormatter(logging.Formatter):
+    """[time] LEVEL message key=value ..."""
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S")
+        line = f"[{timestamp}] {record.levelname:<7} {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line for log pipelines"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _ProcessQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that restarts its listener after a fork"""
+
+    def emit(self, record):
+        if _listener_pid != os.getpid():
+            _start_listener(self.queue)
+        super().emit(record)
+
+
+def _start_listener(log_queue):
+    global _listener, _listener_pid
+    with _setup_lock:
+        if _listener_pid == os.getpid():
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        if os.environ.get('LOG_FORMAT', 'text').lower() == 'json':
+            stream.setFormatter(JSONFormatter())
+        else:
+            stream.setFormatter(TextFormatter())
+        _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def _stop_listener():
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+
+def setup_logging(level=None):
+    """Configure the pdfbookmark logger tree once per process"""
+    root = logging.getLogger(ROOT_LOGGER)
+    if level is None:
+        level = os.environ.get('LOG_LEVEL', 'INFO')
+    with _setup_lock:
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        if any(isinstance(handler, _ProcessQueueHandler) for handler in root.handlers):
+            return root
+
+        log_queue = queue.SimpleQueue()  # unbounded: put() never blocks a request
+        handler = _ProcessQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter(float(os.environ.get('LOG_SAMPLE_RATE', 0.01))))
+        root.addHandler(handler)
+        root.propagate = False
+        _start_listener(log_queue)
+        atexit.register(_stop_listener)
+    return root
+
+
+def get_logger(name):
+    """Return a child of the pdfbookmark logger, configuring logging on first use"""
+    if not logging.getLogger(ROOT_LOGGER).handlers:
+        setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Full-text page index for stored documents
+Page text is extracted in the worker pool range by range and added to an
+inverted index (term -> page and word position) as each range arrives, so
+searches can answer from the pages indexed so far. Indexes are cached per
+document hash within a byte budget.
+"""
+
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from admission import get_admission, run_in_job_slots
+from lazy_import import lazy_module
+from structured_log import get_logger
+from worker_pool import get_pool
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+logger = get_logger('text_index')
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Postings pack (page << PAGE_SHIFT) | word position into one 64-bit value
+PAGE_SHIFT = 32
+POSITION_MASK = (1 << PAGE_SHIFT) - 1
+
+
+def tokenize(text):
+    """Case-folded words of a query"""
+    return [match.group().casefold() for match in TOKEN_RE.finditer(text)]
+
+
+def extract_page_texts(pdf_data, start, stop):
+    """Worker entry point: the plain text of pages [start, stop)"""
+    flags = fitz.TEXTFLAGS_TEXT | fitz.TEXT_DEHYPHENATE
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        return [doc[pno].get_text('text', flags=flags) for pno in range(start, min(stop, doc.page_count))]
+    finally:
+        doc.close()
+
+
+class TextIndex:
+    """Inverted index of one document, filled page by page in page order"""
+
+    def __init__(self, page_count):
+        self.page_count = page_count
+        self.texts = []  # page text, index 0 = page 1
+        self.offsets = []  # per page: character offset of each word
+        self.postings = {}  # term -> array('Q') of packed (page, position)
+        self.words = 0
+        self.error = None
+        self.complete = False
+        self.build_seconds = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def indexed_pages(self):
+        return len(self.texts)
+
+    @property
+    def building(self):
+        return not self._done.is_set()
+
+    def add_page(self, text):
+        page = len(self.texts) + 1
+        offsets = array('I')
+        base = page << PAGE_SHIFT
+        postings = self.postings
+        for position, match in enumerate(TOKEN_RE.finditer(text)):
+            offsets.append(match.start())
+            term = match.group().casefold()
+            entries = postings.get(term)
+            if entries is None:
+                entries = postings[term] = array('Q')
+            entries.append(base | position)
+        with self._lock:
+            self.texts.append(text)
+            self.offsets.append(offsets)
+            self.words += len(offsets)
+
+    def finish(self, error=None):
+        self.error = error
+        self.complete = error is None
+        self._done.set()
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for the build to finish; True if it has"""
+        return self._done.wait(timeout)
+
+    def approximate_bytes(self):
+        """Rough memory footprint, for the cache budget"""
+        return (sum(len(text) for text in self.texts) + 12 * self.words + 120 * len(self.postings))
+
+    def search(self, query, limit=20, context=60):
+        """Pages containing every word of query, phrase matches first
+
+        Returns (total_pages, results); each result has the page, the
+        number of hits and a snippet around the first one.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return 0, []
+        with self._lock:
+            indexed = len(self.texts)
+        limit_value = (indexed + 1) << PAGE_SHIFT
+        lists = []
+        for term in terms:
+            entries = self.postings.get(term)
+            if entries is None:
+                return 0, []
+            # While building, ignore words of a page that is still being added
+            lists.append(entries if self.complete else [value for value in entries if value < limit_value])
+
+        # Phrase hits: term i sits at the position right after term i - 1
+        starts = set(lists[0])
+        for offset, entries in enumerate(lists[1:], 1):
+            following = {value - offset for value in entries}
+            starts &= following
+            if not starts:
+                break
+        hits = {}
+        for value in sorted(starts):
+            hits.setdefault(value >> PAGE_SHIFT, []).append(value & POSITION_MASK)
+        phrase_pages = set(hits)
+
+        # Pages with all words, but not as a phrase, rank after phrase matches
+        pages = None
+        for entries in lists:
+            term_pages = {value >> PAGE_SHIFT for value in entries}
+            pages = term_pages if pages is None else pages & term_pages
+        loose = {}
+        if len(terms) > 1:
+            for value in lists[0]:
+                page = value >> PAGE_SHIFT
+                if page in pages and page not in phrase_pages:
+                    loose.setdefault(page, []).append(value & POSITION_MASK)
+
+        ranked = sorted(hits.items(), key=lambda item: (-len(item[1]), item[0]))
+        ranked += sorted(loose.items(), key=lambda item: (-len(item[1]), item[0]))
+        results = []
+        for page, positions in ranked[:limit]:
+            results.append({
+                'page': page,
+                'hits': len(positions),
+                'phrase': len(terms) > 1 and page in phrase_pages,
+                'snippet': self.snippet(page, positions[0], len(terms) if page in phrase_pages else 1, context),
+            })
+        return len(ranked), results
+
+    def snippet(self, page, position, length, context):
+        """Text around words [position, position + length) of a page, whitespace collapsed"""
+        text = self.texts[page - 1]
+        offsets = self.offsets[page - 1]
+        start = offsets[position]
+        last = offsets[min(position + length, len(offsets)) - 1]
+        match = TOKEN_RE.match(text, last)
+        end = match.end() if match else last
+        before = ' '.join(text[max(0, start - context):start].split())
+        found = ' '.join(text[start:end].split())
+        after = ' '.join(text[end:end + context].split())
+        prefix = '…' if start > context else ''
+        suffix = '…' if end + context < len(text) else ''
+        return {'text': f"{prefix}{before} {found} {after}{suffix}".strip(),
+                'match': found}
+
+
+class TextIndexCache:
+    """Per-document text indexes built in the worker pool, LRU within a byte budget
+
+    A build extracts ``pages_per_task`` pages per pool task with at most
+    one task per worker in flight, each holding an admission job slot.
+    """
+
+    def __init__(self, pool, admission=None, budget=256 * 1024 * 1024, pages_per_task=50):
+        self.pool = pool
+        self.admission = admission
+        self.budget = budget
+        self.pages_per_task = max(1, pages_per_task)
+        self.hits = 0
+        self.misses = 0
+        self._indexes = OrderedDict()  # document digest -> TextIndex
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, pool, admission=None):
+        """Configure from TEXT_INDEX_BYTES and TEXT_INDEX_PAGES_PER_TASK"""
+        return cls(
+            pool, admission,
+            budget=int(os.environ.get('TEXT_INDEX_BYTES', 256 * 1024 * 1024)),
+            pages_per_task=int(os.environ.get('TEXT_INDEX_PAGES_PER_TASK', 50)),
+        )
+
+    def get(self, digest, page_count, load_pdf):
+        """Return the index for a document, starting its build on first use
+
+        ``load_pdf`` is only called when the index has to be built.
+        """
+        with self._lock:
+            index = self._indexes.get(digest)
+            if index is not None and index.error is None:
+                self._indexes.move_to_end(digest)
+                self.hits += 1
+                return index
+            index = TextIndex(page_count)
+            self._indexes[digest] = index
+            self.misses += 1
+        threading.Thread(target=self._build, args=(digest, index, load_pdf),
+                         name=f"text-index-{digest[:8]}", daemon=True).start()
+        return index
+
+    def _build(self, digest, index, load_pdf):
+        started = time.perf_counter()
+        try:
+            pdf_data = load_pdf()
+            ranges = [(pdf_data, start, min(start + self.pages_per_task, index.page_count))
+                      for start in range(0, index.page_count, self.pages_per_task)]
+
+            def add_pages(texts):
+                for text in texts:
+                    index.add_page(text)
+
+            # One job slot per range in flight; ranges are added in page order as they arrive
+            run_in_job_slots(self.admission, self.pool, extract_page_texts, ranges, wait_when_full=True,
+                             max_in_flight=max(1, self.pool.max_workers), on_result=add_pages)
+            index.build_seconds = time.perf_counter() - started
+            index.finish()
+            logger.debug("🔎 Indexed %s: %d pages, %d words, %d terms in %.2fs", digest[:12],
+                         index.page_count, index.words, len(index.postings), index.build_seconds)
+        except Exception as e:
+            logger.warning("❌ Text index for %s failed: %s", digest[:12], e)
+            index.finish(str(e))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            sizes = {digest: index.approximate_bytes() for digest, index in self._indexes.items()}
+            total = sum(sizes.values())
+            for digest in list(self._indexes):
+                if total <= self.budget or len(self._indexes) == 1:
+                    break
+                if self._indexes[digest].building:
+                    continue  # still building
+                total -= sizes[digest]
+                del self._indexes[digest]
+
+    def remove(self, digest):
+        with self._lock:
+            self._indexes.pop(digest, None)
+
+    def stats(self):
+        """Counts and sizes for /health"""
+        with self._lock:
+            return {
+                'indexes': len(self._indexes),
+                'bytes': sum(index.approximate_bytes() for index in self._indexes.values()),
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_text_index_cache():
+    """Return the process-wide text index cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TextIndexCache.from_env(get_pool(), get_admission())
+        return _cache
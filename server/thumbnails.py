@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Page thumbnails for stored documents
+Pages are rendered at a low DPI in the worker pool only when they are
+first asked for, and kept per document hash, page, DPI and format in a
+byte-bounded LRU cache, so a viewer can fetch navigation images instead
+of rendering every page itself.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from admission import get_admission, run_in_job_slots
+from lazy_import import lazy_module
+from structured_log import get_logger
+from worker_pool import get_pool
+
+fitz = lazy_module('fitz')  # PyMuPDF, imported on first use
+logger = get_logger('thumbnails')
+
+THUMBNAIL_FORMATS = {'jpeg': 'image/jpeg', 'png': 'image/png'}
+DEFAULT_THUMBNAIL_DPI = int(os.environ.get('THUMBNAIL_DPI', 36))
+MIN_THUMBNAIL_DPI = 8
+MAX_THUMBNAIL_DPI = 96
+MAX_THUMBNAIL_BATCH = 50
+JPEG_QUALITY = 70
+
+
+def normalize_thumbnail_dpi(value):
+    """Validate a requested DPI, falling back to THUMBNAIL_DPI"""
+    if value in (None, ''):
+        return DEFAULT_THUMBNAIL_DPI
+    try:
+        dpi = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid thumbnail dpi '{value}'")
+    if not MIN_THUMBNAIL_DPI <= dpi <= MAX_THUMBNAIL_DPI:
+        raise ValueError(f"Thumbnail dpi must be between {MIN_THUMBNAIL_DPI} and {MAX_THUMBNAIL_DPI}")
+    return dpi
+
+
+def normalize_thumbnail_format(value):
+    """Validate an image format (jpeg by default)"""
+    image_format = (value or 'jpeg').strip().lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in THUMBNAIL_FORMATS:
+        raise ValueError(f"Unknown thumbnail format '{value}' (expected one of {', '.join(THUMBNAIL_FORMATS)})")
+    return image_format
+
+
+def parse_page_ranges(spec, page_count, limit=MAX_THUMBNAIL_BATCH):
+    """Page numbers from '3', '1-20' or '1,4,10-12' (1-based, in order, no duplicates)"""
+    pages = []
+    seen = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise ValueError(f"Invalid page range '{part}'")
+        if first > last or first < 1 or last > page_count:
+            raise ValueError(f"Page range '{part}' is outside 1-{page_count}")
+        for page in range(first, last + 1):
+            if page not in seen:
+                seen.add(page)
+                pages.append(page)
+        if len(pages) > limit:
+            raise ValueError(f"At most {limit} thumbnails per request")
+    if not pages:
+        raise ValueError("No pages requested")
+    return pages
+
+
+def render_thumbnails(pdf_data, pages, dpi, image_format):
+    """Worker entry point: (image bytes, width, height) for each 1-based page"""
+    doc = fitz.open(stream=pdf_data, filetype="pdf")
+    try:
+        images = []
+        for page in pages:
+            pixmap = doc[page - 1].get_pixmap(dpi=dpi, alpha=False)
+            if image_format == 'jpeg':
+                data = pixmap.tobytes('jpeg', jpg_quality=JPEG_QUALITY)
+            else:
+                data = pixmap.tobytes('png')
+            images.append((data, pixmap.width, pixmap.height))
+        return images
+    finally:
+        doc.close()
+
+
+def thumbnail_etag(digest, pages, dpi, image_format):
+    """ETag of one thumbnail or a batch; the document hash makes it stable across restarts"""
+    if len(pages) == 1:
+        span = str(pages[0])
+    elif pages == list(range(pages[0], pages[-1] + 1)):
+        span = f"{pages[0]}-{pages[-1]}"
+    else:
+        span = '.'.join(str(page) for page in pages)
+    return f'"t-{digest[:24]}-{span}-{dpi}-{image_format}"'
+
+
+class ThumbnailCache:
+    """Rendered thumbnails keyed by (document hash, page, dpi, format), LRU within a byte budget
+
+    Pages missing from the cache are rendered ``pages_per_task`` at a time
+    in the pool, each chunk in flight holding an admission job slot. A
+    page that another request is already rendering is waited for rather
+    than rendered twice.
+    """
+
+    def __init__(self, pool, admission=None, budget=64 * 1024 * 1024, pages_per_task=8):
+        self.pool = pool
+        self.admission = admission
+        self.budget = budget
+        self.pages_per_task = max(1, pages_per_task)
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._images = OrderedDict()  # key -> (data, width, height)
+        self._rendering = {}  # key -> Future of (data, width, height)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, pool, admission=None):
+        """Configure from THUMBNAIL_CACHE_BYTES and THUMBNAIL_PAGES_PER_TASK"""
+        return cls(
+            pool, admission,
+            budget=int(os.environ.get('THUMBNAIL_CACHE_BYTES', 64 * 1024 * 1024)),
+            pages_per_task=int(os.environ.get('THUMBNAIL_PAGES_PER_TASK', 8)),
+        )
+
+    def get(self, digest, pages, dpi, image_format, load_pdf):
+        """Return {page: (data, width, height)}, rendering only the pages not cached
+
+        ``load_pdf`` is only called when something has to be rendered.
+        Raises AdmissionRejected if the job queue is full.
+        """
+        found = {}
+        waiting = {}
+        missing = []
+        with self._lock:
+            for page in pages:
+                key = (digest, page, dpi, image_format)
+                image = self._images.get(key)
+                if image is not None:
+                    self._images.move_to_end(key)
+                    found[page] = image
+                elif key in self._rendering:
+                    waiting[page] = self._rendering[key]
+                else:
+                    missing.append(page)
+                    self._rendering[key] = waiting[page] = Future()
+            self.hits += len(pages) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            self._render(digest, missing, dpi, image_format, load_pdf)
+        for page, future in waiting.items():
+            found[page] = future.result()
+        return found
+
+    def _render(self, digest, pages, dpi, image_format, load_pdf):
+        keys = [(digest, page, dpi, image_format) for page in pages]
+        try:
+            started = time.perf_counter()
+            pdf_data = load_pdf()
+            chunks = [(pdf_data, pages[start:start + self.pages_per_task], dpi, image_format)
+                      for start in range(0, len(pages), self.pages_per_task)]
+            # One job slot per chunk in flight
+            rendered = run_in_job_slots(self.admission, self.pool, render_thumbnails, chunks)
+            images = [image for chunk in rendered for image in chunk]
+        except BaseException as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. MuPDF crashed); start a fresh pool for the next request
+                self.pool.reset()
+            with self._lock:
+                futures = [self._rendering.pop(key) for key in keys]
+            for future in futures:
+                future.set_exception(e)
+            raise
+        logger.debug("🖼️ Rendered %d thumbnail(s) of %s at %d dpi in %.3fs",
+                     len(pages), digest[:12], dpi, time.perf_counter() - started)
+
+        with self._lock:
+            futures = []
+            for key, image in zip(keys, images):
+                futures.append(self._rendering.pop(key))
+                self._images[key] = image
+                self.bytes += len(image[0])
+            while self.bytes > self.budget and len(self._images) > 1:
+                _, (data, _, _) = self._images.popitem(last=False)
+                self.bytes -= len(data)
+        for future, image in zip(futures, images):
+            future.set_result(image)
+
+    def remove(self, digest):
+        """Drop every thumbnail of a document"""
+        with self._lock:
+            for key in [key for key in self._images if key[0] == digest]:
+                self.bytes -= len(self._images.pop(key)[0])
+
+    def stats(self):
+        """Counters for /health"""
+        with self._lock:
+            return {
+                'entries': len(self._images),
+                'bytes': self.bytes,
+                'budget': self.budget,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """Return the process-wide thumbnail cache, creating it on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache.from_env(get_pool(), get_admission())
+        return _cache
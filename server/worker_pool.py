@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Process pool for PyMuPDF work
+Keeps PDF parsing off the HTTP threads so one big document can't stall
+/health or static requests
+"""
+
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from structured_log import get_logger
+
+logger = get_logger('pool')
+
+
+def import_modules(names):
+    """Worker entry point: import modules ahead of the first job; returns the worker's PID"""
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass  # reported by the first job that needs it
+    return os.getpid()
+
+
+def pool_size_from_env():
+    """Worker count from PDF_WORKERS, defaulting to the CPU count (0 = inline)"""
+    value = os.environ.get('PDF_WORKERS')
+    if value is not None and value.strip() != '':
+        return max(0, int(value))
+    return os.cpu_count() or 1
+
+
+class EmbeddingPool:
+    """Bounded process pool that runs PDF jobs outside the request threads"""
+
+    def __init__(self, max_workers=None):
+        self.max_workers = pool_size_from_env() if max_workers is None else max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that already runs request threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) and return a Future
+
+        With no workers the call runs inline and an already-completed
+        Future is returned.
+        """
+        if self.max_workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self._get_executor().submit(fn, *args, **kwargs)
+
+    def run(self, fn, *args, **kwargs):
+        """Run fn in a worker process and wait for the result"""
+        if self.max_workers == 0:
+            return fn(*args, **kwargs)
+        try:
+            return self.submit(fn, *args, **kwargs).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. MuPDF crashed); start a fresh pool next time
+            logger.error("❌ Worker process died, restarting pool")
+            self.reset()
+            raise
+
+    def warm_up(self, modules=()):
+        """Start every worker process and import ``modules`` in each
+
+        Returns the futures of the imports; an inline pool has nothing to
+        start and returns none.
+        """
+        if self.max_workers == 0:
+            return []
+        executor = self._get_executor()
+        return [executor.submit(import_modules, tuple(modules)) for _ in range(self.max_workers)]
+
+    def reset(self):
+        """Drop the current executor so the next job starts new workers"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self, wait=True):
+        """Stop all worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide embedding pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EmbeddingPool()
+            logger.info("⚙️ Embedding pool: %s worker(s)", _pool.max_workers or 'inline')
+        return _pool
@@ -1,37 +1,108 @@
 #!/usr/bin/env python3
+"""
+Production entry point: build the frontend if needed, then start the server
+The Vite build is skipped when dist/ was built from the current sources.
+After each build a SHA-256 of the files it reads is stored in
+dist/.build-hash and compared on the next start, so restarts and
+autoscaled instances go straight to the server.
+
+Usage:
+    python start_production.py               build if needed, then serve
+    python start_production.py --build-only  build if needed and exit (image builds)
+
+Environment:
+    PORT                 Listening port (default 8081)
+    SKIP_FRONTEND_BUILD  1 to serve dist/ as it is without checking it
+"""
+import hashlib
 import os
 import sys
 import subprocess
+import time
 from pathlib import Path
 
+ROOT = Path(__file__).parent
+DIST_DIR = ROOT / "dist"
+BUILD_HASH_FILE = DIST_DIR / ".build-hash"
+
+# Everything `vite build` reads; dependency versions are covered by the lock file
+BUILD_INPUTS = ["index.html", "main.js", "style.css", "vite.config.js", "package.json", "package-lock.json"]
+BUILD_INPUT_DIRS = ["src", "public"]
+
+
+def source_hash():
+    """SHA-256 over the paths and contents of the frontend build inputs"""
+    paths = [ROOT / name for name in BUILD_INPUTS]
+    for name in BUILD_INPUT_DIRS:
+        directory = ROOT / name
+        if directory.is_dir():
+            paths.extend(path for path in directory.rglob("*") if path.is_file())
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        if path.is_file():
+            digest.update(path.relative_to(ROOT).as_posix().encode("utf-8") + b"\0")
+            digest.update(path.read_bytes())
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def frontend_is_current(current_hash):
+    """True if dist/ holds a build of the sources with this hash"""
+    try:
+        built_hash = BUILD_HASH_FILE.read_text().strip()
+    except OSError:
+        return False
+    return built_hash == current_hash and (DIST_DIR / "index.html").is_file()
+
+
 def build_frontend():
-    """Build the frontend using Vite"""
+    """Build the frontend using Vite, unless dist/ is already current"""
+    if os.environ.get("SKIP_FRONTEND_BUILD", "").strip().lower() in ("1", "true", "yes", "on"):
+        print("Skipping frontend build (SKIP_FRONTEND_BUILD)")
+        return True
+    current_hash = source_hash()
+    if frontend_is_current(current_hash):
+        print(f"Frontend is up to date ({current_hash[:12]}), skipping build")
+        return True
+
     print("Building frontend...")
-    result = subprocess.run(["npm", "run", "build"], capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Frontend build failed: {result.stderr}")
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(["npm", "run", "build"], cwd=ROOT, capture_output=True, text=True)
+        error = result.stderr if result.returncode != 0 else None
+    except OSError as e:
+        error = f"could not run npm: {e}"
+    if error is not None:
+        if (DIST_DIR / "index.html").is_file():
+            # A stale frontend beats a crash loop; the API does not depend on it
+            print(f"Frontend build failed, serving the existing dist/: {error}")
+            return True
+        print(f"Frontend build failed: {error}")
         return False
-    print("Frontend built successfully!")
+    BUILD_HASH_FILE.write_text(current_hash + "\n")
+    print(f"Frontend built successfully in {time.perf_counter() - started:.1f}s!")
     return True
 
+
 def start_server():
     """Start the Python server"""
     print("Starting Python server...")
     # Add the server directory to Python path
-    server_dir = Path(__file__).parent / "server"
+    server_dir = ROOT / "server"
     sys.path.insert(0, str(server_dir))
-    
-    # Import and run the server
-    from bookmark_server_clean import app, run_server
-    
+
+    # Import and run the server; PyMuPDF is loaded in the background once it listens
+    from bookmark_server_clean import run_server
+
     port = int(os.environ.get("PORT", 8081))
     print(f"Server starting on port {port}")
     run_server(port)
 
+
 if __name__ == "__main__":
     # Build frontend first
-    if build_frontend():
+    if not build_frontend():
+        sys.exit(1)
+    if "--build-only" not in sys.argv[1:]:
         # Then start the server
         start_server()
-    else:
-        sys.exit(1)
@@ -2,14 +2,17 @@
 """
 Debug multipart form data exactly like browser FormData
 """
+import os
 import requests
 import json
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
 def test_browser_like_multipart():
     """Test using exact browser-like multipart encoding"""
     
-    test_pdf = "/Users/xeno/webdev/pdfbookmark/examples/test_6_pages.pdf"
+    test_pdf = os.path.join(REPO_ROOT, 'examples', 'test_6_pages.pdf')
     
     try:
         with open(test_pdf, 'rb') as f:
@@ -42,7 +45,7 @@ def test_browser_like_multipart():
         )
         
         if response.status_code == 200:
-            with open('/Users/xeno/webdev/pdfbookmark/test_browser_like_result.pdf', 'wb') as f:
+            with open(os.path.join(REPO_ROOT, 'test_browser_like_result.pdf'), 'wb') as f:
                 f.write(response.content)
             print("✅ Browser-like test completed - check test_browser_like_result.pdf")
         else:
@@ -3,14 +3,17 @@
 Test script to check custom bookmark functionality
 """
 
+import os
 import requests
 import json
 
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+
 def test_custom_bookmarks():
     """Test sending custom bookmarks to the server"""
     
     # Test with a simple PDF file
-    test_pdf = "/Users/xeno/webdev/pdfbookmark/examples/test_6_pages.pdf"
+    test_pdf = os.path.join(REPO_ROOT, 'examples', 'test_6_pages.pdf')
     
     try:
         with open(test_pdf, 'rb') as f:
@@ -40,7 +43,7 @@ def test_custom_bookmarks():
         
         if response.status_code == 200:
             # Save result
-            with open('/Users/xeno/webdev/pdfbookmark/test_custom_result.pdf', 'wb') as f:
+            with open(os.path.join(REPO_ROOT, 'test_custom_result.pdf'), 'wb') as f:
                 f.write(response.content)
             print("✅ Custom bookmark test completed - check test_custom_result.pdf")
         else: